@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Times the cloudplow hot paths against a synthetic library and the recorded corpora in benchmarks/corpora.
+
+Every case is run --repeat times and summarised as median/min/max milliseconds, results are written as JSON so runs
+can be compared between versions on the same hardware. Usage:
+
+    python3 benchmarks/hotpaths.py --files 100000 --repeat 5 --output hotpaths.json
+    python3 benchmarks/hotpaths.py --tree /mnt/local/Media --only get_size,find_items
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+CORPORA = os.path.join(ROOT, 'benchmarks', 'corpora')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import tree  # noqa: E402
+from utils import path  # noqa: E402
+from utils.cache import Cache  # noqa: E402
+from utils.models import Triggers  # noqa: E402
+from utils.plex import PlexStream  # noqa: E402
+from utils.unionfs import UnionfsHiddenFolder  # noqa: E402
+
+# the rclone_sleeps shipped in config.json.sample
+RCLONE_SLEEPS = {
+    "Failed to copy: googleapi: Error 403: User rate limit exceeded": {"count": 5, "sleep": 25, "timeout": 3600},
+    " 0/s,": {"count": 15, "sleep": 25, "timeout": 140}
+}
+
+
+def measure(func, repeat):
+    runs = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        runs.append((time.perf_counter() - started) * 1000)
+    return {'median_ms': statistics.median(runs), 'min_ms': min(runs), 'max_ms': max(runs), 'runs_ms': runs}, result
+
+
+def corpus_lines(count):
+    with open(os.path.join(CORPORA, 'rclone-upload.log')) as fp:
+        lines = fp.read().splitlines()
+    return [lines[index % len(lines)] for index in range(count)]
+
+
+def plex_sessions(count):
+    with open(os.path.join(CORPORA, 'plex-sessions.json')) as fp:
+        sessions = json.load(fp)['MediaContainer']['Metadata']
+    return [sessions[index % len(sessions)] for index in range(count)]
+
+
+############################################################
+# CASES
+############################################################
+
+def bench_get_size(args, folder):
+    return lambda: path.get_size(folder, ['downloads/*'])
+
+
+def bench_opened_files(args, folder):
+    # hold a handful of files open so lsof has something to report
+    handles = []
+    for current, _, files in os.walk(folder):
+        handles.extend(open(os.path.join(current, name), 'rb') for name in files[:1])
+        if len(handles) >= 16:
+            break
+    args.cleanup.extend(handle.close for handle in handles)
+    return lambda: path.opened_files(folder)
+
+
+def bench_find_items(args, folder):
+    return lambda: path.find_items(folder, '_HIDDEN~')
+
+
+def bench_empty_dirs_find(args, folder):
+    if args.tree:
+        # deletes the empty folders it finds, never run against a real library
+        return None
+    return lambda: path.remove_empty_dirs(folder, 1)
+
+
+def bench_empty_dirs_targeted(args, folder):
+    if args.tree:
+        return None
+    # the folders of one upload in a hundred files, like the uploader collects from rclone's output
+    folders = set()
+    for index, (current, _, files) in enumerate(os.walk(folder)):
+        if files and index % 100 == 0:
+            folders.add(os.path.relpath(current, folder))
+    return lambda: path.remove_empty_parents(folder, folders, 1)
+
+
+def bench_hidden_discovery(args, folder):
+    return lambda: sum(1 for _ in UnionfsHiddenFolder(folder, True, 'rclone', os.devnull).whiteouts())
+
+
+def bench_trigger_matching(args, folder):
+    triggers = Triggers(RCLONE_SLEEPS)
+    lines = corpus_lines(args.log_lines)
+
+    def run():
+        tracker = triggers.tracker()
+        for line in lines:
+            if tracker.check(line):
+                # rclone would have been killed here, carry on like the next upload would
+                tracker = triggers.tracker()
+        return len(lines)
+
+    return run
+
+
+def bench_plex_streams(args, folder):
+    sessions = plex_sessions(args.streams)
+    return lambda: [PlexStream(session) for session in sessions]
+
+
+def bench_cache_writes(args, folder):
+    cache = Cache(os.path.join(args.workdir, 'cache.db'))
+    sa_bans = cache.get_cache('sa_bans')
+    args.cleanup.extend(sa.close for sa in cache.caches.values())
+    accounts = {f'/service_accounts/{index:03d}.json': None for index in range(100)}
+
+    def run():
+        # the same read-modify-write cloudplow does when it bans a service account
+        sa_bans['google'] = dict(accounts)
+        for index in range(args.cache_writes):
+            current = sa_bans['google']
+            current[f'/service_accounts/{index % 100:03d}.json'] = time.time() + 25 * 3600
+            sa_bans['google'] = current
+        return args.cache_writes
+
+    return run
+
+
+CASES = {
+    'get_size': bench_get_size,
+    'opened_files': bench_opened_files,
+    'find_items': bench_find_items,
+    'empty_dirs_find': bench_empty_dirs_find,
+    'empty_dirs_targeted': bench_empty_dirs_targeted,
+    'hidden_discovery': bench_hidden_discovery,
+    'trigger_matching': bench_trigger_matching,
+    'plex_streams': bench_plex_streams,
+    'cache_writes': bench_cache_writes
+}
+
+
+############################################################
+# MAIN
+############################################################
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cloudplow hot paths')
+    parser.add_argument('--tree', help='Benchmark an existing folder instead of generating a synthetic library')
+    parser.add_argument('--files', type=int, default=20000, help='Files in the synthetic library (default: 20000)')
+    parser.add_argument('--depth', type=int, default=5, help='Depth of the synthetic library (default: 5)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per case (default: 5)')
+    parser.add_argument('--log-lines', type=int, default=200000,
+                        help='Rclone output lines replayed through the triggers (default: 200000)')
+    parser.add_argument('--streams', type=int, default=10000, help='Plex sessions parsed per run (default: 10000)')
+    parser.add_argument('--cache-writes', type=int, default=500, help='Cache writes per run (default: 500)')
+    parser.add_argument('--only', help='Comma separated cases to run, one of: ' + ', '.join(CASES))
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    # the code under test logs every trigger hit and every hidden file, keep that out of the timings
+    logging.disable(logging.CRITICAL)
+
+    selected = args.only.split(',') if args.only else list(CASES)
+    unknown = [name for name in selected if name not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+
+    summary = {
+        'benchmark': 'hotpaths',
+        'python': sys.version.split()[0],
+        'revision': git_revision(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'only')},
+        'results': {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix='cloudplow-bench-') as workdir:
+        args.workdir = workdir
+        args.cleanup = []
+        if args.tree:
+            folder = args.tree
+            summary['tree'] = {'folder': folder}
+        else:
+            folder = os.path.join(workdir, 'library')
+            print(f"Generating {args.files} files in {folder}...")
+            summary['tree'] = tree.generate(folder, args.files, args.depth)
+
+        try:
+            for name in selected:
+                bench = CASES[name](args, folder)
+                if bench is None:
+                    print(f"{name:>19}: skipped")
+                    continue
+                timings, result = measure(bench, args.repeat)
+                if isinstance(result, (list, tuple)):
+                    timings['items'] = len(result)
+                elif result is not None:
+                    timings['items'] = result
+                summary['results'][name] = timings
+                print(f"{name:>19}: median {timings['median_ms']:10.2f} ms  "
+                      f"min {timings['min_ms']:10.2f} ms  max {timings['max_ms']:10.2f} ms")
+        finally:
+            for cleanup in args.cleanup:
+                cleanup()
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(summary, fp, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Runs several local processes as cloudplow hosts sharing one pool of service accounts through utils/leases.py.
+
+Every host keeps picking the least used account, "uploads" with it for a moment and publishes the bytes, banning the
+account once it reaches its daily quota. Afterwards the upload intervals of all hosts are checked for two hosts using
+the same account at the same time. --no-leases runs the hosts the way they worked before, each walking the accounts
+in the same order, for comparison. Usage:
+
+    python3 benchmarks/leases.py --hosts 4 --accounts 6 --seconds 10
+    python3 benchmarks/leases.py --store /mnt/shared/cloudplow-leases.db --hosts 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.leases import AccountLeases  # noqa: E402
+
+# simulated upload speed of a host, and how long one upload runs before the host picks an account again
+RATE = 100 * 1024 ** 2
+UPLOAD_SECONDS = (0.05, 0.2)
+
+
+def host(number, args, results):
+    accounts = [f'/hosts/{number}/service_accounts/sa{index:02d}.json' for index in range(args.accounts)]
+    quota = args.quota_mb * 1024 ** 2
+    leases = AccountLeases(args.store, holder=f'host{number}', ttl=args.ttl)
+    intervals, skipped, uploaded = [], 0, 0
+    deadline = time.time() + args.seconds
+    rng = random.Random(number)
+
+    while time.time() < deadline:
+        bans = leases.merge_bans({account: None for account in accounts})
+        available = [account for account in accounts if bans[account] is None]
+        if not available:
+            # every account is used up, like a suspended uploader
+            time.sleep(0.05)
+            continue
+
+        account = None
+        for candidate in (leases.order(available) if args.leases else available):
+            if not args.leases or leases.acquire(candidate):
+                account = candidate
+                break
+            skipped += 1
+        if account is None:
+            time.sleep(0.01)
+            continue
+
+        start = time.time()
+        time.sleep(rng.uniform(*UPLOAD_SECONDS))
+        end = time.time()
+        size = int((end - start) * RATE)
+        leases.add_usage(account, size)
+        uploaded += size
+        intervals.append((os.path.basename(account), start, end))
+        if leases.usage().get(os.path.basename(account), 0) >= quota:
+            leases.ban(account, time.time() + 3600, 'quota')
+        if args.leases:
+            leases.release(account)
+
+    leases.close()
+    results.put({'host': number, 'intervals': intervals, 'skipped': skipped, 'uploaded': uploaded})
+
+
+def collisions(reports):
+    """ pairs of uploads by different hosts that used the same account at the same time """
+    uploads = sorted((account, start, end, report['host']) for report in reports
+                     for account, start, end in report['intervals'])
+    found = 0
+    for index, (account, start, end, number) in enumerate(uploads):
+        for other_account, other_start, _, other_number in uploads[index + 1:]:
+            if other_account != account or other_start >= end:
+                break
+            if other_number != number:
+                found += 1
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check service account leases with several local hosts')
+    parser.add_argument('--hosts', type=int, default=4, help='Processes acting as hosts (default: 4)')
+    parser.add_argument('--accounts', type=int, default=6, help='Service accounts in the pool (default: 6)')
+    parser.add_argument('--seconds', type=float, default=10, help='How long the hosts upload (default: 10)')
+    parser.add_argument('--quota-mb', type=int, default=2000, help='Daily quota of an account (default: 2000)')
+    parser.add_argument('--ttl', type=float, default=5, help='Lease ttl in seconds (default: 5)')
+    parser.add_argument('--store', help='Lease database to use, a temporary one by default')
+    parser.add_argument('--no-leases', dest='leases', action='store_false',
+                        help='Pick accounts without leases, like hosts did before')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='cloudplow-leases-') as folder:
+        if not args.store:
+            args.store = os.path.join(folder, 'leases.db')
+        # created once up front, the hosts only ever open it
+        AccountLeases(args.store).close()
+
+        results = multiprocessing.Queue()
+        hosts = [multiprocessing.Process(target=host, args=(number, args, results)) for number in range(args.hosts)]
+        for process in hosts:
+            process.start()
+        reports = [results.get() for _ in hosts]
+        for process in hosts:
+            process.join()
+
+    uploads = sum(len(report['intervals']) for report in reports)
+    summary = {
+        'benchmark': 'leases',
+        'python': sys.version.split()[0],
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'store')},
+        'uploads': uploads,
+        'collisions': collisions(reports),
+        'skipped_leased': sum(report['skipped'] for report in reports),
+        'uploaded_gb': round(sum(report['uploaded'] for report in reports) / 1024 ** 3, 2),
+        'accounts_used': len({account for report in reports for account, _, _ in report['intervals']})
+    }
+
+    print(json.dumps({key: value for key, value in summary.items() if key not in ('parameters', 'python')}, indent=4))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(summary, fp, indent=4)
+    if args.leases and summary['collisions']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
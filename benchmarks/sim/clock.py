@@ -0,0 +1,100 @@
+"""
+Accelerated clock shared by the simulation harness, cloudplow and the fake rclone.
+
+Every process derives the simulated time from the same three numbers, passed on through the environment:
+
+    simulated = epoch + (wall clock - started) * scale
+
+so a cloudplow started by the harness and the rclone processes it spawns agree on the time without talking.
+"""
+import datetime
+import functools
+import os
+import threading
+import time
+
+ENV = 'CLOUDPLOW_SIM_CLOCK'
+
+_real_time = time.time
+_real_sleep = time.sleep
+_real_localtime = time.localtime
+_real_gmtime = time.gmtime
+_real_strftime = time.strftime
+_real_ctime = time.ctime
+_real_event_wait = threading.Event.wait
+
+
+class SimClock:
+    def __init__(self, scale=1.0, epoch=None, started=None):
+        self.scale = float(scale)
+        self.started = _real_time() if started is None else float(started)
+        self.epoch = self.started if epoch is None else float(epoch)
+
+    @classmethod
+    def from_env(cls, environ=None):
+        value = (environ or os.environ).get(ENV)
+        if not value:
+            return None
+        started, epoch, scale = value.split(':')
+        return cls(scale, epoch, started)
+
+    def environ(self):
+        return {ENV: f'{self.started!r}:{self.epoch!r}:{self.scale!r}'}
+
+    def now(self):
+        return self.epoch + (_real_time() - self.started) * self.scale
+
+    def elapsed(self):
+        return self.now() - self.epoch
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _real_sleep(seconds / self.scale)
+
+    def real_seconds(self, seconds):
+        return seconds / self.scale
+
+
+def _at(func, clock, secs=None):
+    return func(clock.now() if secs is None else secs)
+
+
+def _strftime(clock, fmt, t=None):
+    return _real_strftime(fmt, _real_localtime(clock.now()) if t is None else t)
+
+
+def install(clock):
+    """ make time.*, datetime.*.now() and threading.Event.wait() in this process follow the simulated clock """
+
+    class SimDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls.fromtimestamp(clock.now(), tz)
+
+        @classmethod
+        def utcnow(cls):
+            return cls.utcfromtimestamp(clock.now())
+
+        @classmethod
+        def today(cls):
+            return cls.fromtimestamp(clock.now())
+
+    class SimDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return cls.fromtimestamp(clock.now())
+
+    # partials rather than lambdas, logging.Formatter keeps time.localtime as a class attribute and a function
+    # stored there would be bound as a method
+    time.time = functools.partial(SimClock.now, clock)
+    time.sleep = functools.partial(SimClock.sleep, clock)
+    time.localtime = functools.partial(_at, _real_localtime, clock)
+    time.gmtime = functools.partial(_at, _real_gmtime, clock)
+    time.ctime = functools.partial(_at, _real_ctime, clock)
+    time.strftime = functools.partial(_strftime, clock)
+    datetime.datetime = SimDatetime
+    datetime.date = SimDate
+    # polling threads wait on events between rounds, queue timeouts are left on the wall clock
+    threading.Event.wait = lambda event, timeout=None: _real_event_wait(
+        event, None if timeout is None else clock.real_seconds(timeout))
+    return clock
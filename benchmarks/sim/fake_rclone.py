@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the rclone binary used by the simulation harness.
+
+`move`/`copy` walk the source folder and "upload" it at the simulated link speed, charging every byte to the daily
+quota of the service account found in the environment. Once that quota is gone it prints the googleapi 403 errors
+Google Drive returns, and exits with code 7 when --drive-stop-on-upload-limit was given. Stats are printed in rclone's
+format every --stats interval and, with --rc-addr, rc/noop, core/stats and core/bwlimit are served like rclone does.
+Everything runs on the simulated clock, see clock.py.
+"""
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from sim.clock import SimClock  # noqa: E402
+from sim.world import World  # noqa: E402
+
+UNITS = {'': 1024, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+QUOTA_ERROR = 'Failed to copy: googleapi: Error 403: User rate limit exceeded., userRateLimitExceeded'
+
+
+def size_to_bytes(value):
+    if value is None or str(value).lower() == 'off':
+        return None
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([BKMGT]?)', str(value).upper())
+    return int(float(match.group(1)) * UNITS[match.group(2)]) if match else None
+
+
+def duration_to_seconds(value):
+    total = 0.0
+    for amount, unit in re.findall(r'(\d+(?:\.\d+)?)(h|ms|m|s)', value or ''):
+        total += float(amount) * {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}[unit]
+    return total or 60.0
+
+
+def human(num_bytes):
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if num_bytes < 1024 or unit == 'TiB':
+            return f'{num_bytes:.3f} {unit}' if unit != 'B' else f'{int(num_bytes)} B'
+        num_bytes /= 1024
+
+
+def parse_args(argv):
+    positional, flags = [], {}
+    for arg in argv:
+        if arg.startswith('--'):
+            key, _, value = arg.partition('=')
+            flags.setdefault(key, []).append(value if _ else None)
+        else:
+            positional.append(arg)
+    return positional, flags
+
+
+############################################################
+# RC
+############################################################
+
+def serve_rc(addr, upload):
+    # only uploads serve rc, keep the http server off the start-up of every other command
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class RcHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            endpoint = self.path.strip('/')
+
+            if endpoint == 'rc/noop':
+                body = payload
+            elif endpoint == 'core/stats':
+                body = upload.stats()
+            elif endpoint == 'core/bwlimit':
+                if 'rate' in payload:
+                    upload.bwlimit = size_to_bytes(payload['rate'])
+                body = {'rate': 'off' if upload.bwlimit is None else f'{upload.bwlimit // 1024}K',
+                        'bytesPerSecond': -1 if upload.bwlimit is None else upload.bwlimit}
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            request, _ = super().get_request()
+            return request, ('local', 0)
+
+    if addr.startswith('unix://'):
+        server = UnixHTTPServer(addr[len('unix://'):], RcHandler)
+    else:
+        host, port = addr.rsplit(':', 1)
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), RcHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+############################################################
+# UPLOAD
+############################################################
+
+class Upload:
+    def __init__(self, clock, world, source, flags):
+        self.clock = clock
+        self.world = world
+        self.source = source
+        self.flags = flags
+        self.stop_on_limit = '--drive-stop-on-upload-limit' in flags
+        self.stats_interval = duration_to_seconds((flags.get('--stats') or ['60s'])[-1])
+        self.bwlimit = size_to_bytes((flags.get('--bwlimit') or [None])[-1])
+        self.account = 'default'
+        for key, value in os.environ.items():
+            if key.startswith('RCLONE_CONFIG_') and key.endswith('_SERVICE_ACCOUNT_FILE'):
+                self.account = os.path.basename(value)
+        self.rate = 0
+        self.current = None
+        self.in_flight = 0
+        self.counters = {'account': self.account, 'uploaded_bytes': 0, 'uploaded_files': 0, 'wasted_bytes': 0,
+                         'quota_errors': 0, 'quota_blocked_seconds': 0.0, 'throttled_seconds': 0.0, 'in_flight': 0, 'rate': 0,
+                         'started': clock.now()}
+
+    def stats(self):
+        transferring = [{'name': self.current, 'speed': self.rate, 'bytes': self.in_flight}] if self.current else []
+        return {'speed': self.rate, 'bytes': self.counters['uploaded_bytes'] + self.in_flight,
+                'transfers': self.counters['uploaded_files'], 'transferring': transferring}
+
+    def files(self):
+        items = []
+        for path, _, names in os.walk(self.source):
+            for name in sorted(names):
+                if name.endswith('partial~') or name.endswith('_HIDDEN~'):
+                    continue
+                items.append(os.path.join(path, name))
+        return sorted(items)
+
+    def link_rate(self):
+        # every running upload shares the uplink
+        uploads = max(len(self.world.running()), 1)
+        rate = self.world.settings['link_up'] / uploads
+        return rate if self.bwlimit is None else min(rate, self.bwlimit)
+
+    def run(self):
+        tick = max(1.0, self.clock.scale * 0.01)
+        pending = self.files()
+        total = sum(os.path.getsize(item) for item in pending)
+        next_stats = self.clock.now() + self.stats_interval
+        exhausted = False
+
+        while pending:
+            item = pending[0]
+            relative = os.path.relpath(item, self.source)
+            size = os.path.getsize(item)
+            self.current = relative
+
+            self.clock.sleep(tick)
+            now = self.clock.now()
+            self.rate = self.link_rate()
+            if self.bwlimit is not None and self.bwlimit < self.world.settings['link_up']:
+                self.counters['throttled_seconds'] += tick
+
+            wanted = min(self.rate * tick, size - self.in_flight)
+            granted = self.world.consume(self.account, wanted, now)
+            self.in_flight += granted
+
+            if granted < wanted:
+                # the account ran out of quota, whatever was sent of this file is lost
+                if not exhausted:
+                    self.world.event('quota_exhausted', now, pid=os.getpid(), account=self.account)
+                self.counters['wasted_bytes'] += self.in_flight
+                exhausted = True
+                self.in_flight = 0
+                self.rate = 0
+                self.counters['quota_errors'] += 1
+                self.counters['quota_blocked_seconds'] += tick
+                print(f"{self.timestamp(now)} ERROR : {relative}: {QUOTA_ERROR}", flush=True)
+                if self.stop_on_limit:
+                    print(f"{self.timestamp(now)} ERROR : Fatal error received - not attempting retries",
+                          flush=True)
+                    return 7
+                # rclone moves on and retries the file later
+                pending.append(pending.pop(0))
+            elif self.in_flight >= size:
+                os.remove(item)
+                pending.pop(0)
+                self.counters['uploaded_bytes'] += size
+                self.counters['uploaded_files'] += 1
+                self.world.event('uploaded', now, pid=os.getpid(), account=self.account, bytes=size)
+                print(f"{self.timestamp(now)} INFO  : {relative}: Copied (new)", flush=True)
+                print(f"{self.timestamp(now)} INFO  : {relative}: Deleted", flush=True)
+                self.in_flight = 0
+                self.current = None
+                exhausted = False
+
+            self.counters['in_flight'] = self.in_flight
+            self.counters['rate'] = self.rate
+            self.world.write_running(os.getpid(), self.counters)
+
+            if now >= next_stats:
+                next_stats = now + self.stats_interval
+                self.print_stats(now, total)
+
+        return 0
+
+    def print_stats(self, now, total):
+        done = self.counters['uploaded_bytes'] + self.in_flight
+        percent = int(done * 100 / total) if total else 100
+        # the " 0/s," of rclone releases the default rclone_sleeps trigger was written for
+        speed = f'{human(self.rate)}/s' if self.rate else '0/s'
+        print(f"{self.timestamp(now)} INFO  :\n"
+              f"Transferred:   \t{human(done)} / {human(total)}, {percent}%, {speed}, ETA -\n"
+              f"Errors:                {self.counters['quota_errors']}\n"
+              f"Transferred:            {self.counters['uploaded_files']}\n"
+              f"Elapsed time:  {now - self.counters['started']:.1f}s\n", flush=True)
+
+    @staticmethod
+    def timestamp(now):
+        return time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(now))
+
+
+class Terminated(Exception):
+    pass
+
+
+def terminate(signum, frame):
+    raise Terminated()
+
+
+def main():
+    clock = SimClock.from_env() or SimClock()
+    positional, flags = parse_args(sys.argv[1:])
+    command = positional[0] if positional else ''
+
+    if command == 'config' and positional[1:2] == ['dump']:
+        world = World(os.environ['CLOUDPLOW_SIM_WORLD'])
+        print(json.dumps({name: {'type': 'drive'} for name in world.settings.get('remotes', ['google'])}))
+        return 0
+
+    if command not in ('move', 'copy', 'sync'):
+        # delete, rmdir and friends succeed without doing anything
+        return 0
+
+    world = World(os.environ['CLOUDPLOW_SIM_WORLD'])
+    upload = Upload(clock, world, positional[1], flags)
+    if '--rc-addr' in flags:
+        serve_rc(flags['--rc-addr'][-1], upload)
+
+    # the harness stops cloudplow and its rclones with SIGTERM at the end of a run, that is not a policy's waste,
+    # only the SIGKILLs of cloudplow's triggers are reaped as kills
+    signal.signal(signal.SIGTERM, terminate)
+    world.event('start', clock.now(), pid=os.getpid(), account=upload.account)
+    world.write_running(os.getpid(), upload.counters)
+    code = 1
+    try:
+        code = upload.run()
+    except Terminated:
+        code = -signal.SIGTERM
+    finally:
+        upload.counters['in_flight'] = upload.in_flight
+        world.event('exit', clock.now(), pid=os.getpid(), code=code, **upload.counters)
+        world.remove_running(os.getpid())
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the Scaleway `scw` tool used by the scaleway syncer, point a syncer's tool_path at it.
+
+Instances are json files in $FAKE_SCW_STATE (default: <tmp>/fake-scw). A created or started instance refuses `exec`
+until $FAKE_SCW_BOOT_SECONDS (default: 45) have passed, like ssh on a booting instance, and every call takes
+$FAKE_SCW_LATENCY seconds (default: 0.2). Everything runs on the simulated clock when one is set, see clock.py.
+For example, a syncer with `"service": "scaleway", "tool_path": "/opt/cloudplow/benchmarks/sim/fake_scw.py"` and
+
+    FAKE_SCW_BOOT_SECONDS=20 python3 cloudplow.py sync --config config.json
+
+goes through instance creation, the boot probes, setup, the sync and destruction without a Scaleway account.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from sim.clock import SimClock  # noqa: E402
+
+STATE = os.environ.get('FAKE_SCW_STATE', os.path.join(tempfile.gettempdir(), 'fake-scw'))
+BOOT_SECONDS = float(os.environ.get('FAKE_SCW_BOOT_SECONDS', 45))
+LATENCY = float(os.environ.get('FAKE_SCW_LATENCY', 0.2))
+UNAME = 'Linux scw-fake 4.15.0-50-generic #54-Ubuntu SMP x86_64 x86_64 x86_64 GNU/Linux'
+
+
+def load(name):
+    for item in os.listdir(STATE):
+        with open(os.path.join(STATE, item)) as fp:
+            instance = json.load(fp)
+        if name in (instance['id'], instance['name']):
+            return instance
+    return None
+
+
+def save(instance):
+    with open(os.path.join(STATE, f"{instance['id']}.json"), 'w') as fp:
+        json.dump(instance, fp)
+
+
+def execute(clock, instance, command):
+    if instance is None or instance['state'] != 'running':
+        print("FATA[0000] instance is not running", file=sys.stderr)
+        return 1
+    if clock.now() - instance['started'] < BOOT_SECONDS:
+        print("ssh: connect to host 10.0.0.1 port 22: Connection refused", file=sys.stderr)
+        return 255
+
+    if command.startswith('uname'):
+        print(UNAME)
+    elif 'which unzip' in command:
+        print('/usr/bin/unzip')
+    elif 'which rclone' in command:
+        print('/usr/bin/rclone')
+    elif command.startswith('cat /root/.config/rclone/rclone.conf'):
+        print(instance.get('rclone_config', ''), end='')
+    elif command.startswith('rclone '):
+        print(f"{command.split()[1]}: nothing to transfer")
+    return 0
+
+
+def main():
+    clock = SimClock.from_env() or SimClock()
+    os.makedirs(STATE, exist_ok=True)
+    clock.sleep(LATENCY)
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--region')]
+    command, args = (args[0], args[1:]) if args else ('', [])
+
+    if command == 'ps':
+        print('INSTANCE ID    IMAGE    TYPE    CREATED    STATUS    PORTS    NAME    COMMERCIAL TYPE    ZONE')
+        for item in sorted(os.listdir(STATE)):
+            with open(os.path.join(STATE, item)) as fp:
+                instance = json.load(fp)
+            print(f"{instance['id'][:8]}    {instance['image']}    {instance['state']}    {instance['name']}    par1")
+        return 0
+
+    if command == 'run':
+        name = next((arg.split('=', 1)[1] for arg in args if arg.startswith('--name=')), str(uuid.uuid4()))
+        instance = {'id': str(uuid.uuid4()), 'name': name, 'image': args[-1], 'state': 'running',
+                    'started': clock.now()}
+        save(instance)
+        print(instance['id'])
+        return 0
+
+    if command in ('start', 'stop', 'rm'):
+        instance = load(args[-1])
+        if instance is None:
+            print(f"FATA[0000] failed to find {args[-1]}", file=sys.stderr)
+            return 1
+        if command == 'rm':
+            os.remove(os.path.join(STATE, f"{instance['id']}.json"))
+        else:
+            instance.update(state='running' if command == 'start' else 'stopped', started=clock.now())
+            save(instance)
+        print(args[-1])
+        return 0
+
+    if command == 'exec':
+        args = [arg for arg in args if arg != '-w']
+        return execute(clock, load(args[0]), ' '.join(args[1:]))
+
+    if command == 'cp':
+        source, target = args
+        instance = load(target.split(':', 1)[0])
+        if instance is None:
+            return 1
+        with open(source) as fp:
+            instance['rclone_config'] = fp.read()
+        save(instance)
+        return 0
+
+    if command == 'reset':
+        # not a scw command, clears every fake instance
+        shutil.rmtree(STATE, ignore_errors=True)
+        return 0
+
+    print(f"FATA[0000] unknown command {command!r}", file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
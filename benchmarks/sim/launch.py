@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Runs cloudplow.py on the simulated clock from the environment, see clock.py. Usage:
+
+    CLOUDPLOW_SIM_CLOCK=... python3 benchmarks/sim/launch.py <work folder> run --config ... --logfile ...
+
+Lock files are kept in the work folder so several simulations never share them with a real cloudplow.
+"""
+import os
+import runpy
+import sys
+
+BENCHMARKS = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+from sim import clock  # noqa: E402
+
+
+def main():
+    workdir, args = sys.argv[1], sys.argv[2:]
+    simulated = clock.SimClock.from_env()
+    if simulated is not None:
+        clock.install(simulated)
+
+    # utils.lock places its folder next to argv[0] when it is first imported
+    sys.argv = [os.path.join(workdir, 'cloudplow.py'), *args]
+    import utils.lock  # noqa: F401
+    runpy.run_path(os.path.join(ROOT, 'cloudplow.py'), run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Fake Plex and NZBGet servers for the simulation harness, both served from threads of the harness process.
+
+FakePlex answers status/sessions with a stream count that follows the simulated hour of the day. FakeNzbget speaks
+enough XML-RPC for cloudplow (pausedownload, resumedownload, rate, status) and is also the producer of the run: each
+tick it "downloads" at whatever speed its pause state, its limit and the uplink leave it and drops finished files into
+the upload folder.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+############################################################
+# PLEX
+############################################################
+
+class FakePlex:
+    def __init__(self, clock, schedule):
+        """ schedule maps 'from-until' hour ranges to remote stream counts, e.g. {'19-23': 3} """
+        self.clock = clock
+        self.schedule = [(tuple(int(hour) for hour in hours.split('-')), count) for hours, count in schedule.items()]
+        self.server = None
+
+    def streams(self):
+        hour = time.localtime(self.clock.now()).tm_hour
+        for (start, until), count in self.schedule:
+            if start <= hour < until or (until < start and (hour >= start or hour < until)):
+                return count
+        return 0
+
+    def start(self):
+        plex = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                sessions = [{'type': 'movie', 'title': f'Stream {index}', 'User': {'title': f'user{index}'},
+                             'Player': {'product': 'Plex Web', 'state': 'playing', 'local': False},
+                             'Session': {'id': str(index)},
+                             'Media': [{'Part': [{'decision': 'directplay'}]}]}
+                            for index in range(plex.streams())]
+                data = json.dumps({'MediaContainer': {'size': len(sessions), 'Metadata': sessions}}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = serve(ThreadingHTTPServer(('127.0.0.1', 0), Handler))
+        return f'http://127.0.0.1:{self.server.server_address[1]}/'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+
+############################################################
+# NZBGET
+############################################################
+
+class FakeNzbget:
+    def __init__(self, clock, world, folder, file_size):
+        self.clock = clock
+        self.world = world
+        self.folder = folder
+        self.file_size = file_size
+        self.paused = False
+        self.limit = None
+        self.rate = 0
+        self.partial = 0
+        self.files = 0
+        self.downloaded_bytes = 0
+        self.paused_seconds = 0.0
+        self.limited_seconds = 0.0
+        self.lock = threading.Lock()
+        self.server = None
+
+    # xml-rpc methods
+    def pausedownload(self):
+        with self.lock:
+            self.paused = True
+        return True
+
+    def resumedownload(self):
+        with self.lock:
+            self.paused = False
+        return True
+
+    def ratelimit(self, kb):
+        with self.lock:
+            self.limit = None if not kb else kb * 1024
+        return True
+
+    def status(self):
+        return {'DownloadPaused': self.paused, 'DownloadRate': int(self.rate),
+                'DownloadLimit': 0 if self.limit is None else self.limit}
+
+    def start(self):
+        class Handler(SimpleXMLRPCRequestHandler):
+            rpc_paths = ('/xmlrpc',)
+
+            def log_message(self, *args):
+                pass
+
+        server = SimpleXMLRPCServer(('127.0.0.1', 0), requestHandler=Handler, logRequests=False, allow_none=True)
+        server.register_function(self.pausedownload, 'pausedownload')
+        server.register_function(self.resumedownload, 'resumedownload')
+        server.register_function(self.ratelimit, 'rate')
+        server.register_function(self.status, 'status')
+        self.server = serve(server)
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def tick(self, seconds):
+        """ download for `seconds` of simulated time, returns the bytes that landed in the upload folder """
+        settings = self.world.settings
+        with self.lock:
+            if self.paused:
+                self.rate = 0
+                self.paused_seconds += seconds
+                return 0
+
+            rate = settings['link_down']
+            if settings.get('shared_link'):
+                rate -= self.world.upload_rate()
+            if self.limit is not None:
+                rate = min(rate, self.limit)
+                self.limited_seconds += seconds
+            self.rate = max(rate, 0)
+
+        self.partial += self.rate * seconds
+        self.downloaded_bytes += self.rate * seconds
+        landed = 0
+        while self.partial >= self.file_size:
+            self.partial -= self.file_size
+            self.files += 1
+            target = os.path.join(self.folder, 'Movies', f'Download {self.files:06d}', f'download-{self.files:06d}.mkv')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # sparse, the fake rclone only looks at the apparent size
+            with open(target, 'wb') as fp:
+                fp.truncate(self.file_size)
+            landed += self.file_size
+        return landed
@@ -0,0 +1,126 @@
+"""
+State shared between the harness and the fake rclone processes of one simulated run.
+
+    world.json      link speeds and quota of the simulated Google Drive
+    quota.json      bytes uploaded per account in the current quota day, guarded by an fcntl lock
+    running/<pid>   live counters of every running fake rclone, rewritten atomically each tick
+    events.jsonl    append only log of rclone starts, exits, uploaded files and quota errors
+"""
+import fcntl
+import json
+import os
+
+QUOTA_DAY = 24 * 60 * 60
+
+
+class World:
+    def __init__(self, folder):
+        self.folder = folder
+        self.running_folder = os.path.join(folder, 'running')
+        self.events_path = os.path.join(folder, 'events.jsonl')
+        self.quota_path = os.path.join(folder, 'quota.json')
+        self._settings = None
+
+    @classmethod
+    def create(cls, folder, **settings):
+        world = cls(folder)
+        os.makedirs(world.running_folder, exist_ok=True)
+        with open(os.path.join(folder, 'world.json'), 'w') as fp:
+            json.dump(settings, fp, indent=4)
+        with open(world.quota_path, 'w') as fp:
+            json.dump({}, fp)
+        open(world.events_path, 'w').close()
+        return world
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            with open(os.path.join(self.folder, 'world.json')) as fp:
+                self._settings = json.load(fp)
+        return self._settings
+
+    ############################################################
+    # QUOTA
+    ############################################################
+
+    def consume(self, account, requested, now):
+        """ take up to `requested` bytes from the daily quota of `account`, returns the bytes granted """
+        day = int(now // QUOTA_DAY)
+        with open(self.quota_path, 'r+') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                quota = json.load(fp)
+                used = quota.get(account, {}).get('used', 0) if quota.get(account, {}).get('day') == day else 0
+                granted = max(min(requested, self.settings['quota_bytes'] - used), 0)
+                quota[account] = {'day': day, 'used': used + granted}
+                fp.seek(0)
+                fp.truncate()
+                json.dump(quota, fp)
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+        return granted
+
+    ############################################################
+    # RUNNING RCLONE PROCESSES
+    ############################################################
+
+    def write_running(self, pid, counters):
+        target = os.path.join(self.running_folder, str(pid))
+        with open(f'{target}.tmp', 'w') as fp:
+            json.dump(counters, fp)
+        os.replace(f'{target}.tmp', target)
+
+    def remove_running(self, pid):
+        try:
+            os.remove(os.path.join(self.running_folder, str(pid)))
+        except FileNotFoundError:
+            pass
+
+    def running(self):
+        """ counters of every fake rclone that has a running file, keyed by pid """
+        result = {}
+        for name in os.listdir(self.running_folder):
+            if not name.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.running_folder, name)) as fp:
+                    result[int(name)] = json.load(fp)
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def upload_rate(self):
+        return sum(counters.get('rate', 0) for counters in self.running().values())
+
+    def reap(self, now):
+        """ turn the running files of rclone processes that were killed into exit events """
+        for pid, counters in self.running().items():
+            try:
+                os.kill(pid, 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+            self.event('exit', now, pid=pid, code=-9, killed=True, **counters)
+            self.remove_running(pid)
+
+    ############################################################
+    # EVENTS
+    ############################################################
+
+    def event(self, kind, now, **data):
+        line = json.dumps({'event': kind, 'time': now, **data}) + '\n'
+        fd = os.open(self.events_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def events(self, offset=0):
+        """ events appended since `offset`, returns (events, new offset) """
+        with open(self.events_path, 'rb') as fp:
+            fp.seek(offset)
+            data = fp.read()
+        complete = data.rfind(b'\n') + 1
+        return [json.loads(line) for line in data[:complete].splitlines() if line], offset + complete
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Replays days of `cloudplow.py run` in seconds to compare scheduling policies without Google Drive or Plex.
+
+Each policy gets its own work folder with a fake rclone (benchmarks/sim/fake_rclone.py) that uploads against a daily
+quota per service account, a fake NZBGet that keeps filling the upload folder, an optional fake Plex with evening
+streams, and a cloudplow running on an accelerated clock. The harness tails what the fake rclone reports and prints,
+per policy, the effective upload throughput, the time the backlog sat idle and the bytes wasted on quota errors.
+Usage:
+
+    python3 benchmarks/simulate.py --days 2 --scale 1440 --output simulation.json
+    python3 benchmarks/simulate.py --policies baseline,sa-rotation --quota-gb 200
+
+Process start-up and disk walks are accelerated along with everything else, at very high scales they start to show
+up as simulated minutes, 1440 (a day per minute) is a good ceiling. A policy can lower the scale and pick its own
+window with the scale, days and start keys, see plex-throttle, --days and --start override the window.
+"""
+import argparse
+import json
+import os
+import shutil
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from sim.clock import SimClock  # noqa: E402
+from sim.fake_rclone import size_to_bytes  # noqa: E402
+from sim.servers import FakeNzbget, FakePlex  # noqa: E402
+from sim.world import World  # noqa: E402
+
+GB = 1024 ** 3
+REMOTE = 'google'
+
+# the rclone_sleeps shipped in config.json.sample
+RCLONE_SLEEPS = {
+    "Failed to copy: googleapi: Error 403: User rate limit exceeded": {"count": 5, "sleep": 25, "timeout": 3600},
+    " 0/s,": {"count": 15, "sleep": 25, "timeout": 140}
+}
+
+POLICIES = {
+    'baseline': {
+        'description': 'one account, rclone_sleeps triggers, NZBGet paused while uploading',
+        'service_accounts': 0, 'stop_on_limit': False, 'download_control': False, 'plex': False
+    },
+    'stop-on-limit': {
+        'description': 'one account, --drive-stop-on-upload-limit, NZBGet paused while uploading',
+        'service_accounts': 0, 'stop_on_limit': True, 'download_control': False, 'plex': False
+    },
+    'sa-rotation': {
+        'description': 'four service accounts rotated on exit code 7, NZBGet paused while uploading',
+        'service_accounts': 4, 'stop_on_limit': True, 'download_control': False, 'plex': False
+    },
+    'download-control': {
+        'description': 'four service accounts, NZBGet speed limited instead of paused',
+        'service_accounts': 4, 'stop_on_limit': True, 'download_control': True, 'plex': False
+    },
+    'plex-throttle': {
+        'description': 'download-control plus three Plex streams every evening',
+        'service_accounts': 4, 'stop_on_limit': True, 'download_control': True, 'plex': {'19-23': 3},
+        # the plex monitor gives rclone 15 seconds to bring its rc up, the real start-up of the fake rclone has to
+        # fit in that at the chosen scale, so only the evening is replayed and slower
+        'scale': 60, 'days': 0.25, 'start': '2024-01-01 18:00'
+    }
+}
+
+
+############################################################
+# SETUP
+############################################################
+
+def write_rclone(workdir):
+    wrapper = os.path.join(workdir, 'rclone')
+    dump = {REMOTE: {'type': 'drive'}}
+    with open(wrapper, 'w') as fp:
+        # answer config dump from the shell, every python start-up costs simulated minutes at high scales
+        fp.write('#!/bin/sh\n'
+                 f'if [ "$1" = "config" ] && [ "$2" = "dump" ]; then echo {shlex.quote(json.dumps(dump))}; exit 0; fi\n'
+                 f'exec {sys.executable} {os.path.join(BENCHMARKS, "sim", "fake_rclone.py")} "$@"\n')
+    os.chmod(wrapper, 0o755)
+    return wrapper
+
+
+def write_config(workdir, policy, args, nzbget_url, plex_url):
+    extras = {'--stats': '60s', '--transfers': 8, '--verbose': 1}
+    if policy['stop_on_limit']:
+        extras['--drive-stop-on-upload-limit'] = None
+
+    uploader = {'check_interval': args.check_interval, 'max_size_gb': 0, 'size_excludes': [], 'opened_excludes': [],
+                'exclude_open_files': False}
+    if policy['service_accounts']:
+        folder = os.path.join(workdir, 'service_accounts')
+        os.makedirs(folder, exist_ok=True)
+        for index in range(policy['service_accounts']):
+            with open(os.path.join(folder, f'{index + 1:02d}.json'), 'w') as fp:
+                json.dump({'type': 'service_account'}, fp)
+        uploader['service_account_path'] = folder
+
+    config = {
+        'core': {'dry_run': False, 'rclone_binary_path': write_rclone(workdir),
+                 'rclone_config_path': os.path.join(workdir, 'rclone.conf')},
+        'hidden': {},
+        'notifications': {},
+        'remotes': {
+            REMOTE: {'upload_folder': os.path.join(workdir, 'upload'), 'upload_remote': f'{REMOTE}:/Media',
+                       'hidden_remote': f'{REMOTE}:', 'sync_remote': f'{REMOTE}:/Media', 'rclone_command': 'move',
+                       'rclone_excludes': ['**partial~', '**_HIDDEN~'], 'rclone_extras': extras,
+                       'rclone_sleeps': RCLONE_SLEEPS, 'remove_empty_dir_depth': 2}
+        },
+        'syncer': {},
+        'uploader': {REMOTE: uploader},
+        'nzbget': {'enabled': True, 'url': nzbget_url},
+        'plex': {'enabled': bool(policy['plex']), 'url': plex_url or 'http://127.0.0.1:32400/', 'token': 'simulation',
+                 'poll_interval': 60, 'max_streams_before_throttle': 1, 'ignore_local_streams': False,
+                 'notifications': False,
+                 'rclone': {'url': 'http://127.0.0.1:7949', 'throttle_speeds': {'1': '50M', '2': '40M', '3': '30M',
+                                                                                '4': '20M', '5': '10M'}}},
+        'download_control': {'enabled': policy['download_control'], 'link_speed': args.link_down,
+                             'min_speed': '1M', 'min_free_space_gb': 0, 'poll_interval': 30}
+    }
+    path = os.path.join(workdir, 'config.json')
+    with open(path, 'w') as fp:
+        json.dump(config, fp, indent=4)
+    return path
+
+
+def add_backlog(folder, total, file_size):
+    files = 0
+    while total >= file_size:
+        files += 1
+        target = os.path.join(folder, 'Movies', f'Backlog {files:06d}', f'backlog-{files:06d}.mkv')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as fp:
+            fp.truncate(file_size)
+        total -= file_size
+    return files * file_size
+
+
+############################################################
+# RUN
+############################################################
+
+def window(policy, args):
+    """ days, scale and start of a policy, given options win over the policy's own, its scale is a ceiling """
+    return (args.days or policy.get('days', 1), min(args.scale, policy.get('scale', args.scale)),
+            args.start or policy.get('start', '2024-01-01 00:00'))
+
+
+def run_policy(name, policy, args):
+    days, scale, start = window(policy, args)
+    workdir = tempfile.mkdtemp(prefix=f'cloudplow-sim-{name}-')
+    upload_folder = os.path.join(workdir, 'upload')
+    os.makedirs(upload_folder)
+    file_size = int(args.file_size_gb * GB)
+    epoch = time.mktime(time.strptime(start, '%Y-%m-%d %H:%M'))
+
+    world = World.create(os.path.join(workdir, 'world'), link_up=size_to_bytes(args.link_up),
+                         link_down=size_to_bytes(args.link_down), shared_link=args.shared_link,
+                         quota_bytes=int(args.quota_gb * GB), remotes=[REMOTE])
+    # the servers are started before the clock, it is only handed to them below
+    nzbget = FakeNzbget(None, world, upload_folder, file_size)
+    plex = FakePlex(None, policy['plex']) if policy['plex'] else None
+    config_path = write_config(workdir, policy, args, nzbget.start(), plex.start() if plex else None)
+
+    env = dict(os.environ, CLOUDPLOW_SIM_WORLD=world.folder)
+    cmd = [sys.executable, os.path.join(BENCHMARKS, 'sim', 'launch.py'), workdir]
+    paths = ['--config', config_path, '--logfile', os.path.join(workdir, 'cloudplow.log'),
+             '--cachefile', os.path.join(workdir, 'cache.db')]
+    # fill in every setting the simulation does not care about, an upgraded config exits straight away
+    subprocess.run(cmd + ['update_config'] + paths, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    pending = add_backlog(upload_folder, int(args.backlog_gb * GB), file_size)
+    clock = SimClock(scale, epoch)
+    nzbget.clock = clock
+    if plex:
+        plex.clock = clock
+    env.update(clock.environ())
+
+    report = {'policy': name, 'description': policy['description'], 'work_folder': workdir,
+              'sim_seconds': 0.0, 'uploaded_bytes': 0, 'uploaded_files': 0, 'downloaded_bytes': 0,
+              'upload_active_seconds': 0.0, 'idle_seconds': 0.0, 'quota_waste_bytes': 0, 'quota_errors': 0,
+              'quota_blocked_seconds': 0.0, 'throttled_seconds': 0.0, 'rclone_runs': 0, 'exit_codes': {},
+              'accounts': {}, 'max_backlog_bytes': pending}
+
+    process = subprocess.Popen(cmd + ['run'] + paths, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    offset = 0
+    last = clock.now()
+    duration = days * 24 * 60 * 60
+    try:
+        while clock.elapsed() < duration and process.poll() is None:
+            time.sleep(0.01)
+            now = clock.now()
+            elapsed, last = now - last, now
+
+            pending += nzbget.tick(elapsed)
+            world.reap(now)
+            events, offset = world.events(offset)
+            pending -= collect(report, events)
+
+            if world.running():
+                report['upload_active_seconds'] += elapsed
+            elif pending > 0:
+                report['idle_seconds'] += elapsed
+            report['max_backlog_bytes'] = max(report['max_backlog_bytes'], pending)
+    finally:
+        report['sim_seconds'] = clock.elapsed()
+        stop(process)
+        nzbget.stop()
+        if plex:
+            plex.stop()
+
+    world.reap(clock.now())
+    events, offset = world.events(offset)
+    pending -= collect(report, events)
+
+    report['cloudplow_exit_code'] = process.returncode if process.returncode and process.returncode > 0 else None
+    report['downloaded_bytes'] = int(nzbget.downloaded_bytes)
+    report['nzbget_paused_seconds'] = nzbget.paused_seconds
+    report['nzbget_limited_seconds'] = nzbget.limited_seconds
+    report['final_backlog_bytes'] = pending
+    report['throughput_bytes_per_second'] = report['uploaded_bytes'] / max(report['sim_seconds'], 1)
+    report['idle_ratio'] = report['idle_seconds'] / max(report['sim_seconds'], 1)
+    report['link_utilisation'] = report['uploaded_bytes'] / max(world.settings['link_up'] * report['sim_seconds'], 1)
+
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+        report['work_folder'] = None
+    return report
+
+
+def collect(report, events):
+    """ fold fake rclone events into the report, returns the bytes that left the upload folder """
+    uploaded = 0
+    for event in events:
+        if event['event'] == 'start':
+            report['rclone_runs'] += 1
+        elif event['event'] == 'uploaded':
+            uploaded += event['bytes']
+            report['uploaded_bytes'] += event['bytes']
+            report['uploaded_files'] += 1
+            account = report['accounts'].setdefault(event['account'], {'uploaded_bytes': 0, 'quota_exhausted': 0})
+            account['uploaded_bytes'] += event['bytes']
+        elif event['event'] == 'quota_exhausted':
+            account = report['accounts'].setdefault(event['account'], {'uploaded_bytes': 0, 'quota_exhausted': 0})
+            account['quota_exhausted'] += 1
+        elif event['event'] == 'exit':
+            code = str(event['code'])
+            report['exit_codes'][code] = report['exit_codes'].get(code, 0) + 1
+            # a killed rclone loses whatever it had in flight
+            report['quota_waste_bytes'] += event.get('wasted_bytes', 0) + (
+                event.get('in_flight', 0) if event.get('killed') else 0)
+            report['quota_errors'] += event.get('quota_errors', 0)
+            report['quota_blocked_seconds'] += event.get('quota_blocked_seconds', 0)
+            report['throttled_seconds'] += event.get('throttled_seconds', 0)
+    return uploaded
+
+
+def stop(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(10)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+############################################################
+# MAIN
+############################################################
+
+def print_report(report):
+    hours = report['sim_seconds'] / 3600
+    print(f"{report['policy']}: {report['description']}")
+    print(f"    simulated {hours:.1f} h with {report['rclone_runs']} rclone run(s), exit codes {report['exit_codes']}")
+    print(f"    uploaded {report['uploaded_bytes'] / GB:.1f} GB, "
+          f"{report['throughput_bytes_per_second'] / 1024 ** 2:.2f} MB/s effective, "
+          f"{report['link_utilisation'] * 100:.1f}% of the uplink")
+    print(f"    idle with a backlog {report['idle_seconds'] / 3600:.2f} h ({report['idle_ratio'] * 100:.1f}%), "
+          f"final backlog {report['final_backlog_bytes'] / GB:.1f} GB")
+    print(f"    quota waste {report['quota_waste_bytes'] / GB:.2f} GB, {report['quota_errors']} quota error(s), "
+          f"{report['quota_blocked_seconds'] / 3600:.2f} h stuck on an exhausted account")
+    print(f"    NZBGet paused {report['nzbget_paused_seconds'] / 3600:.2f} h, "
+          f"downloaded {report['downloaded_bytes'] / GB:.1f} GB, throttled {report['throttled_seconds'] / 3600:.2f} h",
+          flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate cloudplow scheduling policies on an accelerated clock')
+    parser.add_argument('--policies', help='Comma separated policies to run, of: ' + ', '.join(POLICIES))
+    parser.add_argument('--policy-file', help='JSON file with additional policies, same keys as the built-in ones')
+    parser.add_argument('--days', type=float, help='Simulated days per policy (default: 1, or the policy\'s)')
+    parser.add_argument('--scale', type=float, default=720, help='Simulated seconds per second (default: 720)')
+    parser.add_argument('--start', help='Simulated start time (default: 2024-01-01 00:00, or the policy\'s)')
+    parser.add_argument('--quota-gb', type=float, default=750, help='Daily upload quota per account (default: 750)')
+    parser.add_argument('--link-up', default='40M', help='Upload link speed in bytes per second (default: 40M)')
+    parser.add_argument('--link-down', default='60M', help='Download link speed in bytes per second (default: 60M)')
+    parser.add_argument('--shared-link', action='store_true', help='Downloads and uploads share one link')
+    parser.add_argument('--file-size-gb', type=float, default=4, help='Size of every downloaded file (default: 4)')
+    parser.add_argument('--backlog-gb', type=float, default=500, help='Upload backlog at the start (default: 500)')
+    parser.add_argument('--check-interval', type=int, default=30,
+                        help='Uploader check_interval in minutes (default: 30)')
+    parser.add_argument('--keep', action='store_true', help='Keep the work folders, they hold the cloudplow logs')
+    parser.add_argument('--output', help='Write the reports as JSON to this file')
+    args = parser.parse_args()
+
+    policies = dict(POLICIES)
+    if args.policy_file:
+        with open(args.policy_file) as fp:
+            policies.update(json.load(fp))
+    selected = args.policies.split(',') if args.policies else list(policies)
+    unknown = [name for name in selected if name not in policies]
+    if unknown:
+        parser.error(f"unknown policy(s): {', '.join(unknown)}")
+
+    reports = []
+    for name in selected:
+        policy = policies[name]
+        days, scale, _ = window(policy, args)
+        print(f"Simulating {name} for {days} day(s), about {days * 86400 / scale:.0f} seconds...", flush=True)
+        reports.append(run_policy(name, policy, args))
+        print_report(reports[-1])
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'simulation': {key: value for key, value in vars(args).items() if key != 'output'},
+                       'reports': reports}, fp, indent=4)
+
+
+if __name__ == '__main__':
+    # let the finally blocks stop cloudplow and its rclones when the harness is terminated
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Measures how long a cron triggered `cloudplow.py upload` takes to reach its first rclone spawn.
+
+A throwaway config points rclone_binary_path at a stub that only records the time it was started,
+so nothing is uploaded. Usage:
+
+    python3 benchmarks/startup.py --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+STUB_RCLONE = """#!/bin/sh
+date +%s%N >> "$CLOUDPLOW_BENCH_STAMPS"
+"""
+
+
+def write_config(folder):
+    upload_folder = os.path.join(folder, 'upload')
+    os.makedirs(os.path.join(upload_folder, 'Movies'), exist_ok=True)
+    with open(os.path.join(upload_folder, 'Movies', 'movie.mkv'), 'w') as fp:
+        fp.write('benchmark')
+
+    rclone_stub = os.path.join(folder, 'rclone')
+    with open(rclone_stub, 'w') as fp:
+        fp.write(STUB_RCLONE)
+    os.chmod(rclone_stub, 0o755)
+
+    config = {
+        'core': {'dry_run': False, 'rclone_binary_path': rclone_stub,
+                 'rclone_config_path': os.path.join(folder, 'rclone.conf')},
+        'remotes': {
+            'bench': {
+                'upload_folder': upload_folder,
+                'upload_remote': 'bench:/Media',
+                'hidden_remote': 'bench:',
+                'sync_remote': 'bench:/Media',
+                'rclone_command': 'move',
+                'rclone_excludes': [],
+                'rclone_extras': {},
+                'rclone_sleeps': {},
+                'remove_empty_dir_depth': 2
+            }
+        },
+        'uploader': {
+            'bench': {
+                'check_interval': 30,
+                'max_size_gb': 0,
+                'size_excludes': [],
+                'opened_excludes': [],
+                'exclude_open_files': False
+            }
+        }
+    }
+    config_path = os.path.join(folder, 'config.json')
+    with open(config_path, 'w') as fp:
+        json.dump(config, fp, indent=4)
+    return config_path
+
+
+def run(folder, config_path, mode='upload'):
+    stamps = os.path.join(folder, 'stamps')
+    if os.path.exists(stamps):
+        os.remove(stamps)
+
+    cmd = [sys.executable, os.path.join(ROOT, 'cloudplow.py'), mode, '--config', config_path,
+           '--logfile', os.path.join(folder, 'cloudplow.log'), '--cachefile', os.path.join(folder, 'cache.db')]
+    env = dict(os.environ, CLOUDPLOW_BENCH_STAMPS=stamps)
+
+    started = time.time_ns()
+    subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+    finished = time.time_ns()
+
+    first_spawn = None
+    if os.path.exists(stamps):
+        with open(stamps) as fp:
+            first_spawn = int(fp.readline().strip())
+    return {
+        'first_rclone_spawn_ms': None if first_spawn is None else (first_spawn - started) / 1e6,
+        'total_ms': (finished - started) / 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cloudplow startup to first rclone spawn')
+    parser.add_argument('--runs', type=int, default=10, help='Number of measured runs (default: 10)')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='cloudplow-bench-') as folder:
+        config_path = write_config(folder)
+        # let cloudplow upgrade the config first, an upgrade exits before doing any work
+        run(folder, config_path, 'update_config')
+        # warm up the page cache
+        run(folder, config_path)
+        results = [run(folder, config_path) for _ in range(args.runs)]
+
+    spawns = [result['first_rclone_spawn_ms'] for result in results if result['first_rclone_spawn_ms'] is not None]
+    summary = {
+        'benchmark': 'startup',
+        'python': sys.version.split()[0],
+        'runs': results,
+        'first_rclone_spawn_ms': {
+            'median': statistics.median(spawns) if spawns else None,
+            'min': min(spawns) if spawns else None,
+            'max': max(spawns) if spawns else None
+        }
+    }
+
+    print(json.dumps(summary['first_rclone_spawn_ms'], indent=4))
+    if len(spawns) != len(results):
+        print(f"{len(results) - len(spawns)} run(s) never spawned rclone, check the log for errors")
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(summary, fp, indent=4)
+
+
+if __name__ == '__main__':
+    main()
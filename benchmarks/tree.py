@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Generates a synthetic media library for the benchmarks.
+
+Files are created sparse, so a tree with millions of entries costs inodes rather than disk space. The layout is
+seeded, the same arguments always produce the same tree. Usage:
+
+    python3 benchmarks/tree.py /tmp/library --files 1000000 --depth 6 --hidden-ratio 0.01
+"""
+import argparse
+import os
+import random
+from collections import deque
+
+EXTENSIONS = ('mkv', 'mp4', 'srt', 'nfo', 'jpg')
+CATEGORIES = ('Movies', 'TV', 'Music', 'Anime', 'Documentaries')
+
+
+def generate(folder, files=10000, depth=4, fanout=8, hidden_ratio=0.01, partial_ratio=0.005, seed=1):
+    """
+    Create `files` files below `folder` spread over directories up to `depth` levels deep.
+
+    A `hidden_ratio` share of the files and directories get the unionfs `_HIDDEN~` whiteout suffix and a
+    `partial_ratio` share of the files the rclone `partial~` suffix.
+
+    :return: dict describing the generated tree
+    """
+    rng = random.Random(seed)
+    stats = {'folder': folder, 'files': 0, 'folders': 0, 'hidden_files': 0, 'hidden_folders': 0,
+             'partial_files': 0, 'depth': depth, 'seed': seed}
+
+    # build the directory skeleton first, files are then spread over its leaves and inner nodes alike
+    directories = []
+    pending = deque((os.path.join(folder, category), 1) for category in CATEGORIES)
+    while pending and len(directories) < max(files // 16, len(CATEGORIES)):
+        directory, level = pending.popleft()
+        if rng.random() < hidden_ratio:
+            directory += '_HIDDEN~'
+            stats['hidden_folders'] += 1
+        os.makedirs(directory, exist_ok=True)
+        directories.append(directory)
+        stats['folders'] += 1
+        if level < depth:
+            pending.extend((os.path.join(directory, f'{level:02d}-{index:03d}'), level + 1)
+                           for index in range(rng.randint(1, fanout)))
+
+    for index in range(files):
+        directory = rng.choice(directories)
+        name = f'file-{index:08d}.{rng.choice(EXTENSIONS)}'
+        chance = rng.random()
+        if chance < hidden_ratio:
+            name += '_HIDDEN~'
+            stats['hidden_files'] += 1
+        elif chance < hidden_ratio + partial_ratio:
+            name += '.partial~'
+            stats['partial_files'] += 1
+
+        with open(os.path.join(directory, name), 'wb') as fp:
+            fp.truncate(rng.randint(1, 4096) * 1024 * 1024)
+        stats['files'] += 1
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic media library for the cloudplow benchmarks')
+    parser.add_argument('folder', help='Folder to generate the tree in')
+    parser.add_argument('--files', type=int, default=10000, help='Number of files (default: 10000)')
+    parser.add_argument('--depth', type=int, default=4, help='Maximum directory depth (default: 4)')
+    parser.add_argument('--fanout', type=int, default=8, help='Maximum sub-directories per directory (default: 8)')
+    parser.add_argument('--hidden-ratio', type=float, default=0.01,
+                        help='Share of files and folders with a _HIDDEN~ whiteout (default: 0.01)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    args = parser.parse_args()
+
+    stats = generate(args.folder, args.files, args.depth, args.fanout, args.hidden_ratio, seed=args.seed)
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,18 +4,21 @@ import logging
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logging.handlers import RotatingFileHandler
-from multiprocessing import Process
 
 import schedule
 
-from utils import config, lock, path, decorators, version, misc
+from utils import config, lock, path, decorators, version, misc, rc, logger, trace, state
 from utils.cache import Cache
+from utils.downloads import DownloadController
+from utils.leases import AccountLeases
+from utils.ledger import UploadLedger, ledger_file
+from utils.listing import RemoteListing, listing_file
 from utils.notifications import Notifications
 from utils.nzbget import Nzbget
-from utils.sabnzbd import Sabnzbd
-from utils.plex import Plex
 from utils.rclone import RcloneThrottler, RcloneMover
+from utils.supervisor import Supervisor
 from utils.syncer import Syncer
 from utils.threads import Thread
 from utils.unionfs import UnionfsHiddenFolder
@@ -52,7 +55,10 @@ file_handler = RotatingFileHandler(
     encoding='utf-8'
 )
 file_handler.setFormatter(log_formatter)
-root_logger.addHandler(file_handler)
+
+# Log through a queue, so the console and file handlers run on a background listener thread
+root_logger.removeHandler(console_handler)
+logger.log_queue.start(console_handler, file_handler)
 
 # Set chosen logging level
 root_logger.setLevel(conf.settings['loglevel'])
@@ -61,25 +67,62 @@ log = root_logger.getChild('cloudplow')
 # Load config from disk
 conf.load()
 
+# Set tracing and profiling of jobs, both are disabled unless asked for
+trace.tracer.configure(conf.settings['trace'], conf.settings['trace_format'], conf.settings['profile'])
+
+# Set rclone output logging
+logger.rclone_outputs.configure(formatter=log_formatter, **conf.configs['rclone_output'])
+
 # Init Cache class
 cache = Cache(conf.settings['cachefile'])
 
+# Init the ledger of uploaded files
+ledger = UploadLedger(ledger_file(conf.settings['cachefile']))
+
+# Init the cache of remote listings, if enabled
+listing = None
+if conf.model.core.remote_listing_ttl:
+    listing = RemoteListing(listing_file(conf.settings['cachefile']), conf.model.core.rclone_binary_path,
+                            conf.model.core.rclone_config_path, conf.model.core.remote_listing_ttl * 60)
+
+# Init the service account leases shared with other hosts, if enabled
+leases = None
+if conf.model.core.service_account_leases:
+    leases = AccountLeases(conf.model.core.service_account_leases)
+
 # Init Notifications class
 notify = Notifications()
 
 # Init Syncer class
-syncer = Syncer(conf.configs)
+syncer = Syncer(conf.model)
 
 # Ensure lock folder exists
 lock.ensure_lock_folder()
 
+# Give every rclone job its own rc endpoint when stream throttling, download control, service account hot swaps or
+# bandwidth schedules are enabled
+if conf.model.plex.enabled or conf.configs['download_control']['enabled'] or \
+        any(uploader_config.hot_swap_service_accounts or uploader_config.bandwidth_schedule is not None
+            for uploader_config in conf.model.uploaders.values()):
+    rc.jobs.configure(conf.model.plex.rc_url, conf.model.plex.rc_socket_folder)
+
 # Init thread class
 thread = Thread()
 
+# Init download clients, their connections are kept for the life of the process
+nzbget = Nzbget(conf.configs['nzbget']['url']) if conf.configs['nzbget']['enabled'] else None
+sabnzbd = None
+if conf.configs['sabnzbd']['enabled']:
+    from utils.sabnzbd import Sabnzbd
+    sabnzbd = Sabnzbd(conf.configs['sabnzbd']['url'], conf.configs['sabnzbd']['apikey'])
+
 # Logic vars
 uploader_delay = cache.get_cache('uploader_bans')
 syncer_delay = cache.get_cache('syncer_bans')
 plex_monitor_thread = None
+bandwidth_schedule_thread = None
+# Supervisor of the sync worker processes, in run mode
+supervisor = None
 sa_delay = cache.get_cache('sa_bans')
 
 
@@ -100,16 +143,16 @@ def init_service_accounts():
     global sa_delay
     global uploader_delay
     log.debug("Start initializing of service accounts.")
-    for uploader_remote, uploader_config in conf.configs['uploader'].items():
+    for uploader_remote, uploader_config in conf.model.uploaders.items():
         if uploader_remote not in sa_delay:
             sa_delay[uploader_remote] = None
-        if 'service_account_path' in uploader_config and os.path.exists(uploader_config['service_account_path']):
+        if uploader_config.service_account_path and os.path.exists(uploader_config.service_account_path):
             # If service_account path provided, loop over the service account files and provide
             # one at a time when starting the uploader. If upload completes successfully, do not attempt
             # to use the other accounts
-            accounts = {os.path.join(os.path.normpath(uploader_config['service_account_path']),
+            accounts = {os.path.join(os.path.normpath(uploader_config.service_account_path),
                                      sa_file): None for sa_file in
-                        os.listdir(os.path.normpath(uploader_config['service_account_path'])) if
+                        os.listdir(os.path.normpath(uploader_config.service_account_path)) if
                         sa_file.endswith(".json")}
             current_accounts = sa_delay[uploader_remote]
             if current_accounts is not None:
@@ -117,8 +160,8 @@ def init_service_accounts():
                 cached_accounts = list(current_accounts)
                 for cached_account in cached_accounts:
                     log.debug(f"Checking for cached service account file '{cached_account}' for remote '{uploader_remote}'")
-                    if not cached_account.startswith(os.path.normpath(uploader_config['service_account_path'])):
-                        log.debug(f"Cached service account file '{cached_account}' for remote '{uploader_remote}' is not located in specified service_account_path ('{uploader_config['service_account_path']}'). Removing from available accounts.")
+                    if not cached_account.startswith(os.path.normpath(uploader_config.service_account_path)):
+                        log.debug(f"Cached service account file '{cached_account}' for remote '{uploader_remote}' is not located in specified service_account_path ('{uploader_config.service_account_path}'). Removing from available accounts.")
                         current_accounts.pop(cached_account)
                     if not os.path.exists(cached_account):
                         log.debug(f"Cached service account file '{cached_account}' for remote '{uploader_remote}' could not be located. Removing from available accounts.")
@@ -141,13 +184,11 @@ def init_service_accounts():
 
 def init_syncers():
     try:
-        for syncer_name, syncer_config in conf.configs['syncer'].items():
-            # remove irrelevant parameters before loading syncer agent
-            filtered_config = syncer_config.copy()
-            filtered_config.pop('sync_interval', None)
-            filtered_config['syncer_name'] = syncer_name
-            # load syncer agent
-            syncer.load(**filtered_config)
+        for syncer_name, syncer_config in conf.model.syncers.items():
+            # load syncer agent, the compiled options already leave out sync_interval
+            syncer.load(service=syncer_config.service, tool_path=syncer_config.tool_path,
+                        sync_from=syncer_config.sync_from.name, sync_to=syncer_config.sync_to.name,
+                        syncer_name=syncer_name, **syncer_config.options)
     except Exception:
         log.exception("Exception initializing syncer agents: ")
 
@@ -228,14 +269,6 @@ def check_suspended_syncers(syncer_to_check=None):
     return suspended
 
 
-def run_process(task, manager_dict, **kwargs):
-    try:
-        new_process = Process(target=task, args=(manager_dict,), kwargs=kwargs)
-        return new_process.start()
-    except Exception:
-        log.exception("Exception starting process with kwargs=%r: ", kwargs)
-
-
 ############################################################
 # DOER FUNCS
 ############################################################
@@ -243,46 +276,55 @@ def run_process(task, manager_dict, **kwargs):
 
 @decorators.timed
 def do_upload(remote=None):
-    global plex_monitor_thread, uploader_delay
+    global plex_monitor_thread, bandwidth_schedule_thread, uploader_delay
     global sa_delay
 
-    nzbget = None
     nzbget_paused = False
-
-    sabnzbd = None
     sabnzbd_paused = False
+    download_controller = None
 
     lock_file = lock.upload()
     if lock_file.is_locked():
-        log.info("Waiting for running upload to finish before proceeding...")
+        log.info(f"Waiting for running upload (pid {lock_file.holder()}) to finish before proceeding...")
 
-    with lock_file:
+    with state.jobs.run('upload', None, lock_file) as upload_job:
         log.info("Starting upload")
         try:
             # loop each supplied uploader config
-            for uploader_remote, uploader_config in conf.configs['uploader'].items():
+            for uploader_remote, uploader_config in conf.model.uploaders.items():
                 # if remote is not None, skip this remote if it is not == remote
                 if remote and uploader_remote != remote:
                     continue
 
                 # retrieve rclone config for this remote
-                rclone_config = conf.configs['remotes'][uploader_remote]
+                rclone_config = uploader_config.remote
 
-                # send notification that upload is starting
-                notify.send(message=f"Upload of {path.get_size(rclone_config['upload_folder'], uploader_config['size_excludes'])} GB has begun for remote: {uploader_remote}")
+                # send notification that upload is starting, only walk the upload folder when someone will read it
+                if notify.workers:
+                    notify.send(message=f"Upload of {path.get_size(rclone_config.upload_folder, uploader_config.size_excludes)} GB has begun for remote: {uploader_remote}")
 
                 # start the plex stream monitor before the upload begins, if enabled for both plex and the uploader
-                if conf.configs['plex']['enabled'] and plex_monitor_thread is None:
-                    # Only disable throttling if 'can_be_throttled' is both present in uploader_config and is set to False.
-                    if 'can_be_throttled' in uploader_config and not uploader_config['can_be_throttled']:
+                if conf.model.plex.enabled and plex_monitor_thread is None:
+                    # Only disable throttling if 'can_be_throttled' is set to False for this uploader.
+                    if not uploader_config.can_be_throttled:
                         log.debug(f"Skipping check for Plex stream due to throttling disabled in remote: {uploader_remote}")
                     # Otherwise, assume throttling is desired.
                     else:
                         plex_monitor_thread = thread.start(do_plex_monitor, 'plex-monitor')
 
+                # move the running rclones to the rate of each new time in the bandwidth schedule, if it has one
+                if uploader_config.bandwidth_schedule is not None and bandwidth_schedule_thread is None:
+                    bandwidth_schedule_thread = thread.start(do_bandwidth_schedule, 'bandwidth-schedule')
+
+                # limit the download clients to what the upload leaves free, if enabled
+                download_clients = [client for client in (nzbget, sabnzbd) if client is not None]
+                if conf.configs['download_control']['enabled'] and download_clients:
+                    download_controller = DownloadController(conf.configs['download_control'], download_clients,
+                                                             rc.jobs, rclone_config.upload_folder)
+                    download_controller.start()
+
                 # pause the nzbget queue before starting the upload, if enabled
-                if conf.configs['nzbget']['enabled']:
-                    nzbget = Nzbget(conf.configs['nzbget']['url'])
+                elif nzbget is not None:
                     if nzbget.pause_queue():
                         nzbget_paused = True
                         log.info("Paused the Nzbget download queue, upload commencing!")
@@ -292,32 +334,50 @@ def do_upload(remote=None):
                         notify.send(message="Failed to pause the Nzbget download queue, upload commencing anyway...")
 
                 # pause the sabnzbd queue before starting the upload, if enabled
-                if conf.configs['sabnzbd']['enabled']:
-                    sabnzbd = Sabnzbd(conf.configs['sabnzbd']['url'], conf.configs['sabnzbd']['apikey'])
+                if download_controller is None and sabnzbd is not None:
                     if sabnzbd.pause_queue():
                         sabnzbd_paused = True
                         log.info("Paused the Sabnzbd download queue, upload commencing!")
                         notify.send(message="Paused the Sabnzbd download queue, upload commencing!")
                     else:
-                        print(sabnzbd.pause_queue())
                         log.error("Failed to pause the Sabnzbd download queue, upload commencing anyway...")
                         notify.send(message="Failed to pause the Sabnzbd download queue, upload commencing anyway...")
 
-                uploader = Uploader(uploader_remote,
-                                    uploader_config,
-                                    rclone_config,
-                                    conf.configs['core']['rclone_binary_path'],
-                                    conf.configs['core']['rclone_config_path'],
-                                    conf.configs['plex'],
-                                    conf.configs['core']['dry_run'])
+                uploader = Uploader(uploader_config,
+                                    conf.model.core.rclone_binary_path,
+                                    conf.model.core.rclone_config_path,
+                                    conf.model.core.dry_run,
+                                    ledger,
+                                    listing,
+                                    leases)
+
+                # move from staging remote to main ?, the mover settings were validated when the config loaded
+                mover = None
+                mover_config = uploader_config.mover
+                if mover_config is not None and mover_config.enabled:
+                    if mover_config.incremental and not rclone_config.logs_transfers:
+                        log.warning(f"Rclone does not report the files it uploads to {uploader_remote}, the mover will move all of {mover_config.move_from_remote}")
+                    # incremental moves run in the background as each upload batch finishes
+                    mover = RcloneMover(mover_config,
+                                        conf.model.core.rclone_binary_path,
+                                        conf.model.core.rclone_config_path,
+                                        conf.model.core.dry_run,
+                                        rclone_config.upload_remote if rclone_config.logs_transfers else None,
+                                        listing)
 
                 if sa_delay[uploader_remote] is not None:
+                    if leases is not None:
+                        # accounts banned by the other hosts are skipped here too
+                        sa_delay[uploader_remote] = leases.merge_bans(sa_delay[uploader_remote])
                     available_accounts = [account for account, last_ban_time in sa_delay[uploader_remote].items() if
                                           last_ban_time is None]
                     available_accounts_size = len(available_accounts)
 
                     if available_accounts_size:
                         available_accounts = misc.sorted_list_by_digit_asc(available_accounts)
+                        if leases is not None:
+                            # the accounts the hosts used least today go first
+                            available_accounts = leases.order(available_accounts)
 
                     log.info(f"There is {available_accounts_size} available service accounts")
                     log.debug(f"Available service accounts: {str(available_accounts)}")
@@ -330,18 +390,56 @@ def do_upload(remote=None):
                         log.info(f"Lowest Remaining time till unban is {time_till_unban}")
                         uploader_delay[uploader_remote] = time_till_unban
                     else:
+                        used = -1
+                        # the accounts skipped since the last upload, all of them when the loop runs out this way
+                        leased_elsewhere = []
                         for i in range(available_accounts_size):
-                            uploader.set_service_account(available_accounts[i])
-                            resp_delay, resp_trigger, resp_success = uploader.upload()
+                            if i <= used:
+                                # the running rclone was already switched over to this account
+                                continue
+                            if leases is not None and not leases.acquire(available_accounts[i]):
+                                log.info(f"Service account {available_accounts[i]} is in use by another host, skipping it")
+                                leased_elsewhere.append(available_accounts[i])
+                                continue
+                            leased_elsewhere = []
+                            uploader.set_service_account(available_accounts[i], available_accounts[i + 1:])
+                            if upload_job.state == state.ROTATING:
+                                upload_job.set(state.RUNNING)
+                            try:
+                                resp_delay, resp_trigger, resp_success = uploader.upload()
+                            finally:
+                                if leases is not None:
+                                    # the next account is leased before it is used, these are done with
+                                    for account in {available_accounts[i], uploader.service_account,
+                                                    *(swapped[0] for swapped in uploader.swapped)}:
+                                        leases.release(account)
+                            if mover is not None:
+                                mover.start(uploader.transferred.take())
+                            for swapped_account, swapped_delay, swapped_trigger in uploader.swapped:
+                                current_data = sa_delay[uploader_remote]
+                                current_data[swapped_account] = time.time() + ((60 * 60) * swapped_delay)
+                                sa_delay[uploader_remote] = current_data
+                                log.debug(f"Setting account {swapped_account} as unbanned at {sa_delay[uploader_remote][swapped_account]}")
+                                if leases is not None:
+                                    leases.ban(swapped_account, current_data[swapped_account], swapped_trigger)
+                                notify.send(message=f"Upload for remote: {uploader_remote} switched service_account file away from: {os.path.basename(swapped_account)} due to trigger {swapped_trigger}",
+                                            coalesce=f'sa-rotation-{uploader_remote}')
+                            # carry on from the account the upload ended with
+                            i = used = available_accounts.index(uploader.service_account)
                             if resp_delay:
                                 current_data = sa_delay[uploader_remote]
                                 current_data[available_accounts[i]] = time.time() + ((60 * 60) * resp_delay)
                                 sa_delay[uploader_remote] = current_data
                                 log.debug(f"Setting account {available_accounts[i]} as unbanned at {sa_delay[uploader_remote][available_accounts[i]]}")
+                                if leases is not None:
+                                    leases.ban(available_accounts[i], current_data[available_accounts[i]], resp_trigger)
                                 if i != (len(available_accounts) - 1):
                                     log.info(f"Upload aborted due to trigger: {resp_trigger} being met, {uploader_remote} is cycling to service_account file: {available_accounts[i + 1]}")
+                                    notify.send(message=f"Upload for remote: {uploader_remote} is cycling to service_account file: {os.path.basename(available_accounts[i + 1])} due to trigger {resp_trigger}",
+                                                coalesce=f'sa-rotation-{uploader_remote}')
                                     # Set unban time for current service account
                                     log.debug(f"Setting service account {available_accounts[i]} as banned for remote: {uploader_remote}")
+                                    upload_job.set(state.ROTATING, resp_trigger)
                                     continue
                                 else:
                                     # non 0 result indicates a trigger was met, the result is how many hours
@@ -374,8 +472,18 @@ def do_upload(remote=None):
                                 # Remove ban for service account
                                 sa_delay[uploader_remote][available_accounts[i]] = None
                                 break
+                        else:
+                            if leased_elsewhere:
+                                # retry once the first of them is free, rather than every check interval
+                                lease_expiry = leases.expiry(leased_elsewhere) or time.time() + 60
+                                log.info(f"Upload aborted because every remaining service account for remote "
+                                         f"{uploader_remote} is leased by another host, trying again in "
+                                         f"{misc.seconds_to_string(max(int(lease_expiry - time.time()), 1))}")
+                                uploader_delay[uploader_remote] = lease_expiry
                 else:
                     resp_delay, resp_trigger, resp_success = uploader.upload()
+                    if mover is not None:
+                        mover.start(uploader.transferred.take())
                     if resp_delay:
                         if uploader_remote not in uploader_delay:
                             # this uploader was not already in the delay dict, so lets put it there
@@ -405,11 +513,16 @@ def do_upload(remote=None):
                             log.info(f"{uploader_remote} is no longer suspended due to a previous aborted upload!")
 
                 # remove leftover empty directories from disk
-                if not conf.configs['core']['dry_run']:
+                if not conf.model.core.dry_run:
                     uploader.remove_empty_dirs()
 
+                # hand the full link back to the download clients, if they were being limited
+                if download_controller is not None:
+                    download_controller.stop()
+                    download_controller = None
+
                 # resume the nzbget queue, if enabled
-                if conf.configs['nzbget']['enabled'] and nzbget is not None and nzbget_paused:
+                if nzbget is not None and nzbget_paused:
                     if nzbget.resume_queue():
                         nzbget_paused = False
                         log.info("Resumed the Nzbget download queue!")
@@ -418,7 +531,7 @@ def do_upload(remote=None):
                         log.error("Failed to resume the Nzbget download queue??")
                         notify.send(message="Failed to resume the Nzbget download queue??")
                 # resume the Sabnzbd queue, if enabled
-                if conf.configs['sabnzbd']['enabled'] and sabnzbd is not None and sabnzbd_paused:
+                if sabnzbd is not None and sabnzbd_paused:
                     if sabnzbd.resume_queue():
                         sabnzbd_paused = False
                         log.info("Resumed the Sabnzbd download queue!")
@@ -427,205 +540,252 @@ def do_upload(remote=None):
                         log.error("Failed to resume the Sabnzbd download queue??")
                         notify.send(message="Failed to resume the Sabnzbd download queue??")
 
-                # move from staging remote to main ?
-                if 'mover' in uploader_config and 'enabled' in uploader_config['mover']:
-                    if not uploader_config['mover']['enabled']:
-                        # if not enabled, continue the uploader loop
-                        continue
-
-                    # validate we have the bare minimum config settings set
-                    required_configs = ['move_from_remote', 'move_to_remote', 'rclone_extras']
-                    required_set = True
-                    for setting in required_configs:
-                        if setting not in uploader_config['mover']:
-                            log.error(f"Unable to act on '{uploader_remote}' mover because there was no '{setting}' setting in the mover configuration")
-                            required_set = False
-                            break
-
-                    # do move if good
-                    if required_set:
-                        mover = RcloneMover(uploader_config['mover'],
-                                            conf.configs['core']['rclone_binary_path'],
-                                            conf.configs['core']['rclone_config_path'],
-                                            conf.configs['plex'],
-                                            conf.configs['core']['dry_run'])
-                        log.info(f"Move starting from {uploader_config['mover']['move_from_remote']} -> {uploader_config['mover']['move_to_remote']}")
-
-                        # send notification that mover has started
-                        notify.send(message=f"Move has started for {uploader_config['mover']['move_from_remote']} -> {uploader_config['mover']['move_to_remote']}")
-
-                        if mover.move():
-                            log.info(f"Move completed successfully from {uploader_config['mover']['move_from_remote']} -> {uploader_config['mover']['move_to_remote']}")
-                            # send notification move has finished
-                            notify.send(message=f"Move finished successfully for {uploader_config['mover']['move_from_remote']} -> {uploader_config['mover']['move_to_remote']}")
+                # finish moving from staging remote to main
+                if mover is not None:
+                    log.info(f"Move starting from {mover_config.move_from_remote} -> {mover_config.move_to_remote}")
 
-                        else:
-                            log.error(f"Move failed from {uploader_config['mover']['move_from_remote']} -> {uploader_config['mover']['move_to_remote']} ....?")
-                            # send notification move has failed
-                            notify.send(message=f"Move failed for {uploader_config['mover']['move_from_remote']} -> {uploader_config['mover']['move_to_remote']}")
+                    # send notification that mover has started
+                    notify.send(message=f"Move has started for {mover_config.move_from_remote} -> {mover_config.move_to_remote}")
+
+                    if mover.finish():
+                        log.info(f"Move completed successfully from {mover_config.move_from_remote} -> {mover_config.move_to_remote}")
+                        # send notification move has finished
+                        notify.send(message=f"Move finished successfully for {mover_config.move_from_remote} -> {mover_config.move_to_remote}")
+
+                    else:
+                        log.error(f"Move failed from {mover_config.move_from_remote} -> {mover_config.move_to_remote} ....?")
+                        # send notification move has failed
+                        notify.send(message=f"Move failed for {mover_config.move_from_remote} -> {mover_config.move_to_remote}")
 
         except Exception:
             log.exception("Exception occurred while uploading: ")
             notify.send(message="Exception occurred while uploading: ")
+            if download_controller is not None:
+                download_controller.stop()
 
     log.info("Finished upload")
 
 
 @decorators.timed
 def do_sync(use_syncer=None):
-    global syncer_delay
+    syncers = [(sync_name, sync_config) for sync_name, sync_config in conf.model.syncers.items()
+               # if syncer is not None, skip this syncer if not == syncer
+               if not use_syncer or sync_name == use_syncer]
+    if not syncers:
+        return
+
+    log.info("Starting sync")
+    if len(syncers) == 1:
+        record_sync_result(do_syncer(*syncers[0]))
+    else:
+        # every syncer holds its own lock, independent syncers no longer wait for each other
+        workers = min(conf.model.core.max_concurrent_syncers, len(syncers))
+        log.info(f"Running {len(syncers)} syncers, {workers} at a time")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='syncer') as executor:
+            futures = [executor.submit(do_syncer, sync_name, sync_config) for sync_name, sync_config in syncers]
+            for future in as_completed(futures):
+                record_sync_result(future.result())
+    log.info("Finished sync")
+
+
+def do_syncer(sync_name, sync_config):
+    """ runs one syncer from startup to destroy, the outcome is returned for record_sync_result """
+    result = {'syncer': sync_name, 'status': 'failed', 'trigger': None, 'delay': None}
 
-    lock_file = lock.sync()
+    lock_file = lock.sync(sync_name)
     if lock_file.is_locked():
-        log.info("Waiting for running sync to finish before proceeding...")
+        log.info(f"Waiting for running sync of {sync_name} (pid {lock_file.holder()}) to finish before proceeding...")
 
-    with lock_file:
-        log.info("Starting sync")
+    with state.jobs.run('sync', sync_name, lock_file), trace.span('syncer', syncer=sync_name):
         try:
-            for sync_name, sync_config in conf.configs['syncer'].items():
-                # if syncer is not None, skip this syncer if not == syncer
-                if use_syncer and sync_name != use_syncer:
-                    continue
+            # send notification that sync is starting
+            if not sync_config.is_local:
+                notify.send(message=f"Sync initiated for syncer: {sync_name}. {'Creating' if sync_config.instance_destroy else 'Starting'} {sync_config.service} instance...")
+
+            # startup instance
+            resp, instance_id = syncer.startup(service=sync_config.service, name=sync_name)
+            if not resp:
+                # send notification of failure to startup instance
+                notify.send(message=f'Syncer: {sync_name} failed to startup a {"new" if sync_config.instance_destroy else "existing"} instance. Manually check no instances are still running!')
+                return result
+
+            # setup instance
+            resp = syncer.setup(service=sync_config.service, name=sync_name, instance_id=instance_id,
+                                rclone_config=conf.model.core.rclone_config_path)
+            if not resp:
+                # send notification of failure to set up instance
+                notify.send(message=f'Syncer: {sync_name} failed to setup a {"new" if sync_config.instance_destroy else "existing"} instance. Manually check no instances are still running!')
+                return result
+
+            # send notification of sync start
+            notify.send(message=f'Sync has begun for syncer: {sync_name}')
+
+            # do sync
+            resp, resp_delay, resp_trigger = syncer.sync(service=sync_config.service, name=sync_name,
+                                                         instance_id=instance_id, dry_run=conf.model.core.dry_run,
+                                                         rclone_config=conf.model.core.rclone_config_path,
+                                                         cache_file=conf.settings['cachefile'])
+
+            if not resp and not resp_delay:
+                log.error("Sync unexpectedly failed for syncer: %s", sync_name)
+                # send unexpected sync fail notification
+                notify.send(message=f'Sync failed unexpectedly for syncer: {sync_name}. Manually check no instances are still running!')
+
+            elif not resp and resp_trigger:
+                # non 0 resp_delay result indicates a trigger was met, the result is how many hours to sleep
+                result.update(status='aborted', trigger=resp_trigger, delay=resp_delay)
+            else:
+                log.info(f"Syncing completed successfully for syncer: {sync_name}")
+                # send successful sync notification
+                notify.send(message=f"Sync was completed successfully for syncer: {sync_name}")
+                result['status'] = 'completed'
+
+            # destroy instance
+            resp = syncer.destroy(service=sync_config.service, name=sync_name, instance_id=instance_id)
+            if not resp and not sync_config.is_local:
+                # send notification of failure to destroy/stop instance
+                notify.send(message=f"Syncer: {sync_name} failed to {'destroy' if sync_config.instance_destroy else 'stop'} its instance: {instance_id}. Manually check no instances are still running!")
+            elif not sync_config.is_local:
+                notify.send(
+                    message=f"Syncer: {sync_name} has {'destroyed' if sync_config.instance_destroy else 'stopped'} its {sync_config.service} instance")
 
-                # send notification that sync is starting
-                if sync_config['service'].lower() != 'local':
-                    notify.send(message=f"Sync initiated for syncer: {sync_name}. {'Creating' if sync_config['instance_destroy'] else 'Starting'} {sync_config['service']} instance...")
+        except Exception:
+            log.exception(f"Exception occurred while syncing {sync_name}: ")
 
-                # startup instance
-                resp, instance_id = syncer.startup(service=sync_config['service'], name=sync_name)
-                if not resp:
-                    # send notification of failure to startup instance
-                    notify.send(message=f'Syncer: {sync_name} failed to startup a {"new" if sync_config["instance_destroy"] else "existing"} instance. Manually check no instances are still running!')
-                    continue
+    return result
 
-                # setup instance
-                resp = syncer.setup(service=sync_config['service'], instance_id=instance_id,
-                                    rclone_config=conf.configs['core']['rclone_config_path'])
-                if not resp:
-                    # send notification of failure to set up instance
-                    notify.send(message=f'Syncer: {sync_name} failed to setup a {"new" if sync_config["instance_destroy"] else "existing"} instance. Manually check no instances are still running!')
-                    continue
 
-                # send notification of sync start
-                notify.send(message=f'Sync has begun for syncer: {sync_name}')
-
-                # do sync
-                resp, resp_delay, resp_trigger = syncer.sync(service=sync_config['service'], instance_id=instance_id,
-                                                             dry_run=conf.configs['core']['dry_run'],
-                                                             rclone_config=conf.configs['core']['rclone_config_path'])
-
-                if not resp and not resp_delay:
-                    log.error("Sync unexpectedly failed for syncer: %s", sync_name)
-                    # send unexpected sync fail notification
-                    notify.send(message=f'Sync failed unexpectedly for syncer: {sync_name}. Manually check no instances are still running!')
-
-                elif not resp and resp_trigger:
-                    # non 0 resp_delay result indicates a trigger was met, the result is how many hours to sleep
-                    if sync_name not in syncer_delay:
-                        # this syncer was not in the syncer delay dict, so lets put it there
-                        log.info(f"Sync aborted due to trigger: {resp_trigger} being met, {sync_name} will continue automatic syncing normally in {resp_delay} hours")
-                        # add syncer to syncer_delay
-                        syncer_delay[sync_name] = time.time() + 60 ** 2 * resp_delay
-                        # send aborted sync notification
-                        notify.send(message=f"Sync was aborted for syncer: {sync_name} due to trigger {resp_trigger}. Syncs suspended for {resp_delay} hours")
-                    else:
-                        # this syncer was already in the syncer delay dict, so lets not delay it any further
-                        log.info(f"Sync aborted due to trigger: {resp_trigger} being met for {sync_name} syncer")
-                        # send aborted sync notification
-                        notify.send(message=f"Sync was aborted for syncer: {sync_name} due to trigger {resp_trigger}.")
-                else:
-                    log.info(f"Syncing completed successfully for syncer: {sync_name}")
-                    # send successful sync notification
-                    notify.send(message=f"Sync was completed successfully for syncer: {sync_name}")
-                    # remove syncer from syncer_delay(as its no longer banned)
-                    if sync_name in syncer_delay and syncer_delay.pop(sync_name, None) is not None:
-                        # this syncer was in the delay dict, but sync was successful, lets remove it
-                        log.info(f"{sync_name} is no longer suspended due to a previous aborted sync!")
-
-                # destroy instance
-                resp = syncer.destroy(service=sync_config['service'], instance_id=instance_id)
-                if not resp and sync_config['service'].lower() != 'local':
-                    # send notification of failure to destroy/stop instance
-                    notify.send(message=f"Syncer: {sync_name} failed to {'destroy' if sync_config['instance_destroy'] else 'stop'} its instance: {instance_id}. Manually check no instances are still running!")
-                elif sync_config['service'].lower() != 'local':
-                    notify.send(
-                        message=f"Syncer: {sync_name} has {'destroyed' if sync_config['instance_destroy'] else 'stopped'} its {sync_config['service']} instance")
+def record_sync_result(result):
+    """ update the syncer bans with the outcome of do_syncer, always in the cloudplow process owning the cache """
+    global syncer_delay
 
-        except Exception:
-            log.exception("Exception occurred while syncing: ")
+    sync_name = result['syncer']
+    if listing is not None and not conf.model.core.dry_run:
+        # whatever the sync changed on its destination, even one that failed part way, is not in the cached listings
+        listing.forget(conf.model.syncers[sync_name].sync_to.sync_remote)
+        listing.added(conf.model.syncers[sync_name].sync_to.sync_remote, is_dir=True)
+
+    if result['status'] == 'aborted':
+        if sync_name not in syncer_delay:
+            # this syncer was not in the syncer delay dict, so lets put it there
+            log.info(f"Sync aborted due to trigger: {result['trigger']} being met, {sync_name} will continue automatic syncing normally in {result['delay']} hours")
+            # add syncer to syncer_delay
+            syncer_delay[sync_name] = time.time() + 60 ** 2 * result['delay']
+            # send aborted sync notification
+            notify.send(message=f"Sync was aborted for syncer: {sync_name} due to trigger {result['trigger']}. Syncs suspended for {result['delay']} hours")
+        else:
+            # this syncer was already in the syncer delay dict, so lets not delay it any further
+            log.info(f"Sync aborted due to trigger: {result['trigger']} being met for {sync_name} syncer")
+            # send aborted sync notification
+            notify.send(message=f"Sync was aborted for syncer: {sync_name} due to trigger {result['trigger']}.")
 
-    log.info("Finished sync")
+    elif result['status'] == 'completed':
+        # remove syncer from syncer_delay(as its no longer banned)
+        if sync_name in syncer_delay and syncer_delay.pop(sync_name, None) is not None:
+            # this syncer was in the delay dict, but sync was successful, lets remove it
+            log.info(f"{sync_name} is no longer suspended due to a previous aborted sync!")
 
 
 @decorators.timed
 def do_hidden():
     lock_file = lock.hidden()
     if lock_file.is_locked():
-        log.info("Waiting for running hidden cleaner to finish before proceeding...")
+        log.info(f"Waiting for running hidden cleaner (pid {lock_file.holder()}) to finish before proceeding...")
 
-    with lock_file:
+    with state.jobs.run('hidden', None, lock_file):
         log.info("Starting hidden cleaning")
         try:
             # loop each supplied hidden folder
-            for hidden_folder, hidden_config in conf.configs['hidden'].items():
-                hidden = UnionfsHiddenFolder(hidden_folder, conf.configs['core']['dry_run'],
-                                             conf.configs['core']['rclone_binary_path'],
-                                             conf.configs['core']['rclone_config_path'])
-
-                # loop the chosen remotes for this hidden config cleaning files
-                for hidden_remote_name in hidden_config['hidden_remotes']:
-                    # retrieve rclone config for this remote
-                    hidden_remote_config = conf.configs['remotes'][hidden_remote_name]
+            for hidden_config in conf.model.hidden:
+                hidden = UnionfsHiddenFolder(hidden_config.folder, conf.model.core.dry_run,
+                                             conf.model.core.rclone_binary_path,
+                                             conf.model.core.rclone_config_path,
+                                             listing,
+                                             cache.get_cache('hidden_progress'))
 
-                    # clean remote
-                    clean_resp, deleted_ok, deleted_fail = hidden.clean_remote(hidden_remote_name, hidden_remote_config)
+                # clean the chosen remotes, each HIDDEN~ file is removed from disk once all of them confirmed it
+                results = hidden.clean(hidden_config.remotes)
 
-                    # send notification
+                # send notification
+                for hidden_remote_name, (deleted_ok, deleted_fail, _) in results.items():
                     if deleted_ok or deleted_fail:
                         notify.send(message=f"Cleaned {deleted_ok} hidden(s) with {deleted_fail} failure(s) from remote: {hidden_remote_name}")
 
-                # remove the HIDDEN~ files from disk and empty directories from unionfs-fuse folder
-                if not conf.configs['core']['dry_run']:
-                    hidden.remove_local_hidden()
-                    hidden.remove_empty_dirs()
-
         except Exception:
             log.exception("Exception occurred while cleaning hiddens: ")
 
     log.info("Finished hidden cleaning")
 
 
+def do_where(item):
+    uploads = ledger.where(item)
+    if not uploads:
+        log.info(f"No upload of '{item}' in the ledger")
+        return
+
+    for upload in uploads:
+        uploaded = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(upload['uploaded']))
+        account = f" with service account {upload['account']}" if upload['account'] else ''
+        log.info(f"{upload['local_path']} ({upload['size']} bytes) was uploaded to {upload['remote_path']} "
+                 f"on {uploaded}{account}")
+
+
+def do_bandwidth_schedule():
+    global bandwidth_schedule_thread
+
+    schedules = {name: uploader_config.bandwidth_schedule for name, uploader_config in conf.model.uploaders.items()
+                 if uploader_config.bandwidth_schedule is not None}
+    # the jobs are shared with the Plex monitor, each job runs at the lower of its throttle and its schedule
+    rclone = RcloneThrottler(rc.jobs)
+    log.info(f"Applying the bandwidth schedule(s) of {', '.join(schedules)} to running uploads")
+
+    upload_job = state.jobs.get('upload')
+    while upload_job is not None and not upload_job.done:
+        for name, rates in schedules.items():
+            rclone.schedule(name, rates.rate_at())
+        # times are whole minutes, new jobs start at the current rate and anything that failed is retried
+        upload_job.wait(60 - time.time() % 60)
+
+    log.info("Finished applying bandwidth schedule(s)!")
+    bandwidth_schedule_thread = None
+
+
 @decorators.timed
 def do_plex_monitor():
     global plex_monitor_thread
+    from utils.plex import Plex
+
+    upload_job = state.jobs.get('upload')
 
     # create the plex object
-    plex = Plex(conf.configs['plex']['url'], conf.configs['plex']['token'])
+    plex = Plex(conf.model.plex.url, conf.model.plex.token)
     if not plex.validate():
         log.error("Aborting Plex Media Server stream monitor due to failure to validate supplied server URL and/or Token.")
         plex_monitor_thread = None
         return
 
     # sleep 15 seconds to allow rclone to start
-    log.info("Plex Media Server URL + Token were validated. Sleeping for 15 seconds before checking Rclone RC URL.")
-    time.sleep(15)
+    log.info("Plex Media Server URL + Token were validated. Sleeping for 15 seconds before checking Rclone RC endpoints.")
+    if upload_job is None or upload_job.wait(15):
+        log.info("Upload finished before stream monitoring for Plex Media Server began.")
+        plex_monitor_thread = None
+        return
 
-    # create the rclone throttle object
-    rclone = RcloneThrottler(conf.configs['plex']['rclone']['url'])
+    # create the rclone throttle object, it throttles every registered rclone job
+    rclone = RcloneThrottler(rc.jobs)
     if not rclone.validate():
-        log.error("Aborting Plex Media Server stream monitor due to failure to validate supplied Rclone RC URL.")
+        log.error("Aborting Plex Media Server stream monitor due to failure to validate any Rclone RC endpoint.")
         plex_monitor_thread = None
         return
     else:
-        log.info("Rclone RC URL was validated. Stream monitoring for Plex Media Server will now begin.")
+        log.info("Rclone RC endpoints were validated. Stream monitoring for Plex Media Server will now begin.")
 
     throttled = False
     throttle_speed = None
-    lock_file = lock.upload()
-    while lock_file.is_locked():
+    while upload_job is not None and not upload_job.done:
         streams = plex.get_streams()
         if streams is None:
-            log.error(f"Failed to check Plex Media Server stream(s). Trying again in {conf.configs['plex']['poll_interval']} seconds...")
+            log.error(f"Failed to check Plex Media Server stream(s). Trying again in {conf.model.plex.poll_interval} seconds...")
         else:
             # we had a response
             stream_count = sum(
@@ -638,55 +798,59 @@ def do_plex_monitor():
             )
 
             # if we are accounting for local streams, add them to the stream count
-            if not conf.configs['plex']['ignore_local_streams']:
+            if not conf.model.plex.ignore_local_streams:
                 stream_count += local_stream_count
 
             # are we already throttled?
             if ((not throttled or (throttled and not rclone.throttle_active(throttle_speed))) and (
-                    stream_count >= conf.configs['plex']['max_streams_before_throttle'])):
+                    stream_count >= conf.model.plex.max_streams_before_throttle)):
                 log.info(f"There was {stream_count} playing stream(s) on Plex Media Server while it was currently un-throttled.")
                 for stream in streams:
                     log.info(stream)
                 log.info("Upload throttling will now commence.")
 
                 # send throttle request
-                throttle_speed = misc.get_nearest_less_element(conf.configs['plex']['rclone']['throttle_speeds'],
-                                                               stream_count)
+                throttle_speed = conf.model.plex.throttle.speed_for(stream_count)
                 throttled = rclone.throttle(throttle_speed)
+                if throttled:
+                    upload_job.set(state.THROTTLED, f"{stream_count} playing stream(s) on Plex")
 
                 # send notification
-                if throttled and conf.configs['plex']['notifications']:
-                    notify.send(message=f"Throttled current upload to {throttle_speed} because there was {stream_count} playing stream(s) on Plex")
+                if throttled and conf.model.plex.notifications:
+                    notify.send(message=f"Throttled current upload to {throttle_speed} because there was {stream_count} playing stream(s) on Plex",
+                                coalesce='throttle')
 
             elif throttled:
-                if stream_count < conf.configs['plex']['max_streams_before_throttle']:
-                    log.info(f"There was less than {conf.configs['plex']['max_streams_before_throttle']} playing stream(s) on Plex Media Server while it was currently throttled. Removing throttle ...")
+                if stream_count < conf.model.plex.max_streams_before_throttle:
+                    log.info(f"There was less than {conf.model.plex.max_streams_before_throttle} playing stream(s) on Plex Media Server while it was currently throttled. Removing throttle ...")
                     # send un-throttle request
                     throttled = not rclone.no_throttle()
                     throttle_speed = None
+                    if not throttled:
+                        upload_job.set(state.RUNNING, "no more streams on Plex")
 
                     # send notification
-                    if not throttled and conf.configs['plex']['notifications']:
-                        notify.send(message=f"Un-throttled current upload because there was less than {conf.configs['plex']['max_streams_before_throttle']} playing stream(s) on Plex Media Server")
+                    if not throttled and conf.model.plex.notifications:
+                        notify.send(message=f"Un-throttled current upload because there was less than {conf.model.plex.max_streams_before_throttle} playing stream(s) on Plex Media Server",
+                                    coalesce='throttle')
 
-                elif misc.get_nearest_less_element(conf.configs['plex']['rclone']['throttle_speeds'],
-                                                   stream_count) != throttle_speed:
+                elif conf.model.plex.throttle.speed_for(stream_count) != throttle_speed:
                     # throttle speed changed, probably due to more/fewer streams, re-throttle
-                    throttle_speed = misc.get_nearest_less_element(conf.configs['plex']['rclone']['throttle_speeds'],
-                                                                   stream_count)
+                    throttle_speed = conf.model.plex.throttle.speed_for(stream_count)
                     log.info(f"Adjusting throttle speed for current upload to {throttle_speed} because there was now {stream_count} playing stream(s) on Plex Media Server")
 
                     throttled = rclone.throttle(throttle_speed)
 
                     # send notification
-                    if throttled and conf.configs['plex']['notifications']:
-                        notify.send(message=f'Throttle for current upload was adjusted to {throttle_speed} due to {stream_count} playing stream(s) on Plex Media Server')
+                    if throttled and conf.model.plex.notifications:
+                        notify.send(message=f'Throttle for current upload was adjusted to {throttle_speed} due to {stream_count} playing stream(s) on Plex Media Server',
+                                    coalesce='throttle')
 
                 else:
                     log.info(f"There was {stream_count} playing stream(s) on Plex Media Server it was already throttled to {throttle_speed}. Throttling will continue.")
 
-        # the lock_file exists, so we can assume an upload is in progress at this point
-        time.sleep(conf.configs['plex']['poll_interval'])
+        # returns as soon as the upload finishes
+        upload_job.wait(conf.model.plex.poll_interval)
 
     log.info("Finished monitoring Plex stream(s)!")
     plex_monitor_thread = None
@@ -698,66 +862,103 @@ def do_plex_monitor():
 
 def scheduled_uploader(uploader_name, uploader_settings):
     log.debug(f"Scheduled disk check triggered for uploader: {uploader_name}")
-    try:
-        rclone_settings = conf.configs['remotes'][uploader_name]
+    with trace.profile(f'uploader-{uploader_name}'), trace.span('scheduled_uploader', uploader=uploader_name):
+        try:
+            rclone_settings = uploader_settings.remote
 
-        # check suspended uploaders
-        if check_suspended_uploaders(uploader_name):
-            return
+            # check suspended uploaders
+            if check_suspended_uploaders(uploader_name):
+                return
 
-        # clear any banned service accounts
-        check_suspended_sa(uploader_name)
+            # clear any banned service accounts
+            check_suspended_sa(uploader_name)
 
-        # check used disk space
-        used_space = path.get_size(rclone_settings['upload_folder'], uploader_settings['size_excludes'])
+            # check used disk space
+            used_space = path.get_size(rclone_settings.upload_folder, uploader_settings.size_excludes)
 
-        # if disk space is above the limit, clean hidden files then upload
-        if used_space >= uploader_settings['max_size_gb']:
-            log.info(f"Uploader: {uploader_name}. Local folder size is currently {used_space - uploader_settings['max_size_gb']} GB over the maximum limit of {uploader_settings['max_size_gb']} GB")
+            # if disk space is above the limit, clean hidden files then upload
+            if used_space >= uploader_settings.max_size_gb:
+                log.info(f"Uploader: {uploader_name}. Local folder size is currently {used_space - uploader_settings.max_size_gb} GB over the maximum limit of {uploader_settings.max_size_gb} GB")
 
-            # does this uploader have schedule settings
-            if 'schedule' in uploader_settings and uploader_settings['schedule']['enabled']:
-                # there is a schedule set for this uploader, check if we are within the allowed times
-                current_time = time.strftime('%H:%M')
-                if not misc.is_time_between((uploader_settings['schedule']['allowed_from'],
-                                             uploader_settings['schedule']['allowed_until'])):
-                    log.info(f"Uploader: {uploader_name}. The current time {current_time} is not within the allowed upload time periods {uploader_settings['schedule']['allowed_from']} -> {uploader_settings['schedule']['allowed_until']}")
-                    return
+                # does this uploader have schedule settings
+                schedule_settings = uploader_settings.schedule
+                if schedule_settings is not None and schedule_settings.enabled:
+                    # there is a schedule set for this uploader, check if we are within the allowed times
+                    current_time = time.strftime('%H:%M')
+                    if not misc.is_time_between((schedule_settings.allowed_from, schedule_settings.allowed_until)):
+                        log.info(f"Uploader: {uploader_name}. The current time {current_time} is not within the allowed upload time periods {schedule_settings.allowed_from} -> {schedule_settings.allowed_until}")
+                        return
 
-            # clean hidden files
-            do_hidden()
-            # upload
-            do_upload(uploader_name)
+                # clean hidden files
+                do_hidden()
+                # upload
+                do_upload(uploader_name)
 
-        else:
-            log.info(f"Uploader: {uploader_name}. Local folder size is currently {used_space} GB. Still have {uploader_settings['max_size_gb'] - used_space} GB remaining before its eligible to begin uploading...")
+            else:
+                log.info(f"Uploader: {uploader_name}. Local folder size is currently {used_space} GB. Still have {uploader_settings.max_size_gb - used_space} GB remaining before its eligible to begin uploading...")
 
-    except Exception:
-        log.exception(f"Unexpected exception occurred while processing uploader {uploader_name}: ")
+        except Exception:
+            log.exception(f"Unexpected exception occurred while processing uploader {uploader_name}: ")
 
 
 def scheduled_syncer(syncer_name):
+    log.info(f"Scheduled sync triggered for syncer: {syncer_name}")
+    with trace.profile(f'syncer-{syncer_name}'), trace.span('scheduled_syncer', syncer=syncer_name):
+        try:
+            # check suspended syncers
+            if check_suspended_syncers(syncer_name):
+                return
+
+            # do sync
+            do_sync(syncer_name)
+
+        except Exception:
+            log.exception(f"Unexpected exception occurred while processing syncer: {syncer_name}")
+
+
+def supervised_syncer(syncer_name):
+    """ scheduled remote syncers are handed to a worker process, the parent keeps the bans """
     log.info(f"Scheduled sync triggered for syncer: {syncer_name}")
     try:
-        # check suspended syncers
+        # the ban cache is only touched by this process, the worker reports back through the supervisor
         if check_suspended_syncers(syncer_name):
             return
 
-        # do sync
-        do_sync(syncer_name)
+        supervisor.submit(syncer_name, syncer_worker, syncer_name=syncer_name)
 
     except Exception:
         log.exception(f"Unexpected exception occurred while processing syncer: {syncer_name}")
 
 
+def syncer_worker(syncer_name):
+    # runs in the worker process, which exits without running any atexit hooks
+    try:
+        with trace.profile(f'syncer-{syncer_name}'), trace.span('scheduled_syncer', syncer=syncer_name):
+            return do_syncer(syncer_name, conf.model.syncers[syncer_name])
+    finally:
+        notify.stop()
+        trace.tracer.flush()
+        logger.log_queue.stop()
+
+
+def syncer_finished(result):
+    if not result['ok']:
+        log.error(f"Sync worker for {result['name']} failed: {result['error']}")
+        notify.send(message=f"Sync failed unexpectedly for syncer: {result['name']}. Manually check no instances are still running!")
+        return
+
+    log.info(f"Sync worker for {result['name']} finished in {misc.seconds_to_string(int(result['duration']))}")
+    record_sync_result(result['value'])
+
+
 ############################################################
 # MAIN
 ############################################################
 
 
 if __name__ == "__main__":
-    # show the latest version info from git
-    version.check_version()
+    # show the latest version info from git, in the background so it never delays the chosen mode
+    thread.start(version.check_version, 'version-check')
 
     # run chosen mode
     try:
@@ -766,22 +967,25 @@ if __name__ == "__main__":
             log.info("Started in clean mode")
             # init notifications
             init_notifications()
-            do_hidden()
+            with trace.profile('clean'):
+                do_hidden()
         elif conf.args['cmd'] == 'upload':
             log.info("Started in upload mode")
             # init notifications
             init_notifications()
             # initialize service accounts if provided in config
             init_service_accounts()
-            do_hidden()
-            do_upload()
+            with trace.profile('upload'):
+                do_hidden()
+                do_upload()
         elif conf.args['cmd'] == 'sync':
             log.info("Starting in sync mode")
             log.warning("Sync currently has a bug while displaying output to the console. Tail the logfile to view readable logs!")
             # init notifications
             init_notifications()
             init_syncers()
-            do_sync()
+            with trace.profile('sync'):
+                do_sync()
         elif conf.args['cmd'] == 'run':
             log.info("Started in run mode")
 
@@ -791,27 +995,33 @@ if __name__ == "__main__":
             init_service_accounts()
 
             # add uploaders to schedule
-            for uploader, uploader_conf in conf.configs['uploader'].items():
-                schedule.every(uploader_conf['check_interval']).minutes.do(scheduled_uploader, uploader, uploader_conf)
-                log.info(f"Added {uploader} uploader to schedule, checking available disk space every {uploader_conf['check_interval']} minutes")
+            for uploader, uploader_conf in conf.model.uploaders.items():
+                schedule.every(uploader_conf.check_interval).minutes.do(scheduled_uploader, uploader, uploader_conf)
+                log.info(f"Added {uploader} uploader to schedule, checking available disk space every {uploader_conf.check_interval} minutes")
 
-            # add syncers to schedule
+            # add syncers to schedule, remote syncers run in worker processes
             init_syncers()
-            for syncer_name, syncer_conf in conf.configs['syncer'].items():
-                if syncer_conf['service'].lower() == 'local':
-                    schedule.every(syncer_conf['sync_interval']).hours.do(scheduled_syncer, syncer_name=syncer_name)
+            supervisor = Supervisor(conf.model.core.max_concurrent_syncers, on_result=syncer_finished)
+            for syncer_name, syncer_conf in conf.model.syncers.items():
+                if syncer_conf.is_local:
+                    schedule.every(syncer_conf.sync_interval).hours.do(scheduled_syncer, syncer_name=syncer_name)
                 else:
-                    schedule.every(syncer_conf['sync_interval']).hours.do(run_process, scheduled_syncer,
-                                                                          syncer_name=syncer_name)
-                log.info(f"Added {syncer_name} syncer to schedule, syncing every {syncer_conf['sync_interval']} hours")
+                    schedule.every(syncer_conf.sync_interval).hours.do(supervised_syncer, syncer_name=syncer_name)
+                log.info(f"Added {syncer_name} syncer to schedule, syncing every {syncer_conf.sync_interval} hours")
 
             # run schedule
             while True:
                 try:
                     schedule.run_pending()
+                    supervisor.poll()
                 except Exception:
                     log.exception("Unhandled exception occurred while processing scheduled tasks: ")
                 time.sleep(1)
+        elif conf.args['cmd'] == 'where':
+            if not conf.args['item']:
+                log.error("Give the local path, remote path or file name to look up in the upload ledger")
+                exit(1)
+            do_where(conf.args['item'])
         elif conf.args['cmd'] == 'update_config':
             exit(0)
         else:
@@ -821,3 +1031,11 @@ if __name__ == "__main__":
         log.info("cloudplow was interrupted by Ctrl + C")
     except Exception:
         log.exception("Unexpected fatal exception occurred: ")
+    finally:
+        # wait for sync workers, deliver any queued notifications, write the spans of unfinished jobs and flush the
+        # log queue before exiting
+        if supervisor is not None:
+            supervisor.stop()
+        notify.stop()
+        trace.tracer.flush()
+        logger.log_queue.stop()
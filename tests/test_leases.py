@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from utils.leases import AccountLeases
+
+ACCOUNT = '/opt/cloudplow/service_accounts/sa01.json'
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / 'leases.db')
+    opened = []
+
+    def open_store(holder, ttl=60):
+        leases = AccountLeases(path, holder=holder, ttl=ttl)
+        opened.append(leases)
+        return leases
+
+    yield open_store
+    for leases in opened:
+        leases.close()
+
+
+def test_an_account_is_leased_to_one_host_at_a_time(store):
+    first, second = store('host1'), store('host2')
+    assert first.acquire(ACCOUNT)
+    # other hosts keep the same accounts elsewhere, they are told apart by file name
+    assert not second.acquire('/srv/sa/sa01.json')
+    # the holder can lease it again
+    assert first.acquire(ACCOUNT)
+    assert second.acquire('/srv/sa/sa02.json')
+
+
+def test_a_released_account_can_be_leased_by_another_host(store):
+    first, second = store('host1'), store('host2')
+    assert first.acquire(ACCOUNT)
+    second.release(ACCOUNT)
+    # only the holder releases a lease
+    assert not second.acquire(ACCOUNT)
+    first.release(ACCOUNT)
+    assert second.acquire(ACCOUNT)
+    assert second.expiry([ACCOUNT]) is None
+
+
+def test_a_lease_runs_out_when_it_is_not_renewed(store):
+    first, second = store('host1', ttl=0.3), store('host2')
+    assert first.acquire(ACCOUNT)
+    # a host that died without releasing, nothing renews it any more
+    first.stopped.set()
+    expiry = second.expiry([ACCOUNT])
+    assert expiry is not None and time.time() < expiry <= time.time() + 0.3
+    assert not second.acquire(ACCOUNT)
+
+    time.sleep(0.4)
+    assert second.expiry([ACCOUNT]) is None
+    assert second.acquire(ACCOUNT)
+
+
+def test_a_live_holder_renews_its_lease(store):
+    first, second = store('host1', ttl=0.3), store('host2')
+    assert first.acquire(ACCOUNT)
+    # three times the ttl, renewed every third of it
+    time.sleep(0.9)
+    assert not second.acquire(ACCOUNT)
+    assert second.expiry([ACCOUNT]) > time.time()
+
+
+def test_closing_releases_every_lease(store):
+    first, second = store('host1'), store('host2')
+    assert first.acquire(ACCOUNT) and first.acquire('sa02.json')
+    first.close()
+    assert second.acquire(ACCOUNT) and second.acquire('sa02.json')
@@ -0,0 +1,62 @@
+import socket
+
+import pytest
+
+from utils import rc
+
+
+@pytest.fixture
+def taken_port():
+    # another process listening on the configured rc port
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        yield sock.getsockname()[1]
+
+
+def fake_rclone(monkeypatch, failures):
+    """ rclone failing to listen on its rc address the first failures times it is started """
+    started = []
+
+    def execute(cmd, callback=None, env=None, logs=True, shell=False, job=None):
+        addr = next(arg.split('=', 1)[1] for arg in cmd if arg.startswith('--rc-addr='))
+        started.append(addr)
+        if len(started) <= failures:
+            callback(f"ERROR : Failed to start remote control: failed to init server: listen tcp {addr}: bind: "
+                     f"address already in use")
+            return 1
+        callback('INFO  : Movie.mkv: Copied (new)')
+        return 0
+
+    monkeypatch.setattr(rc.process, 'execute', execute)
+    return started
+
+
+def test_a_taken_configured_port_is_not_used(taken_port):
+    jobs = rc.RcloneJobs()
+    jobs.configure(f'http://127.0.0.1:{taken_port}')
+    job = jobs.register('upload')
+    assert job.addr != f'127.0.0.1:{taken_port}'
+    # nor is the port of a job still running
+    assert jobs.register('upload').addr != job.addr
+
+
+def test_rclone_is_started_again_when_its_port_was_taken(monkeypatch):
+    jobs = rc.RcloneJobs()
+    jobs.configure('http://127.0.0.1:5572')
+    started = fake_rclone(monkeypatch, failures=1)
+    lines = []
+
+    assert jobs.execute(['rclone', 'move'], lambda data, job: lines.append((data, job.name)), 'upload') == 0
+    assert len(started) == 2
+    assert lines[-1] == ('INFO  : Movie.mkv: Copied (new)', 'upload#2')
+    assert jobs.active() == []
+
+
+def test_rclone_is_started_again_only_once(monkeypatch):
+    jobs = rc.RcloneJobs()
+    jobs.configure('http://127.0.0.1:5572')
+    started = fake_rclone(monkeypatch, failures=2)
+
+    assert jobs.execute(['rclone', 'move'], lambda data, job: False, 'upload') == 1
+    assert len(started) == 2
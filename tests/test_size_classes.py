@@ -0,0 +1,51 @@
+import glob
+import os
+
+from utils.models import RemoteConfig
+from utils.rclone import RcloneUploader
+
+EXCLUDES = ['**partial~', '**_HIDDEN~', '.unionfs/**', '.unionfs-fuse/**', 'downloads/']
+
+
+def uploader(folder, excludes=(), files=None):
+    remote = RemoteConfig('google', {
+        'upload_folder': folder,
+        'upload_remote': 'google:/Media',
+        'rclone_excludes': EXCLUDES,
+        'rclone_size_classes': {'small': {'max_size': '1K'}, 'large': {}},
+    })
+    return RcloneUploader('google', remote, 'rclone', 'rclone.conf', excludes=excludes, files=files)
+
+
+def write(folder, relative, size):
+    path = os.path.join(folder, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fp:
+        fp.write(b'0' * size)
+
+
+def classified(rclone):
+    return {size_class.name: sorted(files) for size_class, files in rclone._RcloneUploader__classify()}
+
+
+def test_excluded_files_stay_out_of_every_class(tmp_path):
+    folder = str(tmp_path)
+    for relative, size in (('Movies/a.mkv', 4096), ('Movies/a.nfo', 10), ('Movies/b.mkv.partial~', 4096),
+                           ('TV/show_HIDDEN~', 10), ('.unionfs/TV/gone.mkv', 4096),
+                           ('downloads/incomplete.mkv', 4096), ('TV/[1] open.mkv', 4096)):
+        write(folder, relative, size)
+
+    # opened files reach the uploader as escaped globs, anchored to the upload folder
+    rclone = uploader(folder, excludes=[f'/{glob.escape(os.path.join("TV", "[1] open.mkv"))}'])
+    assert classified(rclone) == {'small': ['Movies/a.nfo'], 'large': ['Movies/a.mkv']}
+
+
+def test_excluded_files_stay_out_of_a_carried_over_list(tmp_path):
+    folder = str(tmp_path)
+    for relative in ('Movies/a.mkv', 'Movies/b.mkv.partial~', 'TV/open.mkv'):
+        write(folder, relative, 4096)
+
+    rclone = uploader(folder, excludes=['/TV/open.mkv'],
+                      files=['Movies/a.mkv', 'Movies/b.mkv.partial~', 'TV/open.mkv'])
+    assert classified(rclone) == {'small': [], 'large': ['Movies/a.mkv']}
+    assert rclone.wanted(rclone.files) == ['Movies/a.mkv']
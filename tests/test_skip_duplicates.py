@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+from utils import uploader as uploader_module
+from utils.ledger import UploadLedger
+from utils.models import RemoteConfig, UploaderConfig
+from utils.uploader import Uploader
+
+MTIME = 1500000000.0
+
+
+class FakeRclone:
+    """ a remote holding files relative to the upload remote as (size, mtime), copies on it always work """
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+        self.copies = []
+
+    def file_details(self, files):
+        return {relative: self.files[relative] for relative in files if relative in self.files}
+
+    def copy_file(self, source, target):
+        self.copies.append((source, target))
+        return True
+
+
+@pytest.fixture(autouse=True)
+def small_duplicates(monkeypatch):
+    monkeypatch.setattr(uploader_module, 'DUPLICATE_MIN_SIZE', 1)
+
+
+def make_uploader(tmp_path, command='move'):
+    folder = tmp_path / 'upload'
+    remote = RemoteConfig('google', {'upload_folder': str(folder), 'upload_remote': 'google:/Media',
+                                     'rclone_command': command})
+    config = UploaderConfig('google', {'check_interval': 30, 'max_size_gb': 0, 'size_excludes': [],
+                                       'opened_excludes': [], 'exclude_open_files': False,
+                                       'skip_duplicates': True}, remote)
+    ledger = UploadLedger(str(tmp_path / 'ledger.db'))
+    return Uploader(config, 'rclone', 'rclone.conf', False, ledger=ledger), folder
+
+
+def write(folder, relative, size=100, mtime=MTIME):
+    local_path = os.path.join(str(folder), relative)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with open(local_path, 'wb') as fp:
+        fp.write(b'0' * size)
+    os.utime(local_path, (mtime, mtime))
+    return local_path
+
+
+def uploaded_before(uploader, relative, size=100, mtime=MTIME, remote_path=None):
+    local_path = os.path.join(uploader.remote.upload_folder, relative)
+    uploader.ledger.record([{'local_path': local_path, 'size': size, 'mtime': mtime,
+                             'hash': uploader_module.path.get_file_hash(local_path, size),
+                             'remote_path': remote_path or f'google:/Media/{relative}', 'account': None}])
+
+
+def skip_duplicates(uploader, rclone):
+    scanned = uploader._Uploader__scan()
+    return uploader._Uploader__skip_duplicates(rclone, scanned, set()), scanned
+
+
+def test_a_file_still_on_the_remote_is_removed_locally_when_moving(tmp_path):
+    uploader, folder = make_uploader(tmp_path)
+    local_path = write(folder, 'Movies/Movie.mkv')
+    uploaded_before(uploader, 'Movies/Movie.mkv')
+
+    excludes, scanned = skip_duplicates(uploader, FakeRclone({'Movies/Movie.mkv': (100, MTIME + 0.001)}))
+    assert excludes == [] and scanned == {}
+    assert not os.path.exists(local_path)
+    assert 'Movies/Movie.mkv' in uploader.transferred.files
+
+
+def test_a_file_of_another_size_on_the_remote_is_uploaded(tmp_path):
+    uploader, folder = make_uploader(tmp_path)
+    local_path = write(folder, 'Movies/Movie.mkv')
+    uploaded_before(uploader, 'Movies/Movie.mkv')
+
+    excludes, scanned = skip_duplicates(uploader, FakeRclone({'Movies/Movie.mkv': (90, MTIME)}))
+    assert excludes == [] and 'Movies/Movie.mkv' in scanned
+    assert os.path.exists(local_path)
+
+
+def test_a_replacement_with_the_same_name_and_size_is_uploaded(tmp_path):
+    uploader, folder = make_uploader(tmp_path)
+    # a repack of the uploaded file, same name and size but written later
+    local_path = write(folder, 'Movies/Movie.mkv', mtime=MTIME + 3600)
+    uploaded_before(uploader, 'Movies/Movie.mkv')
+    rclone = FakeRclone({'Movies/Movie.mkv': (100, MTIME)})
+
+    excludes, scanned = skip_duplicates(uploader, rclone)
+    assert excludes == [] and 'Movies/Movie.mkv' in scanned
+    assert os.path.exists(local_path)
+
+    # the same goes for copies from elsewhere on the remote
+    uploaded_before(uploader, 'Movies/Movie.mkv', remote_path='google:/Media/Old/Movie.mkv')
+    skip_duplicates(uploader, rclone)
+    assert rclone.copies == []
+
+
+def test_a_file_uploaded_elsewhere_is_copied_on_the_remote(tmp_path):
+    uploader, folder = make_uploader(tmp_path, command='copy')
+    local_path = write(folder, 'Movies/Movie.mkv')
+    uploaded_before(uploader, 'Movies/Movie.mkv', remote_path='google:/Media/Old/Movie.mkv')
+    rclone = FakeRclone()
+
+    excludes, scanned = skip_duplicates(uploader, rclone)
+    assert rclone.copies == [('google:/Media/Old/Movie.mkv', 'google:/Media/Movies/Movie.mkv')]
+    assert excludes == ['/Movies/Movie.mkv'] and scanned == {}
+    # copies stay in the upload folder, the new place is recorded
+    assert os.path.exists(local_path)
+    assert [upload['remote_path'] for upload in uploader.ledger.where('Movie.mkv')] == \
+        ['google:/Media/Old/Movie.mkv', 'google:/Media/Movies/Movie.mkv']
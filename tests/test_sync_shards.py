@@ -0,0 +1,46 @@
+import json
+
+from utils import rclone
+from utils.models import RemoteConfig
+from utils.rclone import RcloneSyncer
+
+FOLDERS = ['Movies', 'Music', 'TV']
+
+
+def syncer(extras):
+    source = RemoteConfig('source', {'sync_remote': 'source:/Media'})
+    target = RemoteConfig('target', {'sync_remote': 'target:/Media'})
+    return RcloneSyncer(source, target, rclone_extras=extras, syncer_name='media', sync_shards=2)
+
+
+def run(monkeypatch, extras):
+    """ the rclone commands a sync runs, with the source listing the top level folders """
+    commands = []
+
+    def execute(cmd, callback=None, env=None, logs=True, shell=False, job=None):
+        commands.append(cmd)
+        if ' lsjson ' in cmd:
+            for folder in FOLDERS:
+                callback(json.dumps({'Path': folder, 'Name': folder, 'Size': -1, 'IsDir': True}) + ',')
+        return 0
+
+    monkeypatch.setattr(rclone.process, 'execute', execute)
+    assert syncer(extras).sync(lambda cmd: cmd)[0]
+    return [cmd for cmd in commands if ' lsjson ' not in cmd]
+
+
+def test_sync_is_split_into_shards_by_top_level_folder(monkeypatch):
+    commands = run(monkeypatch, {'--checkers': 8})
+    # a shard per folder and one for everything else, run side by side in no particular order
+    assert len(commands) == len(FOLDERS) + 1
+    for folder in FOLDERS:
+        shard, = [cmd for cmd in commands if f"'--filter=+ /{folder}/**'" in cmd]
+        assert shard.endswith("'--filter=- /**'")
+    rest, = [cmd for cmd in commands if cmd.endswith("'--filter=+ /**'")]
+    assert all(f"'--filter=- /{folder}/**'" in rest for folder in FOLDERS)
+
+def test_delete_excluded_falls_back_to_one_rclone(monkeypatch):
+    assert syncer({'--delete-excluded': None}).shards == 0
+    commands = run(monkeypatch, {'--delete-excluded': None})
+    assert len(commands) == 1
+    assert '--delete-excluded' in commands[0] and '--filter' not in commands[0]
@@ -15,7 +15,9 @@ class Cache:
             'syncer_bans': SqliteDict(self.cache_file_path, tablename='syncer_bans', encode=json.dumps,
                                       decode=json.loads, autocommit=True),
             'sa_bans': SqliteDict(self.cache_file_path, tablename='sa_bans', encode=json.dumps,
-                                  decode=json.loads, autocommit=True)
+                                  decode=json.loads, autocommit=True),
+            'hidden_progress': SqliteDict(self.cache_file_path, tablename='hidden_progress', encode=json.dumps,
+                                          decode=json.loads, autocommit=True)
         }
 
     def get_cache(self, cache_name):
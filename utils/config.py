@@ -5,6 +5,9 @@ import os
 import sys
 from copy import copy
 
+from .models import CompiledConfig, ConfigError
+from .syncer import SERVICES as SYNCER_SERVICES
+
 log = logging.getLogger('config')
 
 
@@ -26,7 +29,10 @@ class Config(object):
         'core': {
             'dry_run': False,
             'rclone_binary_path': '/usr/bin/rclone',
-            'rclone_config_path': '/home/seed/.config/rclone/rclone.conf'
+            'rclone_config_path': '/home/seed/.config/rclone/rclone.conf',
+            'max_concurrent_syncers': 2,
+            'remote_listing_ttl': 0,
+            'service_account_leases': ''
         },
         # hidden cleaner settings
         'hidden': {
@@ -54,6 +60,7 @@ class Config(object):
             'notifications': False,
             'rclone': {
                 'url': 'http://localhost:7949',
+                'rc_socket_folder': '',
                 'throttle_speeds': {
                     '1': '50M',
                     '2': '40M',
@@ -73,6 +80,20 @@ class Config(object):
             'enabled': False,
             'url': 'https://sabnzbd.domain.com',
             'apikey': ''
+        },
+        # rclone output logging settings
+        'rclone_output': {
+            'log_folder': '',
+            'sample_every': 1,
+            'max_lines_per_second': 0
+        },
+        # download client speed control settings
+        'download_control': {
+            'enabled': False,
+            'link_speed': '100M',
+            'min_speed': '1M',
+            'min_free_space_gb': 50,
+            'poll_interval': 30
         }
     }
 
@@ -96,6 +117,21 @@ class Config(object):
             'argv': '--loglevel',
             'env': 'CLOUDPLOW_LOGLEVEL',
             'default': 'INFO'
+        },
+        'trace': {
+            'argv': '--trace',
+            'env': 'CLOUDPLOW_TRACE',
+            'default': None
+        },
+        'trace_format': {
+            'argv': '--trace-format',
+            'env': 'CLOUDPLOW_TRACE_FORMAT',
+            'default': 'chrome'
+        },
+        'profile': {
+            'argv': '--profile',
+            'env': 'CLOUDPLOW_PROFILE',
+            'default': None
         }
     }
 
@@ -106,6 +142,8 @@ class Config(object):
         self.settings = self.get_settings()
         # Configs
         self.configs = None
+        # Compiled configs
+        self.model = None
 
     @property
     def default_config(self):
@@ -268,6 +306,13 @@ class Config(object):
             else:
                 log.debug("Config was not upgraded as there were no changes to add.")
 
+        # validate and compile the config once, so the rest of cloudplow only reads attributes
+        try:
+            self.model = CompiledConfig(cfg, SYNCER_SERVICES)
+        except ConfigError as ex:
+            log.error(f"Invalid config {self.settings['config']}: {ex}")
+            sys.exit(1)
+
         self.configs = cfg
 
     def save(self, cfg):
@@ -315,16 +360,21 @@ class Config(object):
 
         # Mode
         parser.add_argument('cmd',
-                            choices=('clean', 'upload', 'sync', 'run', 'update_config'),
+                            choices=('clean', 'upload', 'sync', 'run', 'where', 'update_config'),
                             help=(
                                 '"clean": perform clean of UnionFS HIDDEN files from Rclone remotes\n'
                                 '"upload": perform clean of UnionFS HIDDEN files and upload local content to Rclone remotes\n'
                                 '"sync": perform sync between Rclone remotes\n'
                                 '"run": starts the application in automatic mode\n'
+                                '"where": look up where a file was uploaded to in the upload ledger\n'
                                 '"update_config": perform simple update of config'
                             )
                             )
 
+        # Item to look up
+        parser.add_argument('item', nargs='?',
+                            help='Local path, remote path or file name to look up with "where"')
+
         # Config file
         parser.add_argument(self.base_settings['config']['argv'], nargs='?', const=None,
                             help=f"Config file location (default: {self.base_settings['config']['default']})")
@@ -341,6 +391,19 @@ class Config(object):
         parser.add_argument(self.base_settings['loglevel']['argv'], choices=('WARN', 'INFO', 'DEBUG'),
                             help=f"Log level (default: {self.base_settings['loglevel']['default']})")
 
+        # Trace file
+        parser.add_argument(self.base_settings['trace']['argv'], nargs='?', const=None,
+                            help="Write timing spans of every job to this file (default: disabled)")
+
+        # Trace format
+        parser.add_argument(self.base_settings['trace_format']['argv'], choices=('chrome', 'json'),
+                            help=f"Trace file format, chrome://tracing or nested json "
+                                 f"(default: {self.base_settings['trace_format']['default']})")
+
+        # Profile folder
+        parser.add_argument(self.base_settings['profile']['argv'], nargs='?', const=None,
+                            help="Profile every job with cProfile and write the stats to this folder (default: disabled)")
+
         if len(sys.argv) != 1:
             return vars(parser.parse_args())
         parser.print_help()
@@ -2,7 +2,7 @@ import logging
 import os
 import timeit
 
-from . import misc
+from . import misc, trace
 
 log = logging.getLogger("decorators")
 
@@ -10,7 +10,8 @@ log = logging.getLogger("decorators")
 def timed(method):
     def timer(*args, **kw):
         start_time = timeit.default_timer()
-        result = method(*args, **kw)
+        with trace.span(method.__name__):
+            result = method(*args, **kw)
         time_taken = timeit.default_timer() - start_time
         try:
             log.info(f"{method.__name__} from {os.path.basename(method.__code__.co_filename)} finished in {misc.seconds_to_string(time_taken)}")
@@ -0,0 +1,95 @@
+import logging
+import shutil
+import threading
+
+from . import misc
+
+log = logging.getLogger('downloads')
+
+
+class DownloadController:
+    """ keeps download clients running at a rate that leaves room for the upload and the disk """
+
+    def __init__(self, config, clients, jobs, folder):
+        self.config = config
+        self.clients = clients
+        self.jobs = jobs
+        self.folder = folder
+        self.link_speed = misc.size_to_bytes(config['link_speed'])
+        self.min_speed = misc.size_to_bytes(config['min_speed'])
+        self.rate = None
+        self.paused = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.__run, name='download-controller', daemon=True)
+        self.thread.start()
+        log.info(f"Download speed control started for {', '.join(client.NAME for client in self.clients)}")
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        # hand the full link back to the download clients
+        for client in self.clients:
+            if self.paused and not client.resume_queue():
+                log.error(f"Failed to resume the {client.NAME} download queue??")
+            if not client.set_speed_limit(None):
+                log.error(f"Failed to remove the {client.NAME} speed limit??")
+        self.rate = None
+        self.paused = False
+        log.info("Download speed control stopped, download speed limits removed")
+
+    def adjust(self):
+        rate = self.target_rate()
+
+        if rate == 0:
+            if not self.paused:
+                log.warning(f"Free space in '{self.folder}' is below {self.config['min_free_space_gb']} GB, "
+                            f"pausing downloads")
+                self.paused = all([client.pause_queue() for client in self.clients])
+            return
+
+        if self.paused:
+            log.info("Free space recovered, resuming downloads")
+            self.paused = not all([client.resume_queue() for client in self.clients])
+
+        # only change the limit when it moved more than 10% to avoid flapping the clients
+        if self.rate is not None and abs(rate - self.rate) <= self.rate * 0.1:
+            return
+
+        if all([client.set_speed_limit(rate) for client in self.clients]):
+            log.info(f"Set download speed limit to {misc.bytes_to_size(rate)}/s")
+            self.rate = rate
+
+    def target_rate(self):
+        free_gb = shutil.disk_usage(self.folder).free / 1024 ** 3
+        min_free_gb = self.config['min_free_space_gb']
+        if free_gb <= min_free_gb:
+            return 0
+
+        # downloads get what the upload leaves of the link, slowed down as the disk approaches its minimum
+        headroom = max(self.link_speed - self.upload_rate(), self.min_speed)
+        disk_factor = min(1.0, (free_gb - min_free_gb) / max(min_free_gb, 1))
+        return max(int(headroom * disk_factor), self.min_speed)
+
+    def upload_rate(self):
+        rate = 0
+        for job in self.jobs.active():
+            data = job.call('core/stats', timeout=5)
+            if data and 'transferring' in data:
+                rate += sum(float(transfer.get('speed', 0)) for transfer in data['transferring'])
+        return rate
+
+    # internals
+    def __run(self):
+        while not self.stopped.is_set():
+            try:
+                self.adjust()
+            except Exception:
+                log.exception("Exception adjusting download speed limits: ")
+            self.stopped.wait(self.config['poll_interval'])
@@ -0,0 +1,168 @@
+import atexit
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger('leases')
+
+# a lease outlives a holder that died without releasing it by at most this long, live holders renew it well before
+LEASE_TTL = 900
+
+
+def lease_key(sa_file):
+    """ hosts keep the same service account files in different places, they are told apart by file name """
+    return os.path.basename(sa_file)
+
+
+def _day(now=None):
+    # google resets the upload quota of an account daily, usage is kept per UTC day
+    return time.strftime('%Y-%m-%d', time.gmtime(now))
+
+
+class AccountLeases:
+    """ the service accounts of several cloudplow hosts, shared through one sqlite database they can all reach
+
+    An account is used by one host at a time, under a lease the host renews while it uploads and releases afterwards.
+    Bans and the bytes uploaded each day are published alongside, hosts skip the accounts banned by any of them and
+    start with the ones used least today. The database must be on storage with working file locks.
+    """
+
+    def __init__(self, path, holder=None, ttl=LEASE_TTL):
+        self.path = path
+        self.holder = holder or f'{socket.gethostname()}:{os.getpid()}'
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.held = set()
+        self.renewer = None
+        self.stopped = threading.Event()
+        # transactions are begun by hand, an acquire has to hold the write lock from its read to its write
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.db.execute("CREATE TABLE IF NOT EXISTS leases (account TEXT PRIMARY KEY, holder TEXT, expires REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS bans (account TEXT PRIMARY KEY, until REAL, reason TEXT, "
+                            "holder TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS usage (account TEXT, day TEXT, bytes INTEGER, "
+                            "PRIMARY KEY (account, day))")
+        atexit.register(self.close)
+
+    def acquire(self, sa_file):
+        """ lease the account to this host, False when another host holds it """
+        key = lease_key(sa_file)
+        now = time.time()
+        with self.__transaction() as db:
+            row = db.execute("SELECT holder, expires FROM leases WHERE account = ?", (key,)).fetchone()
+            if row is not None and row[0] != self.holder and row[1] > now:
+                log.debug(f"Service account {key} is leased by {row[0]} for another {int(row[1] - now)} seconds")
+                return False
+            db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (key, self.holder, now + self.ttl))
+            self.held.add(key)
+
+        log.debug(f"Leased service account {key} to {self.holder}")
+        self.__start_renewer()
+        return True
+
+    def release(self, sa_file):
+        key = lease_key(sa_file)
+        with self.__transaction() as db:
+            db.execute("DELETE FROM leases WHERE account = ? AND holder = ?", (key, self.holder))
+            self.held.discard(key)
+        log.debug(f"Released the lease of service account {key}")
+
+    def expiry(self, sa_files):
+        """ when the first of these accounts leased by other hosts is free again, None when none of them is """
+        keys = [lease_key(sa_file) for sa_file in sa_files]
+        if not keys:
+            return None
+        with self.lock:
+            row = self.db.execute(f"SELECT MIN(expires) FROM leases WHERE holder != ? AND expires > ? AND "
+                                  f"account IN ({', '.join('?' * len(keys))})",
+                                  (self.holder, time.time(), *keys)).fetchone()
+        return row[0] if row else None
+
+    def ban(self, sa_file, until, reason=None):
+        """ publish a ban, every host skips the account until then """
+        with self.__transaction() as db:
+            db.execute("INSERT OR REPLACE INTO bans VALUES (?, ?, ?, ?)", (lease_key(sa_file), until, reason,
+                                                                           self.holder))
+
+    def merge_bans(self, accounts):
+        """ accounts maps the service account files of an uploader to their ban expiry, the later ban wins """
+        now = time.time()
+        with self.lock:
+            bans = dict(self.db.execute("SELECT account, until FROM bans WHERE until > ?", (now,)))
+        merged = dict(accounts)
+        for sa_file, until in accounts.items():
+            shared = bans.get(lease_key(sa_file))
+            if shared is not None and (until is None or until < shared):
+                log.debug(f"Service account {sa_file} was banned by another host until {time.ctime(shared)}")
+                merged[sa_file] = shared
+        return merged
+
+    def add_usage(self, sa_file, size):
+        if not size:
+            return
+        with self.__transaction() as db:
+            db.execute("INSERT INTO usage VALUES (?, ?, ?) ON CONFLICT (account, day) DO UPDATE SET "
+                       "bytes = bytes + excluded.bytes", (lease_key(sa_file), _day(), int(size)))
+
+    def usage(self):
+        """ bytes uploaded today by every host, per service account """
+        with self.lock:
+            return dict(self.db.execute("SELECT account, bytes FROM usage WHERE day = ?", (_day(),)))
+
+    def order(self, sa_files):
+        """ the least used accounts first, the given order breaks ties """
+        usage = self.usage()
+        return sorted(sa_files, key=lambda sa_file: usage.get(lease_key(sa_file), 0))
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            if self.db is None:
+                return
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                self.db.executemany("DELETE FROM leases WHERE account = ? AND holder = ?",
+                                    ((key, self.holder) for key in self.held))
+                self.db.execute("COMMIT")
+            except sqlite3.Error:
+                log.exception(f"Exception releasing the service account leases of {self.holder}: ")
+            self.held = set()
+            self.db.close()
+            self.db = None
+
+    # internals
+    @contextlib.contextmanager
+    def __transaction(self):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def __start_renewer(self):
+        with self.lock:
+            if self.renewer is None:
+                self.renewer = threading.Thread(target=self.__renew, name='lease-renewer', daemon=True)
+                self.renewer.start()
+
+    def __renew(self):
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                with self.__transaction() as db:
+                    for key in list(self.held):
+                        renewed = db.execute("UPDATE leases SET expires = ? WHERE account = ? AND holder = ?",
+                                             (time.time() + self.ttl, key, self.holder)).rowcount
+                        if not renewed:
+                            # it ran out while this host was stalled, another host may be using it now
+                            log.warning(f"Lost the lease of service account {key}")
+                            self.held.discard(key)
+            except Exception:
+                log.exception(f"Exception renewing the service account leases of {self.holder}: ")
@@ -0,0 +1,86 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import path
+
+log = logging.getLogger('ledger')
+
+# sqlite caps the variables of a statement, lookups are chunked below it
+LOOKUP_CHUNK = 500
+COLUMNS = ('local_path', 'name', 'size', 'mtime', 'hash', 'remote_path', 'account', 'uploaded')
+
+
+def ledger_file(cache_file):
+    """ the ledger is kept next to the cache, in its own file as it only ever grows """
+    return f'{os.path.splitext(cache_file)[0]}-ledger.db'
+
+
+def join_remote(remote, item):
+    """ the rclone path of item, relative to remote """
+    item = item.lstrip('/')
+    return f'{remote}{item}' if remote.endswith((':', '/')) else f'{remote}/{item}'
+
+
+class UploadLedger:
+    """ every file cloudplow uploaded, where it came from and where it went
+
+    Files are identified like path.get_file_hash does, by name and size, so a file that is downloaded or imported
+    again is recognised wherever it shows up locally.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS uploads (id INTEGER PRIMARY KEY, {', '.join(COLUMNS)})")
+            for column in ('local_path', 'name', 'hash', 'remote_path'):
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS uploads_{column} ON uploads ({column})")
+
+    def record(self, entries):
+        """ store uploads, entries are dicts with local_path, size, mtime, hash, remote_path and account """
+        now = time.time()
+        rows = [(entry['local_path'], os.path.basename(entry['local_path']), entry['size'], entry['mtime'],
+                 entry['hash'], entry['remote_path'], entry.get('account'), now) for entry in entries]
+        if not rows:
+            return 0
+        with self.lock, self.db:
+            self.db.executemany(f"INSERT INTO uploads ({', '.join(COLUMNS)}) "
+                                f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        log.debug(f"Recorded {len(rows)} upload(s) in the ledger")
+        return len(rows)
+
+    def find(self, hashes):
+        """ the uploads of each of these hashes, hash -> entries oldest first """
+        found = {}
+        hashes = list(hashes)
+        with self.lock:
+            for start in range(0, len(hashes), LOOKUP_CHUNK):
+                chunk = hashes[start:start + LOOKUP_CHUNK]
+                cursor = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM uploads WHERE hash IN "
+                                         f"({', '.join('?' * len(chunk))}) ORDER BY uploaded", chunk)
+                for row in cursor:
+                    entry = dict(zip(COLUMNS, row))
+                    found.setdefault(entry['hash'], []).append(entry)
+        return found
+
+    def where(self, item):
+        """ uploads of item, a local path, a remote path or a file name, oldest first """
+        candidates = [('local_path', os.path.abspath(item)), ('remote_path', item), ('name', os.path.basename(item))]
+        if os.path.isfile(item):
+            candidates.insert(1, ('hash', path.get_file_hash(item)))
+
+        with self.lock:
+            for column, value in candidates:
+                rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM uploads WHERE {column} = ? "
+                                       f"ORDER BY uploaded", (value,)).fetchall()
+                if rows:
+                    return [dict(zip(COLUMNS, row)) for row in rows]
+        return []
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import process
+from .rclone import USER_AGENT
+
+log = logging.getLogger('listing')
+
+# rclone's exit code for a directory that does not exist
+DIRECTORY_NOT_FOUND = 3
+
+
+def listing_file(cache_file):
+    """ listings are kept next to the cache, in their own file as they come and go with the ttl """
+    return f'{os.path.splitext(cache_file)[0]}-listings.db'
+
+
+def _split(remote_path):
+    """ 'google:/Media/TV/' -> ('google:', ['Media', 'TV']), a plain path is rclone's local filesystem """
+    remote, colon, item = remote_path.partition(':')
+    remote, item = (f'{remote}:', item) if colon else ('/' if remote_path.startswith('/') else '', remote_path)
+    return remote, [part for part in item.split('/') if part]
+
+
+def _key(remote, parts):
+    return remote + '/'.join(parts)
+
+
+class RemoteListing:
+    """ the lsjson of remote folders, one level at a time, kept for ttl seconds
+
+    A folder is listed the first time something inside it is looked up, a folder that does not exist is remembered as
+    empty. What cloudplow itself uploads, deletes or moves is written through, so the listings stay valid until they
+    expire. Changes made to the remote by anything else are only seen once they do.
+    """
+
+    def __init__(self, path, rclone_binary_path, rclone_config_path, ttl):
+        self.path = path
+        self.rclone_binary_path = rclone_binary_path
+        self.rclone_config_path = rclone_config_path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.listing_locks = {}
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS folders (folder TEXT PRIMARY KEY, listed REAL) WITHOUT ROWID")
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (folder TEXT, name TEXT, size INTEGER, is_dir INTEGER, "
+                            "PRIMARY KEY (folder, name)) WITHOUT ROWID")
+            # expired listings are relisted on their next lookup anyway, drop them rather than keeping them around
+            expired = [row[0] for row in self.db.execute("SELECT folder FROM folders WHERE listed < ?",
+                                                         (time.time() - ttl,))]
+            self.__drop(expired)
+        if expired:
+            log.debug(f"Evicted {len(expired)} expired remote listing(s)")
+
+    def exists(self, remote_path):
+        """ whether remote_path is on the remote, None when its folder could not be listed """
+        remote, parts = _split(remote_path)
+        if not parts:
+            return True
+
+        # a folder listed higher up can already tell the path is not there, without listing anything
+        for depth in range(len(parts) - 1):
+            found = self.__lookup(_key(remote, parts[:depth]), parts[depth])
+            if found is False:
+                return False
+        if not self.__ensure(_key(remote, parts[:-1])):
+            return None
+        return self.__lookup(_key(remote, parts[:-1]), parts[-1])
+
+    def is_empty(self, remote_folder):
+        """ whether remote_folder holds nothing or is not there at all, None when it could not be listed """
+        remote, parts = _split(remote_folder)
+        key = _key(remote, parts)
+        if not self.__ensure(key):
+            return None
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM entries WHERE folder = ? LIMIT 1", (key,)).fetchone() is None
+
+    def added(self, remote_path, size=None, is_dir=False):
+        """ remote_path was uploaded, it and its parent folders are added to the listings that hold them """
+        remote, parts = _split(remote_path)
+        now = time.time()
+        with self.lock, self.db:
+            for depth in range(len(parts)):
+                folder = _key(remote, parts[:depth])
+                if not self.__fresh(folder, now):
+                    continue
+                last = depth == len(parts) - 1
+                self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                (folder, parts[depth], size if last else -1, int(is_dir or not last)))
+
+    def removed(self, remote_path):
+        """ remote_path was deleted, along with everything below it """
+        remote, parts = _split(remote_path)
+        if not parts:
+            return self.forget(remote_path)
+        key = _key(remote, parts)
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM entries WHERE folder = ? AND name = ?", (_key(remote, parts[:-1]), parts[-1]))
+            self.__drop(self.__below(key))
+
+    def forget(self, remote_prefix):
+        """ drop the listings at and below remote_prefix, after something changed there in bulk """
+        remote, parts = _split(remote_prefix)
+        with self.lock, self.db:
+            self.__drop(self.__below(_key(remote, parts)))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    # internals
+    def __fresh(self, key, now=None):
+        row = self.db.execute("SELECT listed FROM folders WHERE folder = ?", (key,)).fetchone()
+        return row is not None and (now or time.time()) - row[0] < self.ttl
+
+    def __lookup(self, key, name):
+        """ True or False when the folder is listed, None when it is not """
+        with self.lock:
+            if not self.__fresh(key):
+                return None
+            return self.db.execute("SELECT 1 FROM entries WHERE folder = ? AND name = ?",
+                                   (key, name)).fetchone() is not None
+
+    def __ensure(self, key):
+        with self.lock:
+            if self.__fresh(key):
+                return True
+            # one listing per folder, lookups of the same folder wait for it
+            folder_lock = self.listing_locks.setdefault(key, threading.Lock())
+
+        with folder_lock:
+            with self.lock:
+                if self.__fresh(key):
+                    return True
+            entries = self.__list(key)
+            if entries is None:
+                return False
+            with self.lock, self.db:
+                self.__drop([key])
+                self.db.execute("INSERT INTO folders VALUES (?, ?)", (key, time.time()))
+                self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                    ((key, name, size, is_dir) for name, size, is_dir in entries))
+            log.debug(f"Listed {len(entries)} item(s) in '{key}'")
+            return True
+
+    def __list(self, key):
+        cmd = [self.rclone_binary_path, 'lsjson', key, '--no-modtime', '--no-mimetype',
+               f'--config={self.rclone_config_path}', f'--user-agent={USER_AGENT}']
+        entries = []
+
+        def parse(line):
+            # lsjson prints one object per line between [ and ], errors are mixed in
+            if line.startswith('{'):
+                item = json.loads(line.rstrip(','))
+                entries.append((item['Name'], item.get('Size', -1), int(bool(item.get('IsDir')))))
+            return False
+
+        try:
+            return_code = process.execute(cmd, parse, logs=False)
+        except Exception:
+            log.exception(f"Exception listing '{key}': ")
+            return None
+        if return_code == DIRECTORY_NOT_FOUND:
+            return []
+        if return_code:
+            log.warning(f"Listing '{key}' failed with exit code {return_code}")
+            return None
+        return entries
+
+    def __below(self, key):
+        prefix = key if key.endswith((':', '/')) else f'{key}/'
+        return [key] + [row[0] for row in self.db.execute("SELECT folder FROM folders WHERE substr(folder, 1, ?) = ?",
+                                                          (len(prefix), prefix))]
+
+    def __drop(self, folders):
+        for folder in folders:
+            self.db.execute("DELETE FROM folders WHERE folder = ?", (folder,))
+            self.db.execute("DELETE FROM entries WHERE folder = ?", (folder,))
@@ -1,13 +1,117 @@
+import fcntl
 import logging
 import os
+import re
 import sys
+import time
 
-import lockfile
+from . import trace
 
 log = logging.getLogger("lock")
 lock_folder = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), 'locks')
 
 
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # someone else's process, but running
+        pass
+    return True
+
+
+class LockFile:
+    """ an exclusive fcntl lock on a file in the lock folder, records the time spent waiting for it as a trace span
+
+    The kernel drops the lock when the process holding it exits, however it exits, so a crashed run never leaves a
+    lock behind for the next one. The holder writes its pid into the file, to tell who is being waited on.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self, timeout=None):
+        """ wait for the lock, up to timeout seconds when given, False when it was not acquired by then """
+        with trace.span('lock-wait', lock=os.path.basename(self.path)):
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if timeout is None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:
+                    deadline = time.time() + timeout
+                    while not self.__try(fd, fcntl.LOCK_EX):
+                        if time.time() >= deadline:
+                            os.close(fd)
+                            return False
+                        time.sleep(0.1)
+            except BaseException:
+                os.close(fd)
+                raise
+
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        fd, self.fd = self.fd, None
+        try:
+            # emptied first, a pid left in the file would name a process that no longer holds it
+            os.ftruncate(fd, 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def is_locked(self):
+        return self.holder() is not None
+
+    def holder(self):
+        """ pid of the process holding the lock, 0 when it has not written it yet, None when nobody holds it """
+        if self.fd is not None:
+            return os.getpid()
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+
+        try:
+            if self.__try(fd, fcntl.LOCK_SH):
+                # a file left by a run that is gone, nobody holds it
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                return None
+            content = os.read(fd, 32).decode(errors='ignore').strip()
+        finally:
+            os.close(fd)
+
+        pid = int(content) if content.isdigit() else 0
+        if pid and not _alive(pid):
+            # only a child that inherited the lock from its crashed parent can still be holding it
+            log.warning(f"Lock {os.path.basename(self.path)} is held by a process left behind by pid {pid}, which "
+                        f"is no longer running")
+        return pid
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    # internals
+    @staticmethod
+    def __try(fd, operation):
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+
 def ensure_lock_folder():
     # ensure lock folder exists, otherwise create it
     try:
@@ -20,12 +124,13 @@ def ensure_lock_folder():
 
 
 def upload():
-    return lockfile.LockFile(os.path.join(lock_folder, 'upload'))
+    return LockFile(os.path.join(lock_folder, 'upload'))
 
 
-def sync():
-    return lockfile.LockFile(os.path.join(lock_folder, 'sync'))
+def sync(name):
+    # every syncer has its own lock, so different syncers can run side by side
+    return LockFile(os.path.join(lock_folder, 'sync-' + re.sub(r'[^\w.-]', '_', name)))
 
 
 def hidden():
-    return lockfile.LockFile(os.path.join(lock_folder, 'hidden'))
+    return LockFile(os.path.join(lock_folder, 'hidden'))
@@ -0,0 +1,154 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+log = logging.getLogger('logger')
+
+# rclone output lines containing any of these are never sampled away
+IMPORTANT_OUTPUT = ('ERROR', 'NOTICE', 'CRITICAL', 'Failed', 'Error')
+
+
+class LogQueue:
+    """ moves formatting and handler I/O of the root logger onto a background listener thread """
+
+    def __init__(self):
+        self.queue = None
+        self.handlers = ()
+        self.listener = None
+
+    def start(self, *handlers):
+        self.handlers = handlers
+        self.queue = queue.Queue(-1)
+        root_logger = logging.getLogger()
+        for handler in list(root_logger.handlers):
+            if isinstance(handler, QueueHandler):
+                root_logger.removeHandler(handler)
+        root_logger.addHandler(QueueHandler(self.queue))
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart(self):
+        # the listener thread does not survive a fork, children need their own
+        if self.listener is not None:
+            self.listener = None
+            self.start(*self.handlers)
+
+
+class RcloneOutput:
+    """ sampled and rate limited log of a single rclone job """
+
+    def __init__(self, name, target, sample_every=1, max_lines_per_second=0, listener=None):
+        self.name = name
+        self.target = target
+        self.sample_every = max(int(sample_every), 1)
+        self.max_lines_per_second = max_lines_per_second
+        self.listener = listener
+        self.seen = 0
+        self.suppressed = 0
+        self.tokens = max_lines_per_second
+        self.refilled = time.monotonic()
+
+    def write(self, line):
+        self.seen += 1
+        if not self.__wanted(line):
+            self.suppressed += 1
+            return
+
+        if self.suppressed:
+            self.target.info(f"({self.suppressed} rclone output line(s) suppressed)")
+            self.suppressed = 0
+        self.target.info(line)
+
+    def close(self):
+        if self.suppressed:
+            self.target.info(f"({self.suppressed} rclone output line(s) suppressed)")
+            self.suppressed = 0
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    # internals
+    def __wanted(self, line):
+        if any(word in line for word in IMPORTANT_OUTPUT):
+            return True
+        if (self.seen - 1) % self.sample_every:
+            return False
+        if not self.max_lines_per_second:
+            return True
+
+        # token bucket, refilled once per second
+        now = time.monotonic()
+        if now - self.refilled >= 1:
+            self.tokens = self.max_lines_per_second
+            self.refilled = now
+        if self.tokens <= 0:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RcloneOutputs:
+    def __init__(self):
+        self.log_folder = None
+        self.sample_every = 1
+        self.max_lines_per_second = 0
+        self.formatter = None
+        self.lock = threading.Lock()
+
+    def configure(self, log_folder='', sample_every=1, max_lines_per_second=0, formatter=None):
+        self.log_folder = log_folder or None
+        self.sample_every = sample_every
+        self.max_lines_per_second = max_lines_per_second
+        self.formatter = formatter
+        if self.log_folder and not os.path.exists(self.log_folder):
+            os.makedirs(self.log_folder, exist_ok=True)
+            log.info(f"Created rclone log folder: {self.log_folder}")
+
+    def open(self, job, fallback):
+        """ output for a rclone job, written to its own log file when a log folder is set, otherwise to fallback """
+        if not self.log_folder or not job:
+            return RcloneOutput(job, fallback, self.sample_every, self.max_lines_per_second)
+
+        name = re.sub(r'[^\w.-]+', '_', job).strip('_') or 'rclone'
+        with self.lock:
+            target = logging.getLogger(f'rclone-output.{name}')
+            target.propagate = False
+            target.setLevel(logging.INFO)
+            for handler in list(target.handlers):
+                target.removeHandler(handler)
+
+            file_handler = RotatingFileHandler(os.path.join(self.log_folder, f'{name}.log'),
+                                               maxBytes=1024 * 1024 * 5, backupCount=2, encoding='utf-8')
+            if self.formatter:
+                file_handler.setFormatter(self.formatter)
+            job_queue = queue.Queue(-1)
+            target.addHandler(QueueHandler(job_queue))
+            listener = QueueListener(job_queue, file_handler)
+            listener.start()
+
+        fallback.info(f"Logging rclone output of {job} to {file_handler.baseFilename}")
+        return RcloneOutput(job, target, self.sample_every, self.max_lines_per_second, listener)
+
+
+log_queue = LogQueue()
+rclone_outputs = RcloneOutputs()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=log_queue.restart)
@@ -70,3 +70,21 @@ def is_time_between(time_range, current_time=None):
 def sorted_list_by_digit_asc(list_to_sort):
     """ reference: https://stackoverflow.com/a/46772952 """
     return sorted(list_to_sort, key=lambda x: [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', x) if s])
+
+
+def size_to_bytes(size):
+    """ convert an rclone size string (e.g. 50M, 64Mi, 1.5G) to bytes, returns None for off/empty values """
+    if size is None:
+        return None
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([BKMGTP]?)i?B?\s*$', str(size), re.IGNORECASE)
+    if not match:
+        return None
+    return int(float(match.group(1)) * 1024 ** 'BKMGTP'.index(match.group(2).upper() or 'K'))
+
+
+def bytes_to_size(num_bytes):
+    """ convert bytes to an rclone size string in KiB (e.g. 51200K) """
+    return f'{max(int(num_bytes // 1024), 1)}K'
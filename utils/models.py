@@ -0,0 +1,525 @@
+import bisect
+import glob
+import logging
+import os
+import re
+import threading
+import time
+from types import MappingProxyType
+
+from . import misc
+
+log = logging.getLogger('models')
+
+
+class ConfigError(Exception):
+    pass
+
+
+class Frozen:
+    """ base for compiled config objects, attributes are set once in __init__ and are read-only afterwards """
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is read-only, change config.json and restart instead")
+
+    def _set(self, **kwargs):
+        for key, value in kwargs.items():
+            object.__setattr__(self, key, value)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)})"
+
+
+############################################################
+# HELPERS
+############################################################
+
+def _require(config, keys, where):
+    if not isinstance(config, dict):
+        raise ConfigError(f"{where} must be an object")
+    missing = [key for key in keys if key not in config]
+    if missing:
+        raise ConfigError(f"{where} is missing required setting(s): {', '.join(missing)}")
+
+
+def _number(value, where, minimum=0):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        raise ConfigError(f"{where} must be a number of at least {minimum}, not {value!r}")
+    return value
+
+
+def _time_of_day(value, where):
+    if not isinstance(value, str) or not re.match(r'^([01]\d|2[0-3]):[0-5]\d$', value):
+        raise ConfigError(f"{where} must be a time in HH:MM format, not {value!r}")
+    return value
+
+
+def extras_to_args(extras, where):
+    """ rclone_extras dict to a static argv tuple, a None value means the flag takes no value """
+    if not isinstance(extras, dict):
+        raise ConfigError(f"{where} must be an object")
+    return tuple(key if value is None else f'{key}={value}' for key, value in extras.items())
+
+
+def extras_log_transfers(extras):
+    """ whether rclone started with these extras prints a line for every file it transfers to its output """
+    if not isinstance(extras, dict) or '--log-file' in extras:
+        return False
+    if str(extras.get('--log-level', '')).upper() in ('INFO', 'DEBUG'):
+        return True
+    return any(flag in extras and extras[flag] not in (0, False, '0', 'false')
+               for flag in ('-v', '-vv', '-vvv', '--verbose'))
+
+
+def excludes_to_args(excludes, where):
+    if not isinstance(excludes, list) or not all(isinstance(item, str) for item in excludes):
+        raise ConfigError(f"{where} must be a list of strings")
+    return tuple(f"--exclude={glob.escape(item) if item.startswith(os.path.sep) else item}" for item in excludes)
+
+
+############################################################
+# MATCHERS
+############################################################
+
+class GlobMatcher(Frozen):
+    """ rclone style glob patterns compiled into one regex, matched against paths relative to the transfer root """
+    __slots__ = ('patterns', 'regex')
+
+    def __init__(self, patterns):
+        regexes = []
+        for pattern in patterns:
+            anchored = pattern.startswith('/')
+            body = self.translate(pattern.lstrip('/').rstrip('/'))
+            # a directory pattern matches every file below the directory
+            end = '/' if pattern.endswith('/') else '$'
+            regexes.append(f"^{body}{end}" if anchored else f"(?:^|/){body}{end}")
+        self._set(patterns=tuple(patterns),
+                  regex=re.compile('|'.join(regexes)) if regexes else None)
+
+    def match(self, relative_path):
+        return bool(self.regex) and self.regex.search(relative_path.replace(os.sep, '/').lstrip('/')) is not None
+
+    @classmethod
+    def translate(cls, pattern):
+        out = ''
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\' and i + 1 < len(pattern):
+                out += re.escape(pattern[i + 1])
+                i += 2
+                continue
+            if pattern.startswith('**', i):
+                out += '.*'
+                i += 2
+                continue
+            if char == '*':
+                out += '[^/]*'
+            elif char == '?':
+                out += '[^/]'
+            elif char == '[':
+                end = pattern.find(']', i + 2)
+                if end == -1:
+                    out += re.escape(char)
+                else:
+                    # a literal [ inside a class, like glob.escape writes it, would start a nested set for re
+                    content = pattern[i + 1:end].replace('[', '\\[')
+                    out += f"[{'^' + content[1:] if content.startswith('!') else content}]"
+                    i = end
+            elif char == '{':
+                end = pattern.find('}', i)
+                if end == -1:
+                    out += re.escape(char)
+                else:
+                    out += f"(?:{'|'.join(cls.translate(alt) for alt in pattern[i + 1:end].split(','))})"
+                    i = end
+            else:
+                out += re.escape(char)
+            i += 1
+        return out
+
+
+############################################################
+# TRIGGERS
+############################################################
+
+class Trigger(Frozen):
+    __slots__ = ('text', 'needle', 'count', 'timeout', 'sleep')
+
+    def __init__(self, text, config, where):
+        _require(config, ('count', 'timeout', 'sleep'), where)
+        self._set(text=text, needle=text.lower(),
+                  count=_number(config['count'], f"{where} count", 1),
+                  timeout=_number(config['timeout'], f"{where} timeout"),
+                  sleep=_number(config['sleep'], f"{where} sleep"))
+
+
+class Triggers(Frozen):
+    """ compiled rclone_sleeps, a fresh TriggerTracker holds the counts for each rclone run """
+    __slots__ = ('items',)
+
+    def __init__(self, rclone_sleeps, where='rclone_sleeps'):
+        if isinstance(rclone_sleeps, Triggers):
+            self._set(items=rclone_sleeps.items)
+            return
+        if not isinstance(rclone_sleeps, dict):
+            raise ConfigError(f"{where} must be an object")
+        self._set(items=tuple(Trigger(text, config, f"{where} '{text}'") for text, config in rclone_sleeps.items()))
+
+    def merge(self, other):
+        merged = Triggers({})
+        items = {trigger.text: trigger for trigger in self.items}
+        items.update({trigger.text: trigger for trigger in other.items})
+        object.__setattr__(merged, 'items', tuple(items.values()))
+        return merged
+
+    def tracker(self):
+        return TriggerTracker(self)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+class TriggerTracker:
+    def __init__(self, triggers):
+        self.triggers = triggers
+        self.tracks = {}
+        self.delayed_check = 0
+        self.delayed_trigger = None
+        self.lock = threading.Lock()
+
+    @property
+    def tripped(self):
+        return bool(self.delayed_check)
+
+    def reset(self):
+        """ start counting again, after whatever the trigger was about has been dealt with """
+        with self.lock:
+            self.tracks = {}
+            self.delayed_check = 0
+            self.delayed_trigger = None
+
+    def check(self, data):
+        """ returns True once a trigger has occurred its configured count within its timeout """
+        if not self.triggers.items:
+            return False
+
+        lowered = data.lower()
+        with self.lock:
+            if self.delayed_check:
+                return True
+
+            for trigger in self.triggers.items:
+                track = self.tracks.get(trigger.text)
+                # check/reset trigger timeout
+                if track and track['expires'] != '' and time.time() >= track['expires']:
+                    log.warning(f"Tracking of trigger: {trigger.text} has expired, resetting occurrence count and timeout")
+                    track = self.tracks[trigger.text] = {'count': 0, 'expires': ''}
+
+                # check if trigger text is in data
+                if trigger.needle not in lowered:
+                    continue
+
+                # check / increase tracking count of trigger text
+                if not track or track['count'] == 0:
+                    # set initial tracking info for trigger
+                    self.tracks[trigger.text] = {'count': 1, 'expires': time.time() + trigger.timeout}
+                    log.warning(f"Tracked first occurrence of trigger: {trigger.text}. Expiring in {trigger.timeout} seconds at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.tracks[trigger.text]['expires']))}")
+                else:
+                    # trigger text WAS seen before increase count
+                    track['count'] += 1
+                    log.warning(f"Tracked trigger: {trigger.text} has occurred {track['count']}/{trigger.count} times within {trigger.timeout} seconds")
+
+                    # check if trigger text was found the required amount of times to abort
+                    if track['count'] >= trigger.count:
+                        log.warning(f"Tracked trigger {trigger.text} has reached the maximum limit of {trigger.count} occurrences within {trigger.timeout} seconds, aborting...")
+                        self.delayed_check = trigger.sleep
+                        self.delayed_trigger = trigger.text
+                        return True
+        return False
+
+
+############################################################
+# THROTTLING
+############################################################
+
+class ThrottleTable(Frozen):
+    """ plex throttle_speeds sorted by stream count """
+    __slots__ = ('counts', 'speeds')
+
+    def __init__(self, throttle_speeds, where='plex.rclone.throttle_speeds'):
+        if not isinstance(throttle_speeds, dict) or not throttle_speeds:
+            raise ConfigError(f"{where} must be an object with at least one stream count")
+        try:
+            items = sorted((int(count), speed) for count, speed in throttle_speeds.items())
+        except ValueError:
+            raise ConfigError(f"{where} keys must be stream counts, not {list(throttle_speeds)}")
+        for count, speed in items:
+            if misc.size_to_bytes(speed) is None:
+                raise ConfigError(f"{where} '{count}' must be a speed like 50M, not {speed!r}")
+        self._set(counts=tuple(count for count, _ in items), speeds=tuple(speed for _, speed in items))
+
+    def speed_for(self, stream_count):
+        """ speed for the exact stream count, otherwise the nearest one (the lower on a tie) """
+        index = bisect.bisect_left(self.counts, stream_count)
+        if index < len(self.counts) and self.counts[index] == stream_count:
+            return self.speeds[index]
+        if index == 0:
+            return self.speeds[0]
+        if index == len(self.counts):
+            return self.speeds[-1]
+        lower, upper = self.counts[index - 1], self.counts[index]
+        return self.speeds[index - 1] if stream_count - lower <= upper - stream_count else self.speeds[index]
+
+
+class BandwidthSchedule(Frozen):
+    """ an uploader's bandwidth_schedule, each time of day sets the rate until the next one, wrapping at midnight """
+    __slots__ = ('times', 'rates')
+
+    def __init__(self, bandwidth_schedule, where):
+        if not isinstance(bandwidth_schedule, dict) or not bandwidth_schedule:
+            raise ConfigError(f"{where} must be an object with at least one time of day")
+        items = sorted((_time_of_day(at, f"{where} '{at}'"), str(rate)) for at, rate in bandwidth_schedule.items())
+        for at, rate in items:
+            if rate.lower() != 'off' and misc.size_to_bytes(rate) is None:
+                raise ConfigError(f"{where} '{at}' has an invalid rate: {rate!r}")
+        self._set(times=tuple(at for at, _ in items), rates=tuple(rate for _, rate in items))
+
+    def rate_at(self, current_time=None):
+        """ the rate in force at current_time (HH:MM, now by default), None when uploads are not limited """
+        index = bisect.bisect_right(self.times, current_time or time.strftime('%H:%M')) - 1
+        # before the first time of the day, the last one of the day before still applies
+        rate = self.rates[index]
+        return None if rate.lower() == 'off' else rate
+
+
+############################################################
+# SECTIONS
+############################################################
+
+class CoreConfig(Frozen):
+    __slots__ = ('dry_run', 'rclone_binary_path', 'rclone_config_path', 'max_concurrent_syncers', 'remote_listing_ttl',
+                 'service_account_leases')
+
+    def __init__(self, config):
+        _require(config, ('dry_run', 'rclone_binary_path', 'rclone_config_path'), 'core')
+        self._set(dry_run=bool(config['dry_run']),
+                  rclone_binary_path=config['rclone_binary_path'],
+                  rclone_config_path=config['rclone_config_path'],
+                  max_concurrent_syncers=int(_number(config.get('max_concurrent_syncers', 2),
+                                                     'core max_concurrent_syncers', 1)),
+                  remote_listing_ttl=_number(config.get('remote_listing_ttl', 0), 'core remote_listing_ttl'),
+                  service_account_leases=config.get('service_account_leases') or None)
+
+
+class SizeClass(Frozen):
+    """ files up to max_size (None for no limit) are uploaded by their own rclone, with these extras on top """
+    __slots__ = ('name', 'max_size', 'extra_args')
+
+    def __init__(self, name, config, extras, where):
+        _require(config, (), where)
+        max_size = config.get('max_size')
+        if max_size is not None and not misc.size_to_bytes(max_size):
+            raise ConfigError(f"{where} max_size must be a size like 20M or 1G, not {max_size!r}")
+        class_extras = config.get('rclone_extras', {})
+        if not isinstance(class_extras, dict):
+            raise ConfigError(f"{where} rclone_extras must be an object")
+        self._set(name=name,
+                  max_size=misc.size_to_bytes(max_size) if max_size is not None else None,
+                  extra_args=extras_to_args({**extras, **class_extras}, f"{where} rclone_extras"))
+
+    def fits(self, size):
+        return self.max_size is None or size <= self.max_size
+
+
+def _size_classes(config, extras, where):
+    if not isinstance(config, dict):
+        raise ConfigError(f"{where} must be an object")
+    classes = [SizeClass(name, item, extras if isinstance(extras, dict) else {}, f"{where} '{name}'")
+               for name, item in config.items()]
+    if sum(size_class.max_size is None for size_class in classes) > 1:
+        raise ConfigError(f"{where} can only have one class without a max_size")
+    # smallest first, a file goes to the first class it fits
+    return tuple(sorted(classes, key=lambda size_class: (size_class.max_size is None, size_class.max_size or 0)))
+
+
+class RemoteConfig(Frozen):
+    __slots__ = ('name', 'upload_folder', 'upload_remote', 'hidden_remote', 'sync_remote', 'rclone_command',
+                 'excludes', 'exclude_args', 'exclude_matcher', 'extras', 'extra_args', 'logs_transfers',
+                 'triggers', 'remove_empty_dir_depth', 'size_classes')
+
+    def __init__(self, name, config):
+        where = f"remotes '{name}'"
+        _require(config, (), where)
+        rclone_command = config.get('rclone_command', 'move')
+        if not isinstance(rclone_command, str) or rclone_command.lower() not in ('move', 'copy', 'sync'):
+            raise ConfigError(f"{where} rclone_command must be move or copy, not {rclone_command!r}")
+
+        excludes = config.get('rclone_excludes', [])
+        extras = config.get('rclone_extras', {})
+        self._set(name=name,
+                  upload_folder=config.get('upload_folder'),
+                  upload_remote=config.get('upload_remote'),
+                  hidden_remote=config.get('hidden_remote'),
+                  sync_remote=config.get('sync_remote'),
+                  rclone_command='move' if rclone_command.lower() == 'sync' else rclone_command,
+                  excludes=tuple(excludes) if isinstance(excludes, list) else excludes,
+                  exclude_args=excludes_to_args(excludes, f"{where} rclone_excludes"),
+                  exclude_matcher=GlobMatcher(excludes),
+                  extras=MappingProxyType(dict(extras)) if isinstance(extras, dict) else extras,
+                  extra_args=extras_to_args(extras, f"{where} rclone_extras"),
+                  logs_transfers=extras_log_transfers(extras),
+                  triggers=Triggers(config.get('rclone_sleeps', {}), f"{where} rclone_sleeps"),
+                  remove_empty_dir_depth=_number(config.get('remove_empty_dir_depth', 1),
+                                                 f"{where} remove_empty_dir_depth"),
+                  size_classes=_size_classes(config.get('rclone_size_classes', {}), extras,
+                                             f"{where} rclone_size_classes"))
+
+
+class ScheduleConfig(Frozen):
+    __slots__ = ('enabled', 'allowed_from', 'allowed_until')
+
+    def __init__(self, config, where):
+        _require(config, ('enabled',), where)
+        enabled = bool(config['enabled'])
+        if enabled:
+            _require(config, ('allowed_from', 'allowed_until'), where)
+        self._set(enabled=enabled,
+                  allowed_from=_time_of_day(config['allowed_from'], f"{where} allowed_from") if enabled else None,
+                  allowed_until=_time_of_day(config['allowed_until'], f"{where} allowed_until") if enabled else None)
+
+
+class MoverConfig(Frozen):
+    __slots__ = ('enabled', 'move_from_remote', 'move_to_remote', 'extra_args', 'exclude_args', 'incremental')
+
+    def __init__(self, config, where):
+        _require(config, ('enabled',), where)
+        enabled = bool(config['enabled'])
+        if enabled:
+            _require(config, ('move_from_remote', 'move_to_remote', 'rclone_extras'), where)
+        self._set(enabled=enabled,
+                  move_from_remote=config.get('move_from_remote'),
+                  move_to_remote=config.get('move_to_remote'),
+                  extra_args=extras_to_args(config.get('rclone_extras', {}), f"{where} rclone_extras"),
+                  exclude_args=excludes_to_args(config.get('rclone_excludes', []), f"{where} rclone_excludes"),
+                  incremental=bool(config.get('incremental', False)))
+
+
+class UploaderConfig(Frozen):
+    __slots__ = ('name', 'remote', 'can_be_throttled', 'check_interval', 'max_size_gb', 'size_excludes',
+                 'opened_excludes', 'exclude_open_files', 'schedule', 'service_account_path', 'mover',
+                 'skip_duplicates', 'hot_swap_service_accounts', 'bandwidth_schedule')
+
+    def __init__(self, name, config, remote):
+        where = f"uploader '{name}'"
+        _require(config, ('check_interval', 'max_size_gb', 'size_excludes', 'opened_excludes',
+                          'exclude_open_files'), where)
+        if remote is None:
+            raise ConfigError(f"{where} has no matching entry in remotes")
+        if not remote.upload_folder or not remote.upload_remote:
+            raise ConfigError(f"remotes '{name}' needs upload_folder and upload_remote to be used by an uploader")
+
+        self._set(name=name,
+                  remote=remote,
+                  can_be_throttled=bool(config.get('can_be_throttled', True)),
+                  check_interval=_number(config['check_interval'], f"{where} check_interval", 1),
+                  max_size_gb=_number(config['max_size_gb'], f"{where} max_size_gb"),
+                  size_excludes=tuple(config['size_excludes']),
+                  opened_excludes=tuple(item.lower() for item in config['opened_excludes']),
+                  exclude_open_files=bool(config['exclude_open_files']),
+                  schedule=ScheduleConfig(config['schedule'], f"{where} schedule") if 'schedule' in config else None,
+                  service_account_path=config.get('service_account_path'),
+                  mover=MoverConfig(config['mover'], f"{where} mover") if 'mover' in config else None,
+                  skip_duplicates=bool(config.get('skip_duplicates', False)),
+                  hot_swap_service_accounts=bool(config.get('hot_swap_service_accounts', False)),
+                  bandwidth_schedule=BandwidthSchedule(config['bandwidth_schedule'], f"{where} bandwidth_schedule")
+                  if config.get('bandwidth_schedule') else None)
+
+    def is_opened_file_excluded(self, file_path):
+        lowered = file_path.lower()
+        return any(item in lowered for item in self.opened_excludes)
+
+
+class HiddenConfig(Frozen):
+    __slots__ = ('folder', 'remotes')
+
+    def __init__(self, folder, config, remotes):
+        where = f"hidden '{folder}'"
+        _require(config, ('hidden_remotes',), where)
+        hidden_remotes = []
+        for name in config['hidden_remotes']:
+            if name not in remotes:
+                raise ConfigError(f"{where} references unknown remote '{name}'")
+            if remotes[name].hidden_remote is None:
+                raise ConfigError(f"remotes '{name}' needs hidden_remote to be used by the hidden cleaner")
+            hidden_remotes.append(remotes[name])
+        self._set(folder=folder, remotes=tuple(hidden_remotes))
+
+
+class SyncerConfig(Frozen):
+    __slots__ = ('name', 'service', 'tool_path', 'sync_from', 'sync_to', 'sync_interval', 'instance_destroy',
+                 'options')
+
+    def __init__(self, name, config, remotes, services):
+        where = f"syncer '{name}'"
+        _require(config, ('service', 'tool_path', 'sync_from', 'sync_to', 'sync_interval'), where)
+        if config['service'] not in services:
+            raise ConfigError(f"{where} service must be one of {', '.join(services)}, not {config['service']!r}")
+        for key in ('sync_from', 'sync_to'):
+            if config[key] not in remotes:
+                raise ConfigError(f"{where} {key} references unknown remote '{config[key]}'")
+            if not remotes[config[key]].sync_remote:
+                raise ConfigError(f"remotes '{config[key]}' needs sync_remote to be used by a syncer")
+
+        # everything else is handed to the syncer service as keyword arguments
+        options = {key: value for key, value in config.items()
+                   if key not in ('service', 'tool_path', 'sync_from', 'sync_to', 'sync_interval')}
+        self._set(name=name,
+                  service=config['service'],
+                  tool_path=config['tool_path'],
+                  sync_from=remotes[config['sync_from']],
+                  sync_to=remotes[config['sync_to']],
+                  sync_interval=_number(config['sync_interval'], f"{where} sync_interval", 1),
+                  instance_destroy=bool(config.get('instance_destroy', True)),
+                  options=MappingProxyType(options))
+
+    @property
+    def is_local(self):
+        return self.service.lower() == 'local'
+
+
+class PlexConfig(Frozen):
+    __slots__ = ('enabled', 'url', 'token', 'poll_interval', 'max_streams_before_throttle', 'ignore_local_streams',
+                 'notifications', 'rc_url', 'rc_socket_folder', 'throttle')
+
+    def __init__(self, config):
+        _require(config, ('enabled', 'url', 'token', 'poll_interval', 'max_streams_before_throttle',
+                          'ignore_local_streams', 'notifications', 'rclone'), 'plex')
+        _require(config['rclone'], ('url', 'throttle_speeds'), 'plex.rclone')
+        self._set(enabled=bool(config['enabled']),
+                  url=config['url'],
+                  token=config['token'],
+                  poll_interval=_number(config['poll_interval'], 'plex poll_interval', 1),
+                  max_streams_before_throttle=_number(config['max_streams_before_throttle'],
+                                                      'plex max_streams_before_throttle'),
+                  ignore_local_streams=bool(config['ignore_local_streams']),
+                  notifications=bool(config['notifications']),
+                  rc_url=config['rclone']['url'],
+                  rc_socket_folder=config['rclone'].get('rc_socket_folder', ''),
+                  throttle=ThrottleTable(config['rclone']['throttle_speeds']))
+
+
+class CompiledConfig(Frozen):
+    __slots__ = ('core', 'remotes', 'uploaders', 'hidden', 'syncers', 'plex')
+
+    def __init__(self, config, syncer_services=()):
+        remotes = {name: RemoteConfig(name, remote) for name, remote in config['remotes'].items()}
+        self._set(core=CoreConfig(config['core']),
+                  remotes=MappingProxyType(remotes),
+                  uploaders=MappingProxyType({name: UploaderConfig(name, uploader, remotes.get(name))
+                                              for name, uploader in config['uploader'].items()}),
+                  hidden=tuple(HiddenConfig(folder, hidden, remotes) for folder, hidden in config['hidden'].items()),
+                  syncers=MappingProxyType({name: SyncerConfig(name, syncer, remotes, syncer_services)
+                                            for name, syncer in config['syncer'].items()}),
+                  plex=PlexConfig(config['plex']))
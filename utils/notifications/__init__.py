@@ -1,21 +1,45 @@
+import importlib
 import logging
+import os
+import queue
+import threading
+import time
+import weakref
 
-from .apprise import Apprise
-from .pushover import Pushover
-from .slack import Slack
+from .. import trace
 
 log = logging.getLogger("notifications")
 
+# services are imported on first load, so unused agents (and their dependencies) cost nothing at startup
 SERVICES = {
-    'apprise': Apprise,
-    'pushover': Pushover,
-    'slack': Slack
+    'apprise': '.apprise.Apprise',
+    'pushover': '.pushover.Pushover',
+    'slack': '.slack.Slack'
 }
 
+# delivery attempts per notification, the wait between attempts doubles each time
+RETRIES = 3
+RETRY_BACKOFF = 5
+# coalesced notifications are collected for this many seconds and sent as one digest
+DIGEST_WINDOW = 60
+
+# the live workers, their locks are replaced in a forked child by the one hook below
+_workers = weakref.WeakSet()
+
+
+def _after_fork():
+    # another thread may hold a lock at the fork, the child must not inherit it locked
+    for worker in list(_workers):
+        worker.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
 
 class Notifications:
     def __init__(self):
         self.services = []
+        self.workers = []
 
     def load(self, **kwargs):
         if 'service' not in kwargs:
@@ -26,12 +50,14 @@ class Notifications:
             return False
 
         try:
-            chosen_service = SERVICES[kwargs['service']]
+            module_name, class_name = SERVICES[kwargs['service']].rsplit('.', 1)
+            chosen_service = getattr(importlib.import_module(module_name, __name__), class_name)
             del kwargs['service']
 
             # load service
             service = chosen_service(**kwargs)
             self.services.append(service)
+            self.workers.append(NotificationWorker(service))
 
         except Exception:
             log.exception("Exception while loading service, kwargs=%r: ", kwargs)
@@ -46,11 +72,101 @@ class Notifications:
             else:
                 chosen_service = None
 
-            # send notification(s)
-            for service in self.services:
-                if chosen_service and service.NAME.lower() != chosen_service:
+            # remove coalesce keyword if supplied, notifications sharing a key are sent as one digest
+            coalesce = kwargs.pop('coalesce', None)
+
+            # queue notification(s)
+            for worker in self.workers:
+                if chosen_service and worker.service.NAME.lower() != chosen_service:
                     continue
-                elif service.send(**kwargs):
-                    log.info("Sent notification with %s", service.NAME)
+                worker.put(kwargs, coalesce)
         except Exception:
             log.exception("Exception sending notification, kwargs=%r: ", kwargs)
+
+    def stop(self, timeout=30):
+        """ flush pending digests and wait for queued notifications to be delivered """
+        for worker in self.workers:
+            worker.stop(timeout)
+
+
+class NotificationWorker:
+    def __init__(self, service):
+        self.service = service
+        self.queue = queue.Queue()
+        self.digests = {}
+        self.thread = None
+        self.pid = None
+        # senders race to start the worker, only one of them may replace the queue
+        self.lock = threading.Lock()
+        _workers.add(self)
+
+    def put(self, kwargs, coalesce=None):
+        with self.lock:
+            # threads do not survive a fork, so (re)start the worker in the process that is sending
+            if self.pid != os.getpid():
+                self.queue = queue.Queue()
+                self.digests = {}
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.__run, name=f'notify-{self.service.NAME.lower()}',
+                                               daemon=True)
+                self.thread.start()
+            self.queue.put((dict(kwargs), coalesce))
+
+    def stop(self, timeout=30):
+        if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            log.warning(f"Timed out waiting for queued {self.service.NAME} notifications to be sent")
+
+    # internals
+    def __run(self):
+        while True:
+            timeout = None
+            if self.digests:
+                timeout = max(min(deadline for deadline, _ in self.digests.values()) - time.time(), 0)
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                # stopping, flush everything still waiting in a digest
+                self.__flush(force=True)
+                return
+
+            if item:
+                kwargs, coalesce = item
+                if coalesce:
+                    if coalesce not in self.digests:
+                        self.digests[coalesce] = (time.time() + DIGEST_WINDOW, [])
+                    self.digests[coalesce][1].append(kwargs['message'])
+                else:
+                    self.__deliver(kwargs)
+
+            self.__flush()
+
+    def __flush(self, force=False):
+        for coalesce, (deadline, messages) in list(self.digests.items()):
+            if not force and time.time() < deadline:
+                continue
+            del self.digests[coalesce]
+            self.__deliver({'message': '\n'.join(messages)})
+
+    def __deliver(self, kwargs):
+        with trace.span('notify', service=self.service.NAME):
+            for attempt in range(RETRIES):
+                try:
+                    if self.service.send(**kwargs):
+                        log.info("Sent notification with %s", self.service.NAME)
+                        return True
+                except Exception:
+                    log.exception("Exception sending notification with %s, kwargs=%r: ", self.service.NAME, kwargs)
+
+                if attempt < RETRIES - 1:
+                    time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+            log.error("Failed to send notification with %s after %d attempts", self.service.NAME, RETRIES)
+            return False
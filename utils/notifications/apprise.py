@@ -22,7 +22,7 @@ class Apprise:
         try:
             apobj = apprise.Apprise()
             apobj.add(self.url)
-            apobj.notify(
+            return apobj.notify(
                 title=self.title,
                 body=kwargs['message'],
             )
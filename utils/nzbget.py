@@ -6,9 +6,11 @@ log = logging.getLogger(__name__)
 
 
 class Nzbget:
-    def __init__(self, url):
+    NAME = 'Nzbget'
+
+    def __init__(self, url, timeout=10):
         self.url = f"{url}/xmlrpc"
-        self.xmlrpc = ServerProxy(self.url)
+        self.xmlrpc = ServerProxy(self.url, timeout=timeout)
 
     def pause_queue(self):
         paused = False
@@ -27,3 +29,13 @@ class Nzbget:
         except Exception:
             log.exception("Exception resuming NzbGet queue: ")
         return resumed
+
+    def set_speed_limit(self, rate):
+        """ rate is in bytes per second, None removes the limit """
+        limited = False
+        try:
+            with self.xmlrpc as proxy:
+                limited = proxy.rate(0 if rate is None else max(int(rate // 1024), 1))
+        except Exception:
+            log.exception("Exception setting NzbGet download rate: ")
+        return limited
@@ -2,7 +2,7 @@ import hashlib
 import os
 from pathlib import Path
 
-from . import process
+from . import process, trace
 
 try:
     from shlex import quote as cmd_quote
@@ -20,13 +20,14 @@ def get_file_extension(filepath):
     return extension.lower()
 
 
-def get_file_hash(filepath):
-    # get file size for hash
-    file_size = 0
-    try:
-        file_size = os.path.getsize(filepath)
-    except Exception:
-        log.exception(f"Exception getting file size of {filepath}: ")
+def get_file_hash(filepath, file_size=None):
+    # get file size for hash, unless it is known already
+    if file_size is None:
+        file_size = 0
+        try:
+            file_size = os.path.getsize(filepath)
+        except Exception:
+            log.exception(f"Exception getting file size of {filepath}: ")
     # set basic string to use for hash
     key = "{filename}-{size}".format(filename=os.path.basename(filepath), size=file_size)
     return hashlib.md5(key.encode('utf-8')).hexdigest()
@@ -48,6 +49,7 @@ def find_items(folder, extension=None, depth=None):
     return sorted(folder_list, key=lambda x: x.count(os.path.sep), reverse=True)
 
 
+@trace.traced('lsof')
 def opened_files(path):
     files = []
 
@@ -90,6 +92,7 @@ def delete(path):
         log.debug("Skipping deletion of '%s' as it does not exist", path)
 
 
+@trace.traced('remove_empty_dirs')
 def remove_empty_dirs(path, depth):
     if os.path.exists(path):
         log.debug("Removing empty directories from '%s' with mindepth %d", path, depth)
@@ -106,6 +109,36 @@ def remove_empty_dirs(path, depth):
     return False
 
 
+@trace.traced('remove_empty_parents')
+def remove_empty_parents(path, folders, depth):
+    """
+    Removes the given folders, relative to path, and then their parents when they are left empty. Only folders at least
+    depth levels below path are removed, like find -mindepth, and nothing outside of these folders is walked.
+
+    :return: number of folders removed
+    """
+    candidates = set()
+    for folder in folders:
+        parts = [part for part in os.path.normpath(folder).split(os.sep) if part not in ('', '.')]
+        if '..' in parts:
+            continue
+        for level in range(len(parts), max(depth, 1) - 1, -1):
+            candidates.add(tuple(parts[:level]))
+
+    removed = 0
+    # deepest first, a parent can only be empty once its children are gone
+    for parts in sorted(candidates, key=len, reverse=True):
+        try:
+            os.rmdir(os.path.join(path, *parts))
+            removed += 1
+        except OSError:
+            # not empty, already gone or not a folder
+            pass
+    log.debug("Removed %d empty directories from '%s' with mindepth %d", removed, path, depth)
+    return removed
+
+
+@trace.traced('du')
 def get_size(path, excludes=None):
     try:
         cmd = "du -s --block-size=1G"
@@ -5,6 +5,9 @@ from uuid import getnode
 
 import requests
 import urllib3
+
+from . import trace
+
 log = logging.getLogger('plex')
 urllib3.disable_warnings()
 
@@ -37,6 +40,7 @@ class Plex:
             log.exception(f"Exception validating server token={self.token}, url={self.url}: ")
             return False
 
+    @trace.traced('plex get_streams')
     def get_streams(self):
         request_url = urljoin(self.url, 'status/sessions')
         try:
@@ -1,43 +1,60 @@
 import logging
+import os
 import shlex
 import subprocess
 
+from . import trace
+from .logger import rclone_outputs
+
 log = logging.getLogger("process")
 
 
-def execute(command, callback=None, env=None, logs=True, shell=False):
-    total_output = ''
-    process = subprocess.Popen(command if shell else shlex.split(command),
-                               shell=shell,
-                               env=env,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT)
-
-    while True:
-        output = process.stdout.readline().decode().strip()
-        if process.poll() is not None:
-            break
-        if output and len(output):
-            if logs:
-                log.info(output)
-            if callback:
-                cancel = callback(output)
-                if cancel:
-                    if logs:
-                        log.info("Callback requested termination, terminating...")
-                        log.debug(f"Callback output {cancel}")
-                    process.kill()
-            else:
-                total_output += "%s\n" % output
-
-    return process.poll() if callback else total_output
-
-
-def popen(command, shell=False):
+def execute(command, callback=None, env=None, logs=True, shell=False, job=None):
+    argv = command if not isinstance(command, str) else shlex.split(command)
+    # name the span after the program and its subcommand, e.g. rclone move
+    name = ' '.join([os.path.basename(argv[0])] + [arg for arg in argv[1:2] if arg.isalpha()])
+    with trace.span(name, job=job):
+        total_output = ''
+        process = subprocess.Popen(command if shell else argv,
+                                   shell=shell,
+                                   env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+
+        output_log = rclone_outputs.open(job, log) if logs else None
+        try:
+            # read until the pipe closes, the last lines are still buffered when the process exits
+            for line in iter(process.stdout.readline, b''):
+                output = line.decode().strip()
+                if output and len(output):
+                    if output_log:
+                        output_log.write(output)
+                    if callback:
+                        cancel = callback(output)
+                        if cancel:
+                            if logs:
+                                log.info("Callback requested termination, terminating...")
+                                log.debug(f"Callback output {cancel}")
+                            process.kill()
+                            break
+                    else:
+                        total_output += "%s\n" % output
+        finally:
+            if output_log:
+                output_log.close()
+
+        return process.wait() if callback else total_output
+
+
+def popen(command, shell=False, timeout=None, quiet=False):
     try:
         return subprocess.check_output(command if shell else shlex.split(command),
-                                       shell=shell).decode().strip()
-
-    except Exception:
-        log.exception("Exception while executing process: ")
+                                       shell=shell, timeout=timeout).decode().strip()
+
+    except Exception as ex:
+        if quiet:
+            # expected to fail now and then, e.g. probes
+            log.debug(f"Process failed: {ex}")
+        else:
+            log.exception("Exception while executing process: ")
     return None
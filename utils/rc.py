@@ -0,0 +1,195 @@
+import http.client
+import itertools
+import json
+import logging
+import os
+import re
+import socket
+import threading
+from urllib.parse import urljoin
+
+from . import misc, process, trace
+
+log = logging.getLogger('rc')
+
+# rclone could not listen on its rc port, another process took it between being picked and rclone starting
+ADDR_IN_USE = re.compile(r'remote control.*address already in use', re.IGNORECASE)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=15):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RcloneJob:
+    """ a single running rclone process and the rc endpoint it was started with """
+
+    def __init__(self, name, addr, owner=None, cap=None):
+        self.name = name
+        self.addr = addr
+        # the uploader it runs for, whose bandwidth schedule caps it
+        self.owner = owner
+        self.rate = None
+        # the Plex throttle's share of the link and the bandwidth schedule's rate, None when either is off
+        self.share = None
+        self.cap = cap
+
+    @property
+    def socket_path(self):
+        return self.addr[len('unix://'):] if self.addr.startswith('unix://') else None
+
+    @property
+    def url(self):
+        return None if self.socket_path else f'http://{self.addr}/'
+
+    @property
+    def rc_args(self):
+        return ['--rc', f'--rc-addr={self.addr}']
+
+    @property
+    def limit(self):
+        """ the tighter of the Plex throttle and the bandwidth schedule, 'off' when neither applies """
+        rates = [rate for rate in (self.share, self.cap) if rate]
+        return min(rates, key=misc.size_to_bytes) if rates else 'off'
+
+    def call(self, endpoint, payload=None, timeout=15):
+        with trace.span(f'rc {endpoint}', job=self.name):
+            try:
+                if self.socket_path:
+                    conn = UnixHTTPConnection(self.socket_path, timeout=timeout)
+                    try:
+                        conn.request('POST', f'/{endpoint}', body=json.dumps(payload or {}),
+                                     headers={'Content-Type': 'application/json'})
+                        text = conn.getresponse().read().decode()
+                    finally:
+                        conn.close()
+                else:
+                    # rc calls are only made from the monitor threads, keep requests off the startup path
+                    import requests
+                    text = requests.post(urljoin(self.url, endpoint), json=payload or {}, timeout=timeout,
+                                         verify=False).text
+
+                if '{' in text and '}' in text:
+                    return json.loads(text)
+                log.error(f"Unexpected response from {self.name} for {endpoint}: {text}")
+            except Exception:
+                log.exception(f"Exception calling {endpoint} on {self.name} at {self.addr}: ")
+        return None
+
+    def __str__(self):
+        return f'{self.name} ({self.addr})'
+
+    def __repr__(self):
+        return str(self)
+
+
+class RcloneJobs:
+    """ registry of running rclone jobs, each one gets its own rc address """
+
+    def __init__(self):
+        self.url = None
+        self.socket_folder = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+
+    @property
+    def enabled(self):
+        return bool(self.url or self.socket_folder)
+
+    def configure(self, url, socket_folder=None):
+        self.url = url
+        self.socket_folder = socket_folder or None
+        if self.socket_folder and not os.path.exists(self.socket_folder):
+            os.makedirs(self.socket_folder, exist_ok=True)
+            log.info(f"Created rc socket folder: {self.socket_folder}")
+
+    def register(self, name, owner=None, cap=None):
+        with self.lock:
+            job_id = next(self.counter)
+            if self.socket_folder:
+                socket_path = os.path.join(self.socket_folder, f'cloudplow-{os.getpid()}-{job_id}.sock')
+                if os.path.exists(socket_path):
+                    os.remove(socket_path)
+                addr = f'unix://{socket_path}'
+            else:
+                addr = self.__tcp_addr()
+
+            job = RcloneJob(f'{name}#{job_id}', addr, owner, cap)
+            self.jobs[job.name] = job
+
+        log.debug(f"Registered rclone job {job}")
+        return job
+
+    def unregister(self, job):
+        with self.lock:
+            self.jobs.pop(job.name, None)
+        if job.socket_path and os.path.exists(job.socket_path):
+            try:
+                os.remove(job.socket_path)
+            except OSError:
+                log.exception(f"Exception removing rc socket {job.socket_path}: ")
+        log.debug(f"Unregistered rclone job {job}")
+
+    def active(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def execute(self, cmd, callback, name, owner=None, cap=None, **kwargs):
+        """ process.execute cmd with an rc endpoint of its own when rc is enabled, callback gets each line and the job
+
+        A free tcp port can still be taken by another process before rclone listens on it, rclone is then started
+        once more on another port. Sockets in rc_socket_folder are not shared, they never run into this.
+        """
+        if not self.enabled:
+            return process.execute(cmd, lambda data: callback(data, None), **kwargs)
+
+        for attempt in (1, 2):
+            job = self.register(name, owner, cap)
+            taken = []
+
+            def check(data):
+                if ADDR_IN_USE.search(data):
+                    taken.append(data)
+                return callback(data, job)
+
+            try:
+                return_code = process.execute([*cmd, *job.rc_args], check, **kwargs)
+            finally:
+                self.unregister(job)
+            if taken and attempt == 1:
+                log.warning(f"The rc address of {job} was taken by another process, starting rclone on another port")
+                continue
+            return return_code
+            log.warning(f"The rc address of {job} was taken by another process, starting rclone on another port")
+        return return_code
+
+    # internals
+    def __tcp_addr(self):
+        host, port = re.sub(r'https?://(www\.)?', '', self.url).strip().strip('/').rsplit(':', 1)
+        in_use = {job.addr for job in self.jobs.values()}
+        if f'{host}:{port}' not in in_use and self.__port_free(host, int(port)):
+            return f'{host}:{port}'
+
+        # configured port is taken, ask the kernel for a free one
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind((host, 0))
+            return f'{host}:{sock.getsockname()[1]}'
+
+    @staticmethod
+    def __port_free(host, port):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind((host, port))
+                return True
+            except OSError:
+                return False
+
+
+jobs = RcloneJobs()
@@ -1,14 +1,17 @@
-import glob
+import datetime
+import json
 import logging
 import os
-import time
-from urllib.parse import urljoin
 import re
-import requests
-import urllib3
 import subprocess
-import jsonpickle
-from . import process, misc
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import misc, process, rc, trace
+from .models import GlobMatcher, extras_to_args
+from .snapshot import SyncSnapshot, snapshot_file
 
 try:
     from shlex import quote as cmd_quote
@@ -17,80 +20,172 @@ except ImportError:
 
 log = logging.getLogger('rclone')
 
-urllib3.disable_warnings()
+# incremental syncs list files modified this long before the previous checkpoint too, covering clock skew between
+# cloudplow and the remote and files still being written while the previous listing ran
+CHECKPOINT_MARGIN = 3600
+# default for the full_sync_interval syncer setting, in hours
+FULL_SYNC_INTERVAL = 168
+# sharded syncs split the top level directories into at most this many jobs per concurrent rclone
+SHARDS_PER_WORKER = 4
+# rclone applies includes and filters of its own ahead of the shard filters, which would break the split, and
+# --delete-excluded would have every shard delete all the other shards' folders from the destination
+SHARD_CONFLICTS = ('--include', '--include-from', '--filter', '--filter-from', '--files-from', '--files-from-raw',
+                   '--delete-excluded')
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_4) AppleWebKit/537.36 (KHTML, like Gecko) ' \
+             'Chrome/74.0.3729.131 Safari/537.36'
+
+
+def argv_to_string(cmd):
+    return ' '.join(cmd_quote(str(arg)) for arg in cmd)
+
+
+def _filter_escape(name):
+    # a folder name as a literal in an rclone filter rule
+    return re.sub(r'([\\*?\[\]{}])', r'\\\1', name)
+
+
+def _timestamp(value):
+    """ an rclone ModTime as seconds since the epoch, rclone gives up to nanoseconds and Z for UTC """
+    value = re.sub(r'(\.\d{6})\d+', r'\1', value.replace('Z', '+00:00'))
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def remote_subpath(parent, child):
+    """ where child sits inside parent when both are paths on the same rclone remote, None otherwise """
+    def split(remote):
+        # a plain path is rclone's local filesystem
+        name, colon, remote_path = remote.partition(':')
+        return (name, remote_path.strip('/')) if colon else ('', remote.strip('/'))
+
+    (parent_remote, parent_path), (child_remote, child_path) = split(parent), split(child)
+    if parent_remote != child_remote:
+        return None
+    if not parent_path:
+        return child_path
+    if child_path == parent_path:
+        return ''
+    if child_path.startswith(f'{parent_path}/'):
+        return child_path[len(parent_path) + 1:]
+    return None
 
 
 class RcloneMover:
-    def __init__(self, config, rclone_binary_path, rclone_config_path, plex, dry_run=False):
+    def __init__(self, config, rclone_binary_path, rclone_config_path, dry_run=False, upload_remote=None,
+                 listing=None):
         self.config = config
         self.rclone_binary_path = rclone_binary_path
         self.rclone_config_path = rclone_config_path
-        self.plex = plex
         self.dry_run = dry_run
+        self.listing = listing
+        # where the uploaded files land inside move_from_remote, incremental moves need it
+        self.prefix = None
+        if config.incremental and upload_remote:
+            self.prefix = remote_subpath(config.move_from_remote, upload_remote)
+            if self.prefix is None:
+                log.warning(f"Upload remote {upload_remote} is not inside {config.move_from_remote}, "
+                            f"moving all of it instead")
+        self.executor = None
+        self.batches = []
+
+    @property
+    def incremental(self):
+        return self.prefix is not None
+
+    def start(self, files):
+        """ move the files of an upload batch in the background, while the next batch uploads """
+        if not self.incremental or not files:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mover')
+        log.info(f"Moving the {len(files)} file(s) of the last upload batch from {self.config.move_from_remote}")
+        self.batches.append(self.executor.submit(self.move, files))
+
+    def finish(self):
+        """ wait for the background moves, the whole remote is moved when one failed or moves are not incremental """
+        if not self.incremental:
+            if self.listing is not None and self.listing.is_empty(self.config.move_from_remote):
+                log.info(f"Nothing to move from {self.config.move_from_remote}, it is empty")
+                return True
+            return self.move()
+        if self.executor is None:
+            log.info(f"Nothing was uploaded, nothing to move from {self.config.move_from_remote}")
+            return True
+
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        failed = [batch for batch in self.batches if not batch.result()]
+        self.batches = []
+        if failed:
+            log.warning(f"{len(failed)} incremental move(s) failed, moving all of {self.config.move_from_remote}")
+            return self.move()
+        return True
 
-    def move(self):
+    def move(self, files=None):
         try:
-            log.debug(f"Moving '{self.config['move_from_remote']}' to '{self.config['move_to_remote']}'")
+            log.debug(f"Moving '{self.config.move_from_remote}' to '{self.config.move_to_remote}'")
 
             # build cmd
-            cmd = f"{cmd_quote(self.rclone_binary_path)} move {cmd_quote(self.config['move_from_remote'])} {cmd_quote(self.config['move_to_remote'])} --config={cmd_quote(self.rclone_config_path)}"
-
-            extras = self.__extras2string()
-            if len(extras) > 2:
-                cmd += f' {extras}'
-            excludes = self.__excludes2string()
-            if len(excludes) > 2:
-                cmd += f' {excludes}'
-            if self.plex.get('enabled'):
-                r = re.compile(r"https?://(www\.)?")
-                rc_url = r.sub('', self.plex['rclone']['url']).strip().strip('/')
-                cmd += f' --rc --rc-addr={cmd_quote(rc_url)}'
+            cmd = [self.rclone_binary_path, 'move', self.config.move_from_remote, self.config.move_to_remote,
+                   f'--config={self.rclone_config_path}', *self.config.extra_args, *self.config.exclude_args]
+            files_from = None
+            if files is not None:
+                # only what was just uploaded, looked up one by one instead of listing either side
+                files_from = tempfile.NamedTemporaryFile('w', prefix='cloudplow-mover-', suffix='.txt')
+                files_from.write(''.join(f'{self.prefix}/{item}\n' if self.prefix else f'{item}\n'
+                                         for item in files))
+                files_from.flush()
+                cmd.extend([f'--files-from={files_from.name}', '--no-traverse'])
             if self.dry_run:
-                cmd += ' --dry-run'
+                cmd.append('--dry-run')
 
             # exec
-            log.debug(f"Using: {cmd}")
-            process.execute(cmd, logs=True)
-            return True
+            log.debug(f"Using: {argv_to_string(cmd)}")
+            try:
+                return_code = rc.jobs.execute(cmd, lambda data, job: False, f"mover:{self.config.move_from_remote}",
+                                              job=f"mover:{self.config.move_from_remote}")
+            finally:
+                if files_from is not None:
+                    files_from.close()
+                if self.listing is not None and not self.dry_run:
+                    # both sides changed, they are listed again when next needed
+                    self.listing.forget(self.config.move_from_remote)
+                    self.listing.forget(self.config.move_to_remote)
+                    self.listing.added(self.config.move_to_remote, is_dir=True)
+            if return_code:
+                log.error(f"Move from '{self.config.move_from_remote}' exited with code {return_code}")
+            return return_code == 0
 
         except Exception:
-            log.exception(f"Exception occurred while moving '{self.config['move_from_remote']}' to '{self.config['move_to_remote']}':")
+            log.exception(f"Exception occurred while moving '{self.config.move_from_remote}' to '{self.config.move_to_remote}':")
 
         return False
 
-    # internals
-    def __extras2string(self):
-        if 'rclone_extras' not in self.config:
-            return ''
-
-        return ' '.join(f"{key}={cmd_quote(value) if isinstance(value, str) else value}" for (key, value) in self.config['rclone_extras'].items()).replace('=None', '').strip()
-
-    def __excludes2string(self):
-        if 'rclone_excludes' not in self.config:
-            return ''
-
-        return ' '.join(f"--exclude={cmd_quote(glob.escape(value) if value.startswith(os.path.sep) else value) if isinstance(value,str) else value}" for value in self.config['rclone_excludes']).replace('=None', '').strip()
-
 
 class RcloneUploader:
-    def __init__(self, name, config, rclone_binary_path, rclone_config_path, plex, dry_run=False,
-                 service_account=None):
+    def __init__(self, name, config, rclone_binary_path, rclone_config_path, dry_run=False,
+                 service_account=None, excludes=(), files=None, schedule=None):
         self.name = name
         self.config = config
         self.rclone_binary_path = rclone_binary_path
         self.rclone_config_path = rclone_config_path
-        self.plex = plex
         self.dry_run = dry_run
         self.service_account = service_account
+        self.excludes = excludes
+        # only these files, relative to the upload folder, instead of everything in it
+        self.files = files
+        # the uploader's bandwidth schedule, rclone starts at its current rate
+        self.schedule = schedule
 
     def delete_file(self, path):
         try:
             log.debug(f"Deleting file '{path}' from remote {self.name}")
-            cmd = f"{cmd_quote(self.rclone_binary_path)} delete {cmd_quote(path)} --config={cmd_quote(self.rclone_config_path)} --user-agent={cmd_quote('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36')}"
+            cmd = [self.rclone_binary_path, 'delete', path, f'--config={self.rclone_config_path}',
+                   f'--user-agent={USER_AGENT}']
 
             if self.dry_run:
-                cmd += ' --dry-run'
-            log.debug(f"Using: {cmd}")
+                cmd.append('--dry-run')
+            log.debug(f"Using: {argv_to_string(cmd)}")
             resp = process.execute(cmd, logs=False)
             return 'Failed to delete' not in resp
         except Exception:
@@ -100,11 +195,12 @@ class RcloneUploader:
     def delete_folder(self, path):
         try:
             log.debug(f"Deleting folder '{path}' from remote {self.name}")
-            cmd = f"{cmd_quote(self.rclone_binary_path)} rmdir {cmd_quote(path)} --config={cmd_quote(self.rclone_config_path)} --user-agent={cmd_quote('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36')}"
+            cmd = [self.rclone_binary_path, 'rmdir', path, f'--config={self.rclone_config_path}',
+                   f'--user-agent={USER_AGENT}']
 
             if self.dry_run:
-                cmd += ' --dry-run'
-            log.debug("Using: %s", cmd)
+                cmd.append('--dry-run')
+            log.debug("Using: %s", argv_to_string(cmd))
             resp = process.execute(cmd, logs=False)
             return 'Failed to rmdir' not in resp
         except Exception:
@@ -112,138 +208,359 @@ class RcloneUploader:
 
         return False
 
-    def upload(self, callback):
+    def copy_file(self, source, target):
+        """ server side copy of a file already on the remote, nothing is uploaded """
         try:
-            log.debug(f"Uploading '{self.config['upload_folder']}' to '{self.config['upload_remote']}'")
-            log.debug(f"Rclone command set to '{self.config['rclone_command'] if ('rclone_command' in self.config and self.config['rclone_command'].lower() != 'sync') else 'move'}'")
-            # build cmd
-            cmd = f"{cmd_quote(self.rclone_binary_path)} {cmd_quote(self.config['rclone_command'] if ('rclone_command' in self.config and self.config['rclone_command'].lower() != 'sync') else 'move')} {cmd_quote(self.config['upload_folder'])} {cmd_quote(self.config['upload_remote'])} --config={cmd_quote(self.rclone_config_path)}"
-            subprocess_env = os.environ.copy()
-
+            log.debug(f"Copying '{source}' to '{target}' on remote {self.name}")
+            cmd = [self.rclone_binary_path, 'copyto', source, target, f'--config={self.rclone_config_path}',
+                   f'--user-agent={USER_AGENT}']
+            env = os.environ.copy()
             if self.service_account is not None:
+                env.update(self.service_account_env())
 
-                rclone_data = subprocess.check_output(f'rclone config dump --config={cmd_quote(self.rclone_config_path)}', shell=True)
-                rclone_remotes = jsonpickle.decode(rclone_data)
-                config_remote = self.config['upload_remote'].split(":")[0]
-
-                def find_crypt_upstream(crypt_remote):
-                    crypt_remote_upstream = rclone_remotes[crypt_remote]['remote'].split(":")[0]
-                    try:
-                        crypt_upstream_remote_type = rclone_remotes[crypt_remote_upstream]['type']
-                        if crypt_upstream_remote_type == "drive":
-                            return [crypt_remote_upstream]
-                        elif crypt_upstream_remote_type == "union":
-                            return find_union_upstreams(crypt_remote_upstream)
-                        elif crypt_upstream_remote_type == "chunker":
-                            return find_chunker_upstream(crypt_remote_upstream)
-                        else:
-                            log.warning(f'{crypt_remote_upstream} is an unsupported type: {rclone_remotes[crypt_remote_upstream]["type"]}.')
-                            return []
-                    except KeyError:
-                        log.error(f'Upstream remote {crypt_remote_upstream} does not exist in rclone.')
-                        exit(1)
-
-                def find_chunker_upstream(chunker_remote):
-                    chunker_remote_upstream = rclone_remotes[chunker_remote]['remote'].split(":")[0]
-                    try:
-                        chunker_upstream_remote_type = rclone_remotes[chunker_remote_upstream]['type']
-                        if chunker_upstream_remote_type == "drive":
-                            return [chunker_remote_upstream]
-                        elif chunker_upstream_remote_type == "union":
-                            return find_union_upstreams(chunker_remote_upstream)
-                        elif chunker_upstream_remote_type == "crypt":
-                            return find_crypt_upstream(chunker_remote_upstream)
-                        else:
-                            log.warning(f'{chunker_remote_upstream} is an unsupported type: {rclone_remotes[chunker_remote_upstream]["type"]}.')
-                            return []
-                    except KeyError:
-                        log.error(f'Upstream remote {chunker_remote_upstream} does not exist in rclone.')
-                        exit(1)
-
-                def find_union_upstreams(union_remote):
-                    union_parsed_upstream = []
-                    for upstream_remote in rclone_remotes[union_remote]['upstreams'].split(' '):
-                        remote_string = upstream_remote.split(":")[0]
-                        try:
-                            upstream_remote_type = rclone_remotes[remote_string]['type']
-                            if upstream_remote_type == "drive":
-                                union_parsed_upstream.append(upstream_remote.split(":")[0])
-                            elif upstream_remote_type == "crypt":
-                                union_parsed_upstream.extend(find_crypt_upstream(remote_string))
-                            elif remote_type == "chunker":
-                                union_parsed_upstream.extend(find_chunker_upstream(union_remote))
-                            else:
-                                log.warning(f'{remote_string} is an unsupported type: {rclone_remotes[remote_string]["type"]}.')
-                        except KeyError:
-                            log.error(f'Upstream remote {remote_string} does not exist in rclone.')
-                            exit(1)
-                    return union_parsed_upstream
-
-                parsed_remotes = []
-                try:
-                    remote_type = rclone_remotes[config_remote]['type']
-                    if remote_type == "crypt":
-                        parsed_remotes.extend(find_crypt_upstream(config_remote))
-                    elif remote_type == "chunker":
-                        parsed_remotes.extend(find_chunker_upstream(config_remote))
-                    elif remote_type == "drive":
-                        parsed_remotes.append(config_remote)
-                    elif remote_type == "union":
-                        parsed_remotes.extend(find_union_upstreams(config_remote))
-                    else:
-                        log.warning(f'{config_remote} has an unsupported type: {rclone_remotes[config_remote]["type"]}.')
+            if self.dry_run:
+                cmd.append('--dry-run')
+            log.debug(f"Using: {argv_to_string(cmd)}")
+            return process.execute(cmd, lambda data: False, env, logs=False) == 0
+        except Exception:
+            log.exception(f"Exception copying '{source}' to '{target}' on remote {self.name}: ")
+        return False
 
-                except KeyError:
-                    log.error(f'{config_remote} is an invalid remote.')
-                    exit(1)
+    def file_details(self, files):
+        """ size and modification time of files on the upload remote, relative to it, looked up in one listing """
+        details = {}
+        try:
+            with tempfile.NamedTemporaryFile('w', prefix=f'cloudplow-{self.name}-', suffix='.txt') as files_from:
+                files_from.write(''.join(f'{item}\n' for item in files))
+                files_from.flush()
+                # only the folders of the listed files are listed
+                cmd = [self.rclone_binary_path, 'lsjson', self.config.upload_remote, '--recursive', '--files-only',
+                       '--no-mimetype', f'--files-from={files_from.name}', f'--config={self.rclone_config_path}',
+                       f'--user-agent={USER_AGENT}']
+                log.debug(f"Using: {argv_to_string(cmd)}")
+                # errors share the output with the listing, keep only its objects
+                items = []
+
+                def collect(line):
+                    if line.startswith('{'):
+                        items.append(json.loads(line.rstrip(',')))
+
+                if process.execute(cmd, collect, logs=False):
+                    return details
+            for item in items:
+                details[item['Path']] = (item['Size'], _timestamp(item['ModTime']))
+        except Exception:
+            log.exception(f"Exception looking up {len(files)} uploaded file(s) on remote {self.name}: ")
+        return details
 
-                finally:
-                    log.debug(f"Parsed remotes: {parsed_remotes}")
+    def upload(self, callback, swap=None):
+        """ swap is given the rc job of the running rclone when callback stops it, True keeps that rclone going """
+        try:
+            log.debug(f"Uploading '{self.config.upload_folder}' to '{self.config.upload_remote}'")
+            log.debug(f"Rclone command set to '{self.config.rclone_command}'")
+            # build cmd
+            cmd = [self.rclone_binary_path, self.config.rclone_command, self.config.upload_folder,
+                   self.config.upload_remote, f'--config={self.rclone_config_path}', *self.config.extra_args,
+                   *self.config.exclude_args, *(f'--exclude={item}' for item in self.excludes)]
+            subprocess_env = os.environ.copy()
 
-                if parsed_remotes:
-                    for remote in list(dict.fromkeys(parsed_remotes)):
-                        remote_env = f'RCLONE_CONFIG_{remote.upper()}_SERVICE_ACCOUNT_FILE'
-                        subprocess_env[remote_env] = self.service_account
-                    log.debug(subprocess_env)
-                else:
-                    log.warning('No remotes were added to ENV.')
-
-            extras = self.__extras2string()
-            if len(extras) > 2:
-                cmd += f' {extras}'
-            excludes = self.__excludes2string()
-            if len(excludes) > 2:
-                cmd += f' {excludes}'
-            if self.plex.get('enabled'):
-                r = re.compile(r"https?://(www\.)?")
-                rc_url = r.sub('', self.plex['rclone']['url']).strip().strip('/')
-                cmd += f' --rc --rc-addr={cmd_quote(rc_url)}'
+            if self.service_account is not None:
+                subprocess_env.update(self.service_account_env())
+
+            if self.config.size_classes:
+                return True, self.__upload_size_classes(callback, subprocess_env)
+
+            files_from = None
+            if self.files is not None:
+                # the files are looked up one by one, neither side is listed
+                files_from = tempfile.NamedTemporaryFile('w', prefix=f'cloudplow-{self.name}-', suffix='.txt')
+                files_from.write(''.join(f'{item}\n' for item in self.wanted(self.files)))
+                files_from.flush()
+                cmd.extend([f'--files-from={files_from.name}', '--no-traverse'])
+            cap = self.__cap()
+            if cap:
+                cmd.append(f'--bwlimit={cap}')
             if self.dry_run:
-                cmd += ' --dry-run'
+                cmd.append('--dry-run')
+
+            def check(data, job):
+                return callback(data) and not (job and swap and swap(job))
 
             # exec
-            log.debug("Using: %s", cmd)
-            return_code = process.execute(cmd, callback, subprocess_env)
+            log.debug("Using: %s", argv_to_string(cmd))
+            try:
+                return_code = rc.jobs.execute(cmd, check, self.name, self.name, cap, env=subprocess_env,
+                                              job=f'upload:{self.name}')
+            finally:
+                if files_from is not None:
+                    files_from.close()
             return True, return_code
         except Exception:
-            log.exception("Exception occurred while uploading '%s' to remote: %s", self.config['upload_folder'],
+            log.exception("Exception occurred while uploading '%s' to remote: %s", self.config.upload_folder,
                           self.name)
             return_code = 9999
 
         return False, return_code
 
-    # internals
-    def __extras2string(self):
-        return ' '.join(f"{key}={cmd_quote(value) if isinstance(value, str) else value}" for (key, value) in
-                        self.config['rclone_extras'].items()).replace('=None', '').strip()
+    def wanted(self, files):
+        """ the files the excludes leave, rclone ignores its filters for a --files-from list """
+        excluded = GlobMatcher(self.excludes)
+        return [relative for relative in files
+                if not self.config.exclude_matcher.match(relative) and not excluded.match(relative)]
+
+    def service_account_env(self):
+        env = {}
+        remotes = self.drive_remotes()
+        if remotes:
+            for remote in remotes:
+                env[f'RCLONE_CONFIG_{remote.upper()}_SERVICE_ACCOUNT_FILE'] = self.service_account
+            log.debug(env)
+        else:
+            log.warning('No remotes were added to ENV.')
+        return env
+
+    def swap_service_account(self, job, sa_file):
+        """ switch the drive remotes of a running rclone to another service account, through its rc """
+        filesystems = self.drive_filesystems()
+        if not filesystems:
+            return False
+
+        for fs in filesystems:
+            resp = job.call('backend/command', {'command': 'set', 'fs': fs,
+                                                'opt': {'service_account_file': sa_file}})
+            if resp is None or 'error' in resp:
+                log.error(f"Failed switching {fs} of {job} to service account {sa_file}: "
+                          f"{resp.get('error') if resp else 'no response'}")
+                return False
+            log.debug(f"Switched {fs} of {job} to service account {sa_file}: {resp.get('result')}")
+
+        self.service_account = sa_file
+        return True
+
+    def drive_filesystems(self):
+        """ the drive filesystems the upload writes to, named the way the running rclone has them cached
+
+        A backend command given any other name opens a filesystem of its own, leaving the upload's untouched. None
+        when one of them cannot be named, like below a crypt whose path could not be encrypted.
+        """
+        with trace.span('rclone config dump'):
+            rclone_data = subprocess.check_output([self.rclone_binary_path, 'config', 'dump',
+                                                   f'--config={self.rclone_config_path}'])
+        name, _, root = self.config.upload_remote.partition(':')
+        filesystems = self.__wrapped_drives(json.loads(rclone_data), name, root)
+        log.debug(f"Drive filesystems of {self.config.upload_remote}: {filesystems}")
+        return list(dict.fromkeys(filesystems)) if filesystems is not None else None
+
+    def drive_remotes(self):
+        """ the drive remotes the upload remote writes to, directly or through crypt, chunker and union """
+        with trace.span('rclone config dump'):
+            rclone_data = subprocess.check_output([self.rclone_binary_path, 'config', 'dump',
+                                                   f'--config={self.rclone_config_path}'])
+        rclone_remotes = json.loads(rclone_data)
+        config_remote = self.config.upload_remote.split(":")[0]
+
+        def find_crypt_upstream(crypt_remote):
+            crypt_remote_upstream = rclone_remotes[crypt_remote]['remote'].split(":")[0]
+            try:
+                crypt_upstream_remote_type = rclone_remotes[crypt_remote_upstream]['type']
+                if crypt_upstream_remote_type == "drive":
+                    return [crypt_remote_upstream]
+                elif crypt_upstream_remote_type == "union":
+                    return find_union_upstreams(crypt_remote_upstream)
+                elif crypt_upstream_remote_type == "chunker":
+                    return find_chunker_upstream(crypt_remote_upstream)
+                else:
+                    log.warning(f'{crypt_remote_upstream} is an unsupported type: {rclone_remotes[crypt_remote_upstream]["type"]}.')
+                    return []
+            except KeyError:
+                log.error(f'Upstream remote {crypt_remote_upstream} does not exist in rclone.')
+                exit(1)
+
+        def find_chunker_upstream(chunker_remote):
+            chunker_remote_upstream = rclone_remotes[chunker_remote]['remote'].split(":")[0]
+            try:
+                chunker_upstream_remote_type = rclone_remotes[chunker_remote_upstream]['type']
+                if chunker_upstream_remote_type == "drive":
+                    return [chunker_remote_upstream]
+                elif chunker_upstream_remote_type == "union":
+                    return find_union_upstreams(chunker_remote_upstream)
+                elif chunker_upstream_remote_type == "crypt":
+                    return find_crypt_upstream(chunker_remote_upstream)
+                else:
+                    log.warning(f'{chunker_remote_upstream} is an unsupported type: {rclone_remotes[chunker_remote_upstream]["type"]}.')
+                    return []
+            except KeyError:
+                log.error(f'Upstream remote {chunker_remote_upstream} does not exist in rclone.')
+                exit(1)
+
+        def find_union_upstreams(union_remote):
+            union_parsed_upstream = []
+            for upstream_remote in rclone_remotes[union_remote]['upstreams'].split(' '):
+                remote_string = upstream_remote.split(":")[0]
+                try:
+                    upstream_remote_type = rclone_remotes[remote_string]['type']
+                    if upstream_remote_type == "drive":
+                        union_parsed_upstream.append(upstream_remote.split(":")[0])
+                    elif upstream_remote_type == "crypt":
+                        union_parsed_upstream.extend(find_crypt_upstream(remote_string))
+                    elif upstream_remote_type == "chunker":
+                        union_parsed_upstream.extend(find_chunker_upstream(remote_string))
+                    else:
+                        log.warning(f'{remote_string} is an unsupported type: {rclone_remotes[remote_string]["type"]}.')
+                except KeyError:
+                    log.error(f'Upstream remote {remote_string} does not exist in rclone.')
+                    exit(1)
+            return union_parsed_upstream
 
-    def __excludes2string(self):
-        return ' '.join(
-            "--exclude=%s" % (
-                cmd_quote(glob.escape(value) if value.startswith(os.path.sep) else value) if isinstance(value,
-                                                                                                        str) else value)
-            for value in
-            self.config['rclone_excludes']).replace('=None', '').strip()
+        parsed_remotes = []
+        try:
+            remote_type = rclone_remotes[config_remote]['type']
+            if remote_type == "crypt":
+                parsed_remotes.extend(find_crypt_upstream(config_remote))
+            elif remote_type == "chunker":
+                parsed_remotes.extend(find_chunker_upstream(config_remote))
+            elif remote_type == "drive":
+                parsed_remotes.append(config_remote)
+            elif remote_type == "union":
+                parsed_remotes.extend(find_union_upstreams(config_remote))
+            else:
+                log.warning(f'{config_remote} has an unsupported type: {rclone_remotes[config_remote]["type"]}.')
+
+        except KeyError:
+            log.error(f'{config_remote} is an invalid remote.')
+            exit(1)
+
+        finally:
+            log.debug(f"Parsed remotes: {parsed_remotes}")
+
+        return list(dict.fromkeys(parsed_remotes))
+
+    # internals
+    def __wrapped_drives(self, rclone_remotes, name, root):
+        """ wrappers open the remote they wrap with their own root joined to its path, crypt encrypts it first """
+        config = rclone_remotes.get(name, {})
+        root = root.strip('/')
+        remote_type = config.get('type')
+        if remote_type == 'drive':
+            # the canonical name rclone caches every drive filesystem under, whatever it was opened as
+            return [f'{name}:{root}']
+        if remote_type == 'union':
+            # without the :ro, :nc and :writeback policy suffixes
+            upstreams = [re.sub(r':(ro|nc|writeback)$', '', upstream)
+                         for upstream in config.get('upstreams', '').split()]
+        elif remote_type in ('crypt', 'chunker'):
+            upstreams = [config.get('remote', '')]
+            if remote_type == 'crypt' and root:
+                root = self.__encrypt_folder(name, config, root)
+                if root is None:
+                    return None
+        else:
+            log.warning(f"{name} has an unsupported type for switching service accounts: {remote_type}")
+            return []
+
+        filesystems = []
+        for upstream in upstreams:
+            upstream_name, colon, upstream_root = upstream.partition(':')
+            if not colon:
+                # a local path
+                continue
+            found = self.__wrapped_drives(rclone_remotes, upstream_name,
+                                          '/'.join(part for part in (upstream_root.strip('/'), root) if part))
+            if found is None:
+                return None
+            filesystems.extend(found)
+        return filesystems
+
+    def __encrypt_folder(self, name, config, root):
+        if config.get('filename_encryption', 'standard') == 'off' or \
+                str(config.get('directory_name_encryption', 'true')).lower() == 'false':
+            # folder names are stored as they are
+            return root
+        try:
+            output = subprocess.check_output([self.rclone_binary_path, 'cryptdecode', '--reverse', f'{name}:', root,
+                                              f'--config={self.rclone_config_path}'], text=True)
+            # printed as "<name> \t <encrypted name>"
+            return output.rsplit('\t', 1)[1].strip()
+        except Exception:
+            log.exception(f"Exception encrypting '{root}' with {name}: ")
+            return None
+
+    def __cap(self, jobs=1):
+        """ this rclone's part of the bandwidth schedule's current rate """
+        rate = self.schedule.rate_at() if self.schedule else None
+        return misc.bytes_to_size(misc.size_to_bytes(rate) / jobs) if rate and jobs > 1 else rate
+
+    def __upload_size_classes(self, callback, subprocess_env):
+        batches = [(size_class, files) for size_class, files in self.__classify() if files]
+        if not batches:
+            log.info(f"Nothing to upload from '{self.config.upload_folder}'")
+            return 0
+
+        # every class gets its own rclone, the biggest files start first so the link is busy from the start
+        batches.reverse()
+        log.info(f"Uploading {', '.join(f'{len(files)} {size_class.name}' for size_class, files in batches)} "
+                 f"file(s) to remote: {self.name}")
+        stopped = threading.Event()
+
+        def check(data):
+            # the upload limit ends every class, not just the one that hit it
+            return stopped.is_set() or callback(data)
+
+        def run(size_class, files):
+            with tempfile.NamedTemporaryFile('w', prefix=f'cloudplow-{self.name}-{size_class.name}-',
+                                             suffix='.txt') as files_from:
+                files_from.write(''.join(f'{item}\n' for item in files))
+                files_from.flush()
+
+                cmd = [self.rclone_binary_path, self.config.rclone_command, self.config.upload_folder,
+                       self.config.upload_remote, f'--config={self.rclone_config_path}', *size_class.extra_args,
+                       *self.config.exclude_args, *(f'--exclude={item}' for item in self.excludes),
+                       f'--files-from={files_from.name}']
+                if self.files is not None:
+                    cmd.append('--no-traverse')
+                if not any(arg.startswith('--order-by') for arg in size_class.extra_args):
+                    cmd.append('--order-by=size,descending')
+                cap = self.__cap(len(batches))
+                if cap:
+                    cmd.append(f'--bwlimit={cap}')
+                if self.dry_run:
+                    cmd.append('--dry-run')
+
+                log.debug("Using: %s", argv_to_string(cmd))
+                return_code = rc.jobs.execute(cmd, lambda data, job: check(data), f'{self.name}:{size_class.name}',
+                                              self.name, cap, env=subprocess_env,
+                                              job=f'upload:{self.name}:{size_class.name}')
+                if return_code == 7:
+                    stopped.set()
+                log.info(f"Upload of the {size_class.name} files to remote {self.name} finished with exit code {return_code}")
+                return return_code
+
+        with ThreadPoolExecutor(max_workers=len(batches), thread_name_prefix=f'upload-{self.name}') as executor:
+            return_codes = list(executor.map(lambda batch: run(*batch), batches))
+
+        # the upload limit decides the outcome (rotate or sleep), then triggers, then any other failure
+        for wanted in (7, -9):
+            if wanted in return_codes:
+                return wanted
+        return next((return_code for return_code in return_codes if return_code), 0)
+
+    def __classify(self):
+        batches = [(size_class, []) for size_class in self.config.size_classes]
+        if self.files is not None:
+            listed = self.files
+        else:
+            listed = (os.path.relpath(os.path.join(folder, name), self.config.upload_folder)
+                      for folder, _, names in os.walk(self.config.upload_folder) for name in names)
+
+        for relative in self.wanted(listed):
+            try:
+                size = os.path.getsize(os.path.join(self.config.upload_folder, relative))
+            except OSError:
+                # gone since the walk found it
+                continue
+            # the first class it fits, anything bigger than every class goes with the biggest
+            next((files for size_class, files in batches if size_class.fits(size)), batches[-1][1]).append(relative)
+        return batches
 
 
 class RcloneSyncer:
@@ -252,17 +569,36 @@ class RcloneSyncer:
         self.to_config = to_remote
 
         # trigger logic
-        self.rclone_sleeps = misc.merge_dicts(self.from_config['rclone_sleeps'], self.to_config['rclone_sleeps'])
-        self.trigger_tracks = {}
-        self.delayed_check = 0
-        self.delayed_trigger = None
+        self.triggers = self.from_config.triggers.merge(self.to_config.triggers).tracker()
 
         # parse rclone_extras from kwargs
-        self.rclone_extras = kwargs.get('rclone_extras', {})
+        self.rclone_extras = extras_to_args(kwargs.get('rclone_extras', {}), 'rclone_extras')
         # parse dry_run from kwargs
         self.dry_run = kwargs.get('dry_run', False)
         # parse use_copy from kwargs
         self.use_copy = kwargs.get('use_copy', False)
+        # parse syncer_name from kwargs
+        self.syncer_name = kwargs.get('syncer_name', 'sync')
+        # parse incremental and full_sync_interval from kwargs (default off, a full sync once a week)
+        self.full_sync_interval = kwargs.get('full_sync_interval', FULL_SYNC_INTERVAL)
+        # parse sync_shards from kwargs (default off, one rclone for the whole remote)
+        self.shards = int(kwargs.get('sync_shards', 0) or 0)
+        conflicts = [arg for arg in self.rclone_extras if arg.split('=', 1)[0] in SHARD_CONFLICTS]
+        if self.shards > 1 and conflicts:
+            log.warning(f"Not sharding syncs of {self.syncer_name}, its rclone_extras conflict with the shard filters: "
+                        f"{', '.join(conflicts)}")
+            self.shards = 0
+        self.snapshot = None
+        if kwargs.get('incremental', False) and kwargs.get('cache_file'):
+            self.snapshot = SyncSnapshot(snapshot_file(kwargs['cache_file']), self.syncer_name)
+
+    @property
+    def delayed_check(self):
+        return self.triggers.delayed_check
+
+    @property
+    def delayed_trigger(self):
+        return self.triggers.delayed_trigger
 
     def sync(self, cmd_wrapper):
         if not cmd_wrapper:
@@ -270,12 +606,29 @@ class RcloneSyncer:
                 "You must provide a cmd_wrapper method to wrap the rclone sync command for the desired sync agent")
             return False, self.delayed_check, self.delayed_trigger
 
-        # build sync command
-        cmd = f"rclone {'copy' if self.use_copy else 'sync'} {cmd_quote(self.from_config['sync_remote'])} {cmd_quote(self.to_config['sync_remote'])}"
+        try:
+            started = time.time()
+            if self.snapshot is not None:
+                state = self.snapshot.state
+                if state.get('checkpoint') and started - state.get('full', 0) < self.full_sync_interval * 3600:
+                    return self.__sync_incremental(cmd_wrapper, state['checkpoint'], started)
+                log.info(f"Running a full sync for {self.syncer_name}, "
+                         f"{'no snapshot was taken yet' if not state.get('full') else 'the last one was ' + time.strftime('%Y-%m-%d %H:%M', time.localtime(state['full']))}")
+
+            code = self.__sync_sharded(cmd_wrapper) if self.shards > 1 else self.__sync_full(cmd_wrapper)
+            if self.snapshot is not None and code == 0 and not self.delayed_check and not self.dry_run:
+                self.__refresh_snapshot(cmd_wrapper, started)
+            return not self.delayed_check, self.delayed_check, self.delayed_trigger
+        finally:
+            if self.snapshot is not None:
+                self.snapshot.close()
 
-        extras = self.__extras2string()
-        if len(extras) > 2:
-            cmd += f' {extras}'
+    # internals
+
+    def __sync_full(self, cmd_wrapper, filters=(), job=None):
+        # build sync command
+        cmd = argv_to_string(['rclone', 'copy' if self.use_copy else 'sync', self.from_config.sync_remote,
+                              self.to_config.sync_remote, *self.rclone_extras, *filters])
         if self.dry_run:
             cmd += ' --dry-run'
 
@@ -283,121 +636,212 @@ class RcloneSyncer:
         log.debug("Using: %s", sync_agent_cmd)
 
         # exec
-        process.execute(sync_agent_cmd, self._sync_logic)
-        return not self.delayed_check, self.delayed_check, self.delayed_trigger
+        return process.execute(sync_agent_cmd, self.triggers.check, job=job or f'sync:{self.syncer_name}')
+
+    def __sync_sharded(self, cmd_wrapper):
+        folders = []
+        code = self.__list(cmd_wrapper, lambda path, entry: folders.append(path), '--dirs-only')
+        if code != 0 or not folders:
+            log.warning(f"Could not split {self.from_config.sync_remote} into shards (exit code {code}, "
+                        f"{len(folders)} folder(s)), syncing it with one rclone")
+            return self.__sync_full(cmd_wrapper)
+
+        # each group of top level folders is one shard, the last one takes everything else: files at the top level,
+        # folders only the destination has (so sync still deletes them) and folders created since the listing
+        folders = sorted(folders)
+        count = min(len(folders), self.shards * SHARDS_PER_WORKER)
+        groups = [folders[index::count] for index in range(count)]
+        shards = [[f'--filter=+ /{_filter_escape(folder)}/**' for folder in group] + ['--filter=- /**']
+                  for group in groups]
+        shards.append([f'--filter=- /{_filter_escape(folder)}/**' for folder in folders] + ['--filter=+ /**'])
+
+        workers = min(self.shards, len(shards))
+        log.info(f"Syncing {len(folders)} top level folder(s) of {self.from_config.sync_remote} in {len(shards)} "
+                 f"shards, {workers} at a time")
+
+        def run(index, filters):
+            # a trigger met by any shard stops the rest, the tracker keeps answering True once tripped
+            if self.triggers.tripped:
+                return None
+            return self.__sync_full(cmd_wrapper, filters, job=f'sync:{self.syncer_name}:{index + 1}/{len(shards)}')
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'shard-{self.syncer_name}') as executor:
+            codes = list(executor.map(run, range(len(shards)), shards))
+
+        failed = [(index + 1, code) for index, code in enumerate(codes) if code]
+        skipped = codes.count(None)
+        if failed or skipped:
+            log.error(f"Sharded sync of {self.syncer_name} had {len(failed)} failed and {skipped} skipped shard(s): "
+                      f"{', '.join(f'{index}/{len(shards)} exit code {code}' for index, code in failed)}")
+        return failed[0][1] if failed else (1 if skipped else 0)
+
+    def __sync_incremental(self, cmd_wrapper, checkpoint, started):
+        max_age = int(started - checkpoint + CHECKPOINT_MARGIN)
+        log.info(f"Listing files of {self.from_config.sync_remote} modified in the last {misc.seconds_to_string(max_age)}")
+        changed = {}
+        code = self.__list(cmd_wrapper, lambda path, entry: changed.__setitem__(path, entry),
+                           '-R', '--files-only', '--hash', '--max-age', f'{max_age}s')
+        if code != 0:
+            log.error(f"Listing changes of {self.from_config.sync_remote} failed with exit code {code}, "
+                      f"not syncing {self.syncer_name} until the next run")
+            return False, None, None
+
+        delta = sorted(path for path, entry in changed.items() if self.snapshot.get(path) != entry)
+        log.info(f"{len(delta)} of {len(changed)} recently modified file(s) differ from the snapshot of {self.syncer_name}")
+        if not delta:
+            if not self.dry_run:
+                self.snapshot.update([], started)
+            return True, None, None
+
+        with tempfile.NamedTemporaryFile('w', prefix=f'cloudplow-{self.syncer_name}-', suffix='.txt') as files_from:
+            files_from.write(''.join(f'{path}\n' for path in delta))
+            files_from.flush()
+
+            # copy rather than sync, deletions and renames reach the destination with the next full sync
+            cmd = argv_to_string(['rclone', 'copy', self.from_config.sync_remote, self.to_config.sync_remote,
+                                  '--files-from', files_from.name, '--no-traverse', *self.rclone_extras])
+            if self.dry_run:
+                cmd += ' --dry-run'
 
-    # internals
+            sync_agent_cmd = cmd_wrapper(cmd)
+            log.debug("Using: %s", sync_agent_cmd)
+            code = process.execute(sync_agent_cmd, self.triggers.check, job=f'sync:{self.syncer_name}')
 
-    def _sync_logic(self, data):
-        # loop sleep triggers
-        for trigger_text, trigger_config in self.rclone_sleeps.items():
-            # check/reset trigger timeout
-            if (
-                    trigger_text in self.trigger_tracks
-                    and self.trigger_tracks[trigger_text]['expires'] != ''
-                    and time.time() >= self.trigger_tracks[trigger_text]['expires']
-            ):
-                log.warning("Tracking of trigger: %r has expired, resetting occurrence count and timeout",
-                            trigger_text)
-                self.trigger_tracks[trigger_text] = {'count': 0, 'expires': ''}
-
-            # check if trigger_text is in data
-            if trigger_text.lower() in data.lower():
-                # check / increase tracking count of trigger_text
-                if trigger_text not in self.trigger_tracks or self.trigger_tracks[trigger_text]['count'] == 0:
-                    # set initial tracking info for trigger
-                    self.trigger_tracks[trigger_text] = {'count': 1, 'expires': time.time() + trigger_config['timeout']}
-                    log.warning("Tracked first occurrence of trigger: %r. Expiring in %d seconds at %s", trigger_text,
-                                trigger_config['timeout'], time.strftime('%Y-%m-%d %H:%M:%S',
-                                                                         time.localtime(
-                                                                             self.trigger_tracks[trigger_text][
-                                                                                 'expires'])))
-                else:
-                    # trigger_text WAS seen before increase count
-                    self.trigger_tracks[trigger_text]['count'] += 1
-                    log.warning("Tracked trigger: %r has occurred %d/%d times within %d seconds", trigger_text,
-                                self.trigger_tracks[trigger_text]['count'], trigger_config['count'],
-                                trigger_config['timeout'])
-
-                    # check if trigger_text was found the required amount of times to abort
-                    if self.trigger_tracks[trigger_text]['count'] >= trigger_config['count']:
-                        log.warning(
-                            "Tracked trigger %r has reached the maximum limit of %d occurrences within %d seconds,"
-                            " aborting upload...", trigger_text, trigger_config['count'], trigger_config['timeout'])
-                        self.delayed_check = trigger_config['sleep']
-                        self.delayed_trigger = trigger_text
-                        return True
-        return False
+        if code == 0 and not self.delayed_check and not self.dry_run:
+            self.snapshot.update(((path, changed[path]) for path in delta), started)
+        return not self.delayed_check, self.delayed_check, self.delayed_trigger
+
+    def __refresh_snapshot(self, cmd_wrapper, started):
+        log.info(f"Taking a snapshot of {self.from_config.sync_remote} for incremental syncs of {self.syncer_name}")
+        self.snapshot.begin()
+        code = self.__list(cmd_wrapper, self.snapshot.add, '-R', '--files-only', '--hash')
+        if code != 0:
+            log.error(f"Listing {self.from_config.sync_remote} failed with exit code {code}, keeping the previous snapshot")
+            self.snapshot.abort()
+            return
+        self.snapshot.finish(started)
+
+    def __list(self, cmd_wrapper, on_entry, *flags):
+        cmd = argv_to_string(['rclone', 'lsjson', self.from_config.sync_remote, *flags, *self.rclone_extras])
+
+        def parse(line):
+            # lsjson prints one object per line between [ and ]
+            if not line.startswith('{'):
+                if line not in ('[', ']'):
+                    log.debug(f"lsjson: {line}")
+                return False
+            try:
+                item = json.loads(line.rstrip(','))
+                hashes = item.get('Hashes') or {}
+                on_entry(item['Path'], [item.get('Size'), item.get('ModTime'), next(iter(hashes.values()), None)])
+            except ValueError:
+                log.warning(f"Unexpected lsjson output: {line}")
+            return False
 
-    def __extras2string(self):
-        return ' '.join(f"{key}={cmd_quote(value) if isinstance(value, str) else value}" for (key, value) in
-                        self.rclone_extras.items()).replace('=None', '').strip()
+        return process.execute(cmd_wrapper(cmd), parse, logs=False, job=f'list:{self.syncer_name}')
 
 
 class RcloneThrottler:
-    def __init__(self, url):
-        self.url = url
+    """ throttles every registered rclone job, splitting the allowed bandwidth between them """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.throttled_jobs = set()
 
     def validate(self):
         success = False
-        payload = {'validated': True}
-        try:
-            resp = requests.post(urljoin(self.url, 'rc/noop'), json=payload, timeout=15, verify=False)
-            if '{' in resp.text and '}' in resp.text:
-                data = resp.json()
-                success = data['validated']
-        except Exception:
-            log.exception("Exception validating rc url %s: ", self.url)
+        for job in self.jobs.active():
+            data = job.call('rc/noop', {'validated': True})
+            if data and data.get('validated'):
+                success = True
+            else:
+                log.error("Failed to validate rc endpoint of %s", job)
         return success
 
     def throttle_active(self, speed):
-        if speed:
-            try:
-                resp = requests.post(urljoin(self.url, 'core/stats'), timeout=15, verify=False)
-                if '{' in resp.text and '}' in resp.text:
-                    data = resp.json()
-                    if 'transferring' in data and len(data['transferring']) > 0:
-                        # Sum total speed of all active transfers to determine if greater than current_speed
-                        current_speed = sum(
-                            float(transfer['speed'])
-                            for transfer in data['transferring']
-                        )
-
-                        return (current_speed / 1000000) - 10 <= float(speed.rstrip('M'))
-            except Exception:
-                log.exception("Exception checking if throttle currently active")
-
-        return False
+        if not speed:
+            return False
+
+        active_jobs = self.jobs.active()
+        if not active_jobs or {job.name for job in active_jobs} != self.throttled_jobs:
+            # jobs started or finished since the last throttle, the split needs recalculating
+            return False
+
+        share = misc.size_to_bytes(speed) / len(active_jobs)
+        for job in active_jobs:
+            data = job.call('core/stats')
+            if not data:
+                return False
+            if 'transferring' in data and len(data['transferring']) > 0:
+                # Sum total speed of all active transfers to determine if greater than this jobs share
+                current_speed = sum(
+                    float(transfer['speed'])
+                    for transfer in data['transferring']
+                )
+                if (current_speed / 1000000) - 10 > share / 1000000:
+                    return False
+        return True
 
     def throttle(self, speed):
-        success = False
-        payload = {'rate': speed}
-        try:
-            resp = requests.post(urljoin(self.url, 'core/bwlimit'), json=payload, timeout=15, verify=False)
-            if '{' in resp.text and '}' in resp.text:
-                data = resp.json()
-                if 'error' in data:
-                    log.error("Failed to throttle %s: %s", self.url, data['error'])
-                elif 'rate' in data and speed in data['rate']:
-                    log.warning("Successfully throttled %s to %s.", self.url, speed)
-                    success = True
-
-        except Exception:
-            log.exception("Exception sending throttle request to %s: ", self.url)
+        active_jobs = self.jobs.active()
+        if not active_jobs:
+            return False
+
+        share = misc.bytes_to_size(misc.size_to_bytes(speed) / len(active_jobs))
+        success = True
+        for job in active_jobs:
+            job.share = share
+            if self.__bwlimit(job, job.limit):
+                log.warning("Successfully throttled %s to %s (%s shared between %d job(s)).", job, job.limit, speed,
+                            len(active_jobs))
+            else:
+                success = False
+
+        self.throttled_jobs = {job.name for job in active_jobs} if success else set()
         return success
 
     def no_throttle(self):
-        success = False
-        payload = {'rate': 'off'}
-        try:
-            resp = requests.post(urljoin(self.url, 'core/bwlimit'), json=payload, timeout=15, verify=False)
-            if '{' in resp.text and '}' in resp.text:
-                data = resp.json()
-                if 'error' in data:
-                    log.error("Failed to un-throttle %s: %s", self.url, data['error'])
-                elif 'rate' in data and data['rate'] == 'off':
-                    log.warning("Successfully un-throttled %s", self.url)
-                    success = True
-        except Exception:
-            log.exception("Exception sending un-throttle request to %s: ", self.url)
+        success = True
+        for job in self.jobs.active():
+            job.share = None
+            # back to what the bandwidth schedule allows, if the job has one
+            if self.__bwlimit(job, job.limit):
+                log.warning("Successfully un-throttled %s", job)
+            else:
+                success = False
+
+        self.throttled_jobs = set()
         return success
+
+    def schedule(self, owner, rate):
+        """ cap the jobs of an uploader at the rate of its bandwidth schedule, None lifts the cap """
+        owned = [job for job in self.jobs.active() if job.owner == owner]
+        if rate and len(owned) > 1:
+            # the uploader's jobs share the rate, like they share the Plex throttle
+            rate = misc.bytes_to_size(misc.size_to_bytes(rate) / len(owned))
+        success = True
+        for job in owned:
+            if job.cap == rate:
+                continue
+            previous, job.cap = job.cap, rate
+            if self.__bwlimit(job, job.limit):
+                log.info(f"Set the bandwidth limit of {job} to {job.limit} for the bandwidth schedule of {owner}")
+            else:
+                # tried again on the next check
+                job.cap = previous
+                success = False
+        return success
+
+    # internals
+    @staticmethod
+    def __bwlimit(job, rate):
+        data = job.call('core/bwlimit', {'rate': rate})
+        if not data:
+            return False
+        elif 'error' in data:
+            log.error("Failed to set bandwidth limit of %s to %s: %s", job, rate, data['error'])
+            return False
+        elif 'rate' in data:
+            job.rate = None if rate == 'off' else rate
+            return True
+        return False
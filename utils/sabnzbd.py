@@ -1,11 +1,18 @@
-import urllib
+import logging
+
+import requests
+
+log = logging.getLogger("sabnzbd")
 
 
 class Sabnzbd(object):
+    NAME = 'Sabnzbd'
 
-    def __init__(self, url, apikey=''):
+    def __init__(self, url, apikey='', timeout=10):
         self.url = url
         self.apikey = apikey
+        self.timeout = timeout
+        self.session = requests.Session()
 
     def request(self, mode, output=True, **kwargs):
         kwargs['apikey'] = self.apikey
@@ -13,45 +20,27 @@ class Sabnzbd(object):
 
         if output:
             kwargs['output'] = 'json'
-        url = f'{self.url}/api?{urllib.parse.urlencode(kwargs)}'
 
         try:
-            result = urllib.request.urlopen(url)
-            if output:
-                print("Result is ", result.reason)
-            if mode == "pause":
-                self.paused = True
-            if mode == "resume":
-                self.resumed = True
-        except urllib.error.HTTPError as error:
-            print(f"Failed to {mode} with error code {error.code}")
-            return None
+            resp = self.session.get(f'{self.url}/api', params=kwargs, timeout=self.timeout, verify=False)
+            if resp.status_code != 200:
+                log.error(f"Failed to {mode} with status code {resp.status_code}: {resp.text}")
+                return None
+            return resp.json() if output else resp.text
+        except Exception:
+            log.exception(f"Exception requesting {mode} from Sabnzbd: ")
+        return None
 
     def pause_queue(self):
-        self.paused = False
-        self.request('pause')
-        return self.paused
+        resp = self.request('pause')
+        return bool(resp and resp.get('status'))
 
     def resume_queue(self):
-        self.resumed = False
-        self.request('resume')
-        return self.resumed
-
-# Can we use this in the furture ??
-#    def shutdown(self):
-#        self.request('shutdown')
-
-#    def status(self, advanced=False):
-#        if advanced:
-#            return self.request('status', True)
-#        else:
-#            return self.request('qstatus', True)
-
-#    def limit(self):
-#        try:
-#            return self.status(advanced=True)['limit']
-#        except:
-#            return
-
-#    def setLimit(self, value=0):
-#        self.request('config', name='speedlimit', value=value)
+        resp = self.request('resume')
+        return bool(resp and resp.get('status'))
+
+    def set_speed_limit(self, rate):
+        """ rate is in bytes per second, None removes the limit """
+        value = 100 if rate is None else f'{max(int(rate // 1024), 1)}K'
+        resp = self.request('config', name='speedlimit', value=value)
+        return bool(resp and resp.get('status'))
@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import re
+
+from sqlitedict import SqliteDict
+
+log = logging.getLogger('snapshot')
+
+
+def snapshot_file(cache_file):
+    """ snapshots are kept next to the cache, in their own file so a long refresh never locks the bans """
+    return f'{os.path.splitext(cache_file)[0]}-snapshots.db'
+
+
+class SyncSnapshot:
+    """ what the source of a syncer held after its last successful sync, path -> [size, modtime, hash]
+
+    A successful sync leaves both sides identical, so this one listing stands for both of them. Full refreshes are
+    written to the spare of two tables and only take over once complete, a failed listing leaves the old one intact.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.prefix = 'files_' + re.sub(r'\W', '_', name)
+        self.checkpoints = SqliteDict(path, tablename='checkpoints', encode=json.dumps, decode=json.loads,
+                                      autocommit=True)
+        self.files = None
+        self.refresh = None
+
+    @property
+    def state(self):
+        return self.checkpoints.get(self.name) or {}
+
+    def get(self, path):
+        if self.files is None:
+            self.files = self.__open(self.state.get('table', f'{self.prefix}_a'))
+        return self.files.get(path)
+
+    def update(self, entries, checkpoint):
+        """ record the files an incremental sync transferred """
+        if self.files is None:
+            self.files = self.__open(self.state.get('table', f'{self.prefix}_a'))
+        count = 0
+        for path, entry in entries:
+            self.files[path] = entry
+            count += 1
+        self.files.commit()
+        self.checkpoints[self.name] = dict(self.state, checkpoint=checkpoint)
+        log.debug(f"Updated {count} file(s) in the snapshot of {self.name}")
+
+    def begin(self):
+        """ start a full listing taken after a full sync, add() its entries as they stream in and finish() it """
+        self.abort()
+        table = f'{self.prefix}_b' if self.state.get('table') == f'{self.prefix}_a' else f'{self.prefix}_a'
+        self.refresh = [table, SqliteDict(self.path, tablename=table, encode=json.dumps, decode=json.loads,
+                                          flag='w'), 0]
+
+    def add(self, path, entry):
+        self.refresh[1][path] = entry
+        self.refresh[2] += 1
+
+    def finish(self, checkpoint):
+        table, files, count = self.refresh
+        files.commit()
+        files.close()
+        self.refresh = None
+
+        # readers of the previous table see the swap on their next open
+        if self.files is not None:
+            self.files.close()
+            self.files = None
+        self.checkpoints[self.name] = {'table': table, 'checkpoint': checkpoint, 'full': checkpoint, 'files': count}
+        log.info(f"Stored a snapshot of {count} file(s) for {self.name}")
+
+    def abort(self):
+        if self.refresh is not None:
+            # never committed, the table in use is left as it was
+            self.refresh[1].close(force=True)
+            self.refresh = None
+
+    def close(self):
+        self.abort()
+        if self.files is not None:
+            self.files.close()
+            self.files = None
+        self.checkpoints.close()
+
+    # internals
+    def __open(self, table):
+        return SqliteDict(self.path, tablename=table, encode=json.dumps, decode=json.loads)
@@ -0,0 +1,143 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+log = logging.getLogger('state')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+THROTTLED = 'throttled'
+ROTATING = 'rotating'
+DONE = 'done'
+
+# where a job can go from each state, a finished job stays finished
+TRANSITIONS = {
+    QUEUED: (RUNNING, DONE),
+    RUNNING: (THROTTLED, ROTATING, DONE),
+    THROTTLED: (RUNNING, ROTATING, DONE),
+    ROTATING: (RUNNING, THROTTLED, DONE),
+    DONE: (),
+}
+
+Event = collections.namedtuple('Event', ('job', 'state', 'previous', 'reason', 'time'))
+
+
+class EventBus:
+    """ hands every state change to the subscribers, and wakes up whoever waits for one """
+
+    def __init__(self):
+        self.subscribers = []
+        self.condition = threading.Condition()
+
+    def subscribe(self, callback):
+        with self.condition:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.condition:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def publish(self, event):
+        with self.condition:
+            subscribers = list(self.subscribers)
+            self.condition.notify_all()
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                log.exception(f"Exception handing {event.job} becoming {event.state} to {callback}: ")
+
+    def wait_for(self, predicate, timeout=None):
+        """ wait until predicate holds, checked on every event, returns its last result """
+        with self.condition:
+            return self.condition.wait_for(predicate, timeout)
+
+
+class Job:
+    """ an upload, sync or hidden clean of this process, from waiting for its lock until it finished """
+
+    def __init__(self, kind, name, bus):
+        self.kind = kind
+        self.name = name
+        self.bus = bus
+        self.state = QUEUED
+        self.since = time.time()
+
+    @property
+    def done(self):
+        return self.state == DONE
+
+    def set(self, state, reason=None):
+        """ move to state, False when the current state cannot go there """
+        with self.bus.condition:
+            previous = self.state
+            if state == previous:
+                return True
+            if state not in TRANSITIONS[previous]:
+                log.error(f"{self} cannot go from {previous} to {state}")
+                return False
+            self.state = state
+            self.since = time.time()
+
+        log.debug(f"{self} went from {previous} to {state}{f' ({reason})' if reason else ''}")
+        self.bus.publish(Event(self, state, previous, reason, self.since))
+        return True
+
+    def wait(self, timeout=None):
+        """ wait for the job to finish, up to timeout seconds, returns whether it did """
+        return self.bus.wait_for(lambda: self.done, timeout)
+
+    def __str__(self):
+        return f'{self.kind} {self.name}' if self.name else self.kind
+
+    def __repr__(self):
+        return str(self)
+
+
+class JobStates:
+    """ registry of the jobs of this process, cross-process exclusion is left to the locks """
+
+    def __init__(self):
+        self.bus = EventBus()
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def start(self, kind, name=None):
+        job = Job(kind, name, self.bus)
+        with self.lock:
+            self.jobs.append(job)
+        log.debug(f"{job} is {QUEUED}")
+        self.bus.publish(Event(job, QUEUED, None, None, job.since))
+        return job
+
+    @contextlib.contextmanager
+    def run(self, kind, name, lock_file):
+        """ queued while waiting for lock_file, running once it holds it and done afterwards, however it ends """
+        job = self.start(kind, name)
+        try:
+            with lock_file:
+                job.set(RUNNING)
+                yield job
+        finally:
+            self.finish(job)
+
+    def finish(self, job, reason=None):
+        job.set(DONE, reason)
+        with self.lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    def get(self, kind, name=None):
+        """ the oldest such job, the one holding the lock when others queue behind it """
+        with self.lock:
+            return next((job for job in self.jobs if job.kind == kind and job.name == name), None)
+
+    def active(self, kind=None):
+        with self.lock:
+            return [job for job in self.jobs if kind is None or job.kind == kind]
+
+
+jobs = JobStates()
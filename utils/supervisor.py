@@ -0,0 +1,114 @@
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from collections import OrderedDict
+
+log = logging.getLogger('supervisor')
+
+
+class Supervisor:
+    """ runs named tasks in child processes, at most max_workers at a time and one per name
+
+    The return value of a task is sent back to the parent over a queue and handed to on_result by poll(), which the
+    parent calls from its main loop. poll() also reaps finished children and starts tasks waiting for a free slot.
+    """
+
+    def __init__(self, max_workers, on_result=None):
+        # children inherit the loaded config, syncers and notification agents, so they are forked
+        self.context = multiprocessing.get_context('fork')
+        self.max_workers = max(int(max_workers), 1)
+        self.on_result = on_result
+        self.results = self.context.Queue()
+        self.workers = {}
+        self.pending = OrderedDict()
+        self.answered = set()
+
+    def submit(self, name, task, **kwargs):
+        if name in self.workers or name in self.pending:
+            log.info(f"{name} is already {'running' if name in self.workers else 'queued'}, not starting it again")
+            return False
+
+        self.pending[name] = (task, kwargs)
+        if len(self.workers) >= self.max_workers:
+            log.info(f"Queued {name}, {len(self.workers)}/{self.max_workers} workers are busy: "
+                     f"{', '.join(self.workers)}")
+        self.__start_pending()
+        return True
+
+    def poll(self):
+        self.__drain()
+
+        finished = [(name, process) for name, process in self.workers.items() if not process.is_alive()]
+        if finished:
+            # a child is only done once the queue has taken its result, pick up what arrived while it exited
+            self.__drain()
+        for name, process in finished:
+            process.join()
+            del self.workers[name]
+            if (name, process.pid) in self.answered:
+                self.answered.discard((name, process.pid))
+                log.debug(f"Reaped worker {process.pid} of {name}, exit code {process.exitcode}")
+                continue
+            # killed or crashed before it could report back
+            log.error(f"Worker {process.pid} of {name} died with exit code {process.exitcode} without a result")
+            self.__deliver({'name': name, 'pid': process.pid, 'ok': False, 'value': None,
+                            'error': f'exited with code {process.exitcode}', 'duration': None})
+
+        self.__start_pending()
+
+    def stop(self, timeout=30):
+        """ wait up to timeout seconds for running workers, terminate the rest and forget anything still queued """
+        self.pending.clear()
+        deadline = time.time() + timeout
+        for name, process in list(self.workers.items()):
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                log.warning(f"Terminating worker {process.pid} of {name}, it did not finish within {timeout} seconds")
+                process.terminate()
+                process.join(5)
+        self.poll()
+
+    # internals
+    def __drain(self):
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.answered.add((result['name'], result['pid']))
+            self.__deliver(result)
+
+    def __start_pending(self):
+        while self.pending and len(self.workers) < self.max_workers:
+            name, (task, kwargs) = self.pending.popitem(last=False)
+            try:
+                process = self.context.Process(target=_run, args=(self.results, name, task, kwargs),
+                                               name=f'worker-{name}', daemon=False)
+                process.start()
+                self.workers[name] = process
+                log.info(f"Started worker {process.pid} for {name} ({len(self.workers)}/{self.max_workers} busy)")
+            except Exception:
+                log.exception(f"Exception starting worker for {name}: ")
+
+    def __deliver(self, result):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(result)
+        except Exception:
+            log.exception(f"Exception handling the result of {result['name']}: ")
+
+
+def _run(results, name, task, kwargs):
+    started = time.time()
+    result = {'name': name, 'pid': os.getpid(), 'ok': False, 'value': None, 'error': None, 'duration': None}
+    try:
+        result['value'] = task(**kwargs)
+        result['ok'] = True
+    except BaseException as ex:
+        log.exception(f"Exception running {name} in worker {os.getpid()}: ")
+        result['error'] = repr(ex)
+    result['duration'] = time.time() - started
+    results.put(result)
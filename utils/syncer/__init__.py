@@ -1,14 +1,15 @@
+import importlib
 import logging
 import uuid
 
-from .local import Local
-from .scaleway import Scaleway
+from .. import trace
 
 log = logging.getLogger("syncer")
 
+# services are imported on first load, so unused agents cost nothing at startup
 SERVICES = {
-    'scaleway': Scaleway,
-    'local': Local
+    'scaleway': '.scaleway.Scaleway',
+    'local': '.local.Local'
 }
 
 
@@ -36,12 +37,13 @@ class Syncer:
 
         try:
             # retrieve remotes config for sync_from and sync_to
-            sync_from_config = self.config['remotes'][kwargs['sync_from']]
-            sync_to_config = self.config['remotes'][kwargs['sync_to']]
+            sync_from_config = self.config.remotes[kwargs['sync_from']]
+            sync_to_config = self.config.remotes[kwargs['sync_to']]
 
             # clean kwargs before initializing the service
             tool_path = kwargs['tool_path']
-            chosen_service = SERVICES[kwargs['service']]
+            module_name, class_name = SERVICES[kwargs['service']].rsplit('.', 1)
+            chosen_service = getattr(importlib.import_module(module_name, __name__), class_name)
             del kwargs['service']
             del kwargs['sync_from']
             del kwargs['sync_to']
@@ -76,12 +78,13 @@ class Syncer:
                 if syncer.syncer_name != kwargs['name']:
                     continue
 
-                return syncer.startup(**kwargs)
+                with trace.span('syncer startup', syncer=syncer.syncer_name):
+                    return syncer.startup(**kwargs)
         except Exception:
             log.exception("Exception starting instance kwargs=%r: ", kwargs)
 
     """
-        Methods below require minimum 1 or 2 keyword parameter (service and instance_id).
+        Methods below require minimum 1 or 2 keyword parameter (service and instance_id, optionally name).
     """
 
     def setup(self, **kwargs):
@@ -92,15 +95,20 @@ class Syncer:
         try:
             # clean kwargs before passing this on
             chosen_service = kwargs['service']
+            chosen_name = kwargs.pop('name', None)
             del kwargs['service']
 
             for syncer in self.services:
                 if chosen_service and syncer.NAME.lower() != chosen_service:
                     continue
+                # syncers run side by side, never hand the call to a different syncer of the same service
+                if chosen_name and syncer.syncer_name != chosen_name:
+                    continue
                 # ignore syncer if instance_id does not match otherwise setup all syncers from service
                 if 'instance_id' in kwargs and syncer.instance_id != kwargs['instance_id']:
                     continue
-                return syncer.setup(**kwargs)
+                with trace.span('syncer setup', syncer=syncer.syncer_name):
+                    return syncer.setup(**kwargs)
         except Exception:
             log.exception("Exception setting up instance kwargs=%r: ", kwargs)
 
@@ -112,15 +120,21 @@ class Syncer:
         try:
             # clean kwargs before passing this on
             chosen_service = kwargs['service']
+            chosen_name = kwargs.pop('name', None)
             del kwargs['service']
 
             for syncer in self.services:
                 if chosen_service and syncer.NAME.lower() != chosen_service:
                     continue
+                # syncers run side by side, never hand the call to a different syncer of the same service
+                if chosen_name and syncer.syncer_name != chosen_name:
+                    continue
                 # ignore syncer if instance_id does not match otherwise destroy all syncers from service
                 if 'instance_id' in kwargs and syncer.instance_id != kwargs['instance_id']:
                     continue
-                return syncer.destroy(**kwargs)
+                # instance_id only picks the syncer, the services destroy their own instance
+                with trace.span('syncer destroy', syncer=syncer.syncer_name):
+                    return syncer.destroy()
         except Exception:
             log.exception("Exception destroying instance kwargs=%r: ", kwargs)
 
@@ -132,14 +146,19 @@ class Syncer:
         try:
             # clean kwargs before passing this on
             chosen_service = kwargs['service']
+            chosen_name = kwargs.pop('name', None)
             del kwargs['service']
 
             for syncer in self.services:
                 if chosen_service and syncer.NAME.lower() != chosen_service:
                     continue
+                # syncers run side by side, never hand the call to a different syncer of the same service
+                if chosen_name and syncer.syncer_name != chosen_name:
+                    continue
                 # ignore syncer if instance_id does not match otherwise destroy all syncers from service
                 if 'instance_id' in kwargs and syncer.instance_id != kwargs['instance_id']:
                     continue
-                return syncer.sync(**kwargs)
+                with trace.span('syncer sync', syncer=syncer.syncer_name):
+                    return syncer.sync(**kwargs)
         except Exception:
             log.exception("Exception syncing instance kwargs=%r: ", kwargs)
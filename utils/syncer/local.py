@@ -23,7 +23,7 @@ class Local:
         self.rclone_config_path = None
         self.syncer_name = kwargs.get('syncer_name', 'Unknown Syncer')
 
-        log.info(f"Initialized Local syncer agent for {self.syncer_name} - {self.sync_from_config['sync_remote']} -> {self.sync_to_config['sync_remote']} using tool: {self.tool_path}")
+        log.info(f"Initialized Local syncer agent for {self.syncer_name} - {self.sync_from_config.sync_remote} -> {self.sync_to_config.sync_remote} using tool: {self.tool_path}")
         return
 
     def startup(self, **kwargs):
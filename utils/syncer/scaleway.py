@@ -1,7 +1,8 @@
+import concurrent.futures
 import logging
 import time
 
-from utils import process
+from utils import misc, process
 from utils.rclone import RcloneSyncer
 
 try:
@@ -11,6 +12,14 @@ except ImportError:
 
 log = logging.getLogger("scaleway")
 
+# the instance is probed with uname until it answers, waiting longer after every failed probe up to the maximum
+PROBE_DELAY = 5
+PROBE_MAX_DELAY = 30
+# a single probe, ssh handshake included
+PROBE_TIMEOUT = 60
+# default for the boot_timeout syncer setting, in seconds
+BOOT_TIMEOUT = 600
+
 
 class Scaleway:
     NAME = 'Scaleway'
@@ -30,9 +39,15 @@ class Scaleway:
         self.image = kwargs.get('image', 'ubuntu-xenial')
         # parse instance_destroy from kwargs (default True)
         self.instance_destroy = kwargs.get('instance_destroy', True)
+        # parse boot_timeout from kwargs (default 10 minutes)
+        self.boot_timeout = kwargs.get('boot_timeout', BOOT_TIMEOUT)
         self.syncer_name = kwargs.get('syncer_name', 'Unknown Syncer')
+        # incremental syncs hand rclone a local file list, the instance cannot read it
+        if kwargs.get('incremental', False):
+            log.warning(f"Incremental sync is only supported by local syncers, {self.syncer_name} will run full syncs")
+            self.kwargs['incremental'] = False
 
-        log.info(f"Initialized Scaleway syncer agent for {self.syncer_name} - {self.sync_from_config['sync_remote']} -> {self.sync_to_config['sync_remote']} using tool: {self.tool_path}")
+        log.info(f"Initialized Scaleway syncer agent for {self.syncer_name} - {self.sync_from_config.sync_remote} -> {self.sync_to_config.sync_remote} using tool: {self.tool_path}")
         return
 
     def startup(self, **kwargs):
@@ -72,19 +87,35 @@ class Scaleway:
 
         # wait for instance to finish booting
         log.info("Waiting for instance to finish booting...")
-        time.sleep(60)
-        cmd = f"{cmd_quote(self.tool_path)} --region={cmd_quote(self.region)} exec -w {cmd_quote(self.instance_id)} {cmd_quote('uname -a')}"
+        if not self.wait_until_ready(self.boot_timeout):
+            self.destroy()
+            return False, self.instance_id
+        return True, self.instance_id
 
+    def wait_until_ready(self, timeout):
+        """ probe the instance until it runs commands, backing off between probes, False once timeout has passed """
+        cmd = self._wrap_command('uname -a')
         log.debug(f"Using: {cmd}")
 
-        resp = process.popen(cmd)
-        if not resp or 'gnu/linux' not in resp.lower():
-            log.error(f"Unexpected response while waiting for instance to boot: {resp}")
-            self.destroy()
-            return False, self.instance_id
+        started = time.time()
+        delay = PROBE_DELAY
+        probes = 0
+        while True:
+            probes += 1
+            remaining = timeout - (time.time() - started)
+            resp = process.popen(cmd, timeout=max(min(PROBE_TIMEOUT, remaining), 1), quiet=True)
+            if resp and 'gnu/linux' in resp.lower():
+                log.info(f"Instance has finished booting after {misc.seconds_to_string(time.time() - started)} and {probes} probe(s), uname: {resp}")
+                return True
+
+            remaining = timeout - (time.time() - started)
+            if remaining <= 0:
+                log.error(f"Instance {self.instance_id} did not finish booting within {timeout} seconds, last response: {resp}")
+                return False
 
-        log.info(f"Instance has finished booting, uname: {resp}")
-        return True, self.instance_id
+            log.debug(f"Instance {self.instance_id} is not ready yet, probing again in {min(delay, remaining):.0f} seconds")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, PROBE_MAX_DELAY)
 
     def start_instance(self, cmd, arg1):
         log.debug(f"Using: {cmd}")
@@ -97,56 +128,20 @@ class Scaleway:
             log.error("Setup was called, but no instance_id was found, aborting...")
             return False
         if 'rclone_config' not in kwargs:
-            log.error("Setup was called, but no rclone_config was found, aborting...")
-            self.destroy()
-            return False
-
-        # install unzip
-        cmd_exec = "apt-get -qq update && apt-get -y -qq install unzip && which unzip"
-        cmd = f"{cmd_quote(self.tool_path)} --region={cmd_quote(self.region)} exec {cmd_quote(self.instance_id)} {cmd_quote(cmd_exec)}"
-
-        log.debug(f"Using: {cmd}")
-
-        log.debug(f"Installing rclone to instance: {self.instance_id}")
-        resp = process.popen(cmd)
-        if not resp or '/usr/bin/unzip' not in resp.lower():
-            return self.error_handling(f"Unexpected response while installing unzip: {resp}")
+            return self.error_handling("Setup was called, but no rclone_config was found, aborting...")
 
-        log.info("Installed unzip")
-
-        # install rclone to instance
-        cmd_exec = "cd ~ && curl -sO https://downloads.rclone.org/rclone-current-linux-amd64.zip && " \
-                   "unzip -oq rclone-current-linux-amd64.zip && cd rclone-*-linux-amd64 && " \
-                   "cp -rf rclone /usr/bin/ && cd ~ && rm -rf rclone-* && chown root:root /usr/bin/rclone && " \
-                   "chmod 755 /usr/bin/rclone && mkdir -p /root/.config/rclone && which rclone"
-        cmd = f"{cmd_quote(self.tool_path)} --region={cmd_quote(self.region)} exec {cmd_quote(self.instance_id)} {cmd_quote(cmd_exec)}"
-
-        log.debug(f"Using: {cmd}")
-
-        log.debug(f"Installing rclone to instance: {self.instance_id}")
-        resp = process.popen(cmd)
-        if not resp or '/usr/bin/rclone' not in resp.lower():
-            return self.error_handling(f"Unexpected response while installing rclone: {resp}")
-
-        log.info("Installed rclone")
-
-        # copy rclone.conf to instance
-        cmd = f"{cmd_quote(self.tool_path)} --region={cmd_quote(self.region)} cp {cmd_quote(kwargs['rclone_config'])} {cmd_quote(self.instance_id)}:/root/.config/rclone/"
-
-        log.debug(f"Using: {cmd}")
-
-        log.debug(f"Copying rclone config {kwargs['rclone_config']} to instance: {self.instance_id}")
-        resp = process.popen(cmd)
-        if resp is None or len(resp) >= 2:
-            return self.error_handling(f"Unexpected response while copying rclone config: {resp}")
-
-        log.info("Copied across rclone.conf")
+        # installing rclone and copying its config across do not depend on each other
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='scaleway-setup') as executor:
+            steps = [executor.submit(self.__install_rclone),
+                     executor.submit(self.__copy_config, kwargs['rclone_config'])]
+            if not all(step.result() for step in steps):
+                return self.error_handling(f"Failed to setup instance: {self.instance_id}")
 
         log.info(f"Successfully setup instance: {self.instance_id}")
         return True
 
-    def error_handling(self, arg0, resp):
-        log.error(arg0, resp)
+    def error_handling(self, message):
+        log.error(message)
         self.destroy()
         return False
 
@@ -221,3 +216,54 @@ class Scaleway:
 
     def _wrap_command(self, command):
         return f"{cmd_quote(self.tool_path)} --region={cmd_quote(self.region)} exec {cmd_quote(self.instance_id)} {cmd_quote(command)}"
+
+    def __install_rclone(self):
+        # install unzip
+        cmd = self._wrap_command("apt-get -qq update && apt-get -y -qq install unzip && which unzip")
+        log.debug(f"Using: {cmd}")
+
+        log.debug(f"Installing unzip to instance: {self.instance_id}")
+        resp = process.popen(cmd)
+        if not resp or '/usr/bin/unzip' not in resp.lower():
+            log.error(f"Unexpected response while installing unzip: {resp}")
+            return False
+
+        log.info("Installed unzip")
+
+        # install rclone to instance
+        cmd = self._wrap_command("cd ~ && curl -sO https://downloads.rclone.org/rclone-current-linux-amd64.zip && "
+                                 "unzip -oq rclone-current-linux-amd64.zip && cd rclone-*-linux-amd64 && "
+                                 "cp -rf rclone /usr/bin/ && cd ~ && rm -rf rclone-* && chown root:root /usr/bin/rclone && "
+                                 "chmod 755 /usr/bin/rclone && which rclone")
+        log.debug(f"Using: {cmd}")
+
+        log.debug(f"Installing rclone to instance: {self.instance_id}")
+        resp = process.popen(cmd)
+        if not resp or '/usr/bin/rclone' not in resp.lower():
+            log.error(f"Unexpected response while installing rclone: {resp}")
+            return False
+
+        log.info("Installed rclone")
+        return True
+
+    def __copy_config(self, rclone_config):
+        # create the config folder, the rclone install no longer runs first
+        cmd = self._wrap_command("mkdir -p /root/.config/rclone")
+        log.debug(f"Using: {cmd}")
+
+        if process.popen(cmd) is None:
+            log.error(f"Failed creating the rclone config folder on instance: {self.instance_id}")
+            return False
+
+        # copy rclone.conf to instance
+        cmd = f"{cmd_quote(self.tool_path)} --region={cmd_quote(self.region)} cp {cmd_quote(rclone_config)} {cmd_quote(self.instance_id)}:/root/.config/rclone/"
+        log.debug(f"Using: {cmd}")
+
+        log.debug(f"Copying rclone config {rclone_config} to instance: {self.instance_id}")
+        resp = process.popen(cmd)
+        if resp is None or len(resp) >= 2:
+            log.error(f"Unexpected response while copying rclone config: {resp}")
+            return False
+
+        log.info("Copied across rclone.conf")
+        return True
@@ -0,0 +1,182 @@
+import cProfile
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+log = logging.getLogger('trace')
+
+# oldest spans are dropped past this, run mode would otherwise grow the trace forever
+MAX_SPANS = 100000
+FORMATS = ('chrome', 'json')
+
+
+class Span:
+    __slots__ = ('id', 'parent', 'name', 'start', 'duration', 'thread', 'thread_name', 'attrs')
+
+    def __init__(self, span_id, parent, name, attrs):
+        thread = threading.current_thread()
+        self.id = span_id
+        self.parent = parent
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.thread = thread.ident
+        self.thread_name = thread.name
+        self.attrs = attrs
+
+    def to_dict(self):
+        return {'name': self.name, 'start': self.start, 'duration': self.duration, 'thread': self.thread_name,
+                'attrs': self.attrs}
+
+
+class Tracer:
+    """ nested timing spans per thread, written out as json or a chrome trace whenever a top level span ends """
+
+    def __init__(self):
+        self.path = None
+        self.format = 'chrome'
+        self.profile_folder = None
+        self.pid = os.getpid()
+        self.spans = deque(maxlen=MAX_SPANS)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+
+    def configure(self, path=None, fmt=None, profile_folder=None):
+        self.path = path or None
+        self.format = fmt or 'chrome'
+        if self.format not in FORMATS:
+            log.warning(f"Unknown trace format {self.format!r}, writing a chrome trace instead")
+            self.format = 'chrome'
+        self.profile_folder = profile_folder or None
+        if self.profile_folder and not os.path.exists(self.profile_folder):
+            os.makedirs(self.profile_folder, exist_ok=True)
+            log.info(f"Created profile folder: {self.profile_folder}")
+        if self.path:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.exists(folder):
+                os.makedirs(folder, exist_ok=True)
+            log.info(f"Writing {self.format} trace of every job to {self.path}")
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if self.path is None:
+            yield None
+            return
+
+        stack = self.__stack()
+        span = Span(next(self.ids), stack[-1] if stack else None, name, attrs)
+        stack.append(span.id)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - started
+            stack.pop()
+            with self.lock:
+                self.spans.append(span)
+            if not stack:
+                self.flush()
+
+    def flush(self):
+        if self.path is None:
+            return
+        with self.lock:
+            spans = list(self.spans)
+
+        # a forked child (the remote syncers) writes next to the parent rather than over it
+        target = self.path
+        if os.getpid() != self.pid:
+            root, ext = os.path.splitext(self.path)
+            target = f'{root}-{os.getpid()}{ext}'
+
+        try:
+            data = self.__chrome(spans) if self.format == 'chrome' else self.__tree(spans)
+            with open(f'{target}.tmp', 'w') as fp:
+                json.dump(data, fp)
+            os.replace(f'{target}.tmp', target)
+        except Exception:
+            log.exception(f"Exception writing trace to {target}: ")
+
+    @contextmanager
+    def profile(self, name):
+        if self.profile_folder is None:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # only one profiler can be active at a time
+            log.warning(f"Not profiling {name}, another profile is already running")
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profiler.disable()
+            target = os.path.join(self.profile_folder,
+                                  f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+            try:
+                profiler.dump_stats(target)
+                log.info(f"Wrote profile of {name} to {target}")
+            except Exception:
+                log.exception(f"Exception writing profile of {name} to {target}: ")
+
+    # internals
+    def __stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def __chrome(self, spans):
+        events = []
+        threads = {}
+        for span in spans:
+            threads[span.thread] = span.thread_name
+            events.append({'name': span.name, 'cat': 'cloudplow', 'ph': 'X', 'pid': os.getpid(),
+                           'tid': span.thread, 'ts': int(span.start * 1000000),
+                           'dur': int(span.duration * 1000000), 'args': span.attrs})
+        for thread, thread_name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread,
+                           'args': {'name': thread_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    @staticmethod
+    def __tree(spans):
+        nodes = {span.id: dict(span.to_dict(), children=[]) for span in spans}
+        roots = []
+        # spans are stored as they end, children before their parents, order everything by start
+        for span in sorted(spans, key=lambda item: item.start):
+            parent = nodes.get(span.parent)
+            (parent['children'] if parent else roots).append(nodes[span.id])
+        return {'spans': roots}
+
+
+tracer = Tracer()
+span = tracer.span
+profile = tracer.profile
+
+
+def traced(name=None):
+    """ decorator, runs the function in a span named after it """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name or func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
@@ -1,121 +1,163 @@
 import concurrent.futures
+import itertools
 import logging
+import os
 
 from . import path
 from .rclone import RcloneUploader
 
 log = logging.getLogger('unionfs')
 
+HIDDEN_SUFFIX = '_HIDDEN~'
+# whiteouts are cleaned this many at a time, memory stays flat however many there are
+BATCH_SIZE = 500
+
 
 class UnionfsHiddenFolder:
-    def __init__(self, hidden_folder, dry_run, rclone_binary_path, rclone_config_path):
+    """ deletes what the unionfs-fuse whiteouts (_HIDDEN~) of a folder hide from its remotes
+
+    Whiteouts are streamed from a single walk of the folder, deepest first, and cleaned from every remote a batch at a
+    time. A whiteout is removed from disk as soon as every remote confirmed its delete, the remotes that did are
+    recorded in progress until then, so an interrupted clean resumes where it stopped instead of deleting again.
+    """
+
+    def __init__(self, hidden_folder, dry_run, rclone_binary_path, rclone_config_path, listing=None, progress=None):
         self.unionfs_fuse = hidden_folder
         self.dry_run = dry_run
-        self.hidden_files = self.__files()
-        self.hidden_folders = self.__folders()
         self.rclone_binary_path = rclone_binary_path
         self.rclone_config_path = rclone_config_path
+        # cached remote listings, hiddens that are not on a remote are skipped without a delete
+        self.listing = listing
+        # whiteout -> names of the remotes it was cleaned from
+        self.progress = progress if progress is not None else {}
 
-    def clean_remote(self, name, remote):
+    def clean(self, remotes):
         """
-        Delete hidden_files and hidden_folders from remote
+        Delete everything hidden in the folder from the remotes
 
-        :param name: name of the rclone remote
-        :param remote: rclone remote item from config.json
-        :return: True or False based on whether clean was successful
+        :param remotes: compiled RemoteConfigs of the rclone remotes to clean
+        :return: remote name -> [deleted, failed, not found]
         """
-        delete_success = 0
-        delete_failed = 0
+        results = {remote.name: [0, 0, 0] for remote in remotes}
+        rclones = {remote.name: RcloneUploader(remote.name, remote, self.rclone_binary_path,
+                                               self.rclone_config_path, self.dry_run) for remote in remotes}
+        found = removed = 0
 
         try:
-            rclone = RcloneUploader(name, remote, self.rclone_binary_path, self.rclone_config_path, self.dry_run)
-            # clean hidden files from remote using threadpool
-            if self.hidden_files:
-                with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
-                    log.info(f"Cleaning {len(self.hidden_files)} hidden file(s) from remote: {name}")
-                    future_to_remote_file = {}
-                    for hidden_file in self.hidden_files:
-                        remote_file = self.__hidden2remote(remote, hidden_file)
-                        if remote_file:
-                            future_to_remote_file[executor.submit(rclone.delete_file, remote_file)] = remote_file
-                        else:
-                            log.error(f"Failed mapping file '{hidden_file}' to a remote file")
-                            delete_failed += 1
-
-                    for future in concurrent.futures.as_completed(future_to_remote_file):
-                        remote_file = future_to_remote_file[future]
-                        try:
-                            if future.result():
-                                log.info(f"Removed file '{remote_file}'")
-                                delete_success += 1
-                            else:
-                                log.error(f"Failed removing file '{remote_file}'")
-                                delete_failed += 1
-                        except Exception:
-                            log.exception("Exception processing result from rclone delete file future for '{remote_file}': ")
-                            delete_failed += 1
-
-            # clean hidden folders from remote
-            if self.hidden_folders:
-                log.info(f"Cleaning {len(self.hidden_folders)} hidden folder(s) from remote: {name}")
-                for hidden_folder in self.hidden_folders:
-                    remote_folder = self.__hidden2remote(remote, hidden_folder)
-                    if remote_folder and rclone.delete_folder(remote_folder):
-                        log.info(f"Removed folder '{remote_folder}'")
-                        delete_success += 1
-                    else:
-                        log.error(f"Failed removing folder '{remote_folder}'")
-                        delete_failed += 1
-
-            if self.hidden_folders or self.hidden_files:
-                log.info(f"Completed cleaning hidden(s) from remote: {name}")
-                log.info(f"{delete_success} items were deleted, {delete_failed} items failed to delete")
-
-            return True, delete_success, delete_failed
-
+            whiteouts = self.whiteouts()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+                while True:
+                    batch = list(itertools.islice(whiteouts, BATCH_SIZE))
+                    if not batch:
+                        break
+                    found += len(batch)
+                    confirmed = {whiteout: set(self.progress.get(whiteout, ())) for whiteout, _ in batch}
+                    for remote in remotes:
+                        self.__clean_batch(executor, rclones[remote.name], remote, batch, confirmed,
+                                           results[remote.name])
+                    removed += self.__finish_batch(remotes, batch, confirmed)
+
+            self.__prune_progress()
         except Exception:
             log.exception(f"Exception cleaning hidden(s) from {self.unionfs_fuse}: ")
 
-        return False, delete_success, delete_failed
-
-    def remove_local_hidden(self):
-        if len(self.hidden_files):
-            path.delete(self.hidden_files)
-            log.info(f"Removed {len(self.hidden_files)} local hidden file(s) from disk")
-        if len(self.hidden_folders):
-            path.delete(self.hidden_folders)
-            log.info(f"Removed {len(self.hidden_folders)} local hidden folder(s) from disk")
-        return
-
-    def remove_empty_dirs(self):
-        path.remove_empty_dirs(self.unionfs_fuse, 1)
-        log.info(f"Removed empty directories from '{self.unionfs_fuse}'")
+        log.info(f"Found {found} hidden(s) in {self.unionfs_fuse}, {removed} were cleaned from every remote and "
+                 f"removed from disk")
+        for name, (deleted, failed, not_found) in results.items():
+            log.info(f"{deleted} items were deleted from remote {name}, {failed} items failed to delete"
+                     f"{f', {not_found} items were not on the remote' if not_found else ''}")
+        return results
+
+    def whiteouts(self):
+        """ (whiteout, is_folder) of every _HIDDEN~ file and folder, the contents of a folder before the folder """
+        for folder, subdirs, files in os.walk(self.unionfs_fuse, topdown=False):
+            for name in files:
+                if name.endswith(HIDDEN_SUFFIX):
+                    yield os.path.join(folder, name), False
+            for name in subdirs:
+                if name.endswith(HIDDEN_SUFFIX):
+                    yield os.path.join(folder, name), True
 
     # internals
-    def __files(self):
-        hidden_files = []
+    def __clean_batch(self, executor, rclone, remote, batch, confirmed, counts):
+        pending = [(whiteout, self.__hidden2remote(remote, whiteout), is_folder) for whiteout, is_folder in batch
+                   if remote.name not in confirmed[whiteout]]
+        futures = {executor.submit(self.__delete_file, rclone, remote_path): (whiteout, remote_path)
+                   for whiteout, remote_path, is_folder in pending if not is_folder}
+        for future in concurrent.futures.as_completed(futures):
+            self.__count(future.result, remote.name, *futures[future], confirmed, counts)
+
+        # folders are emptied on the remote by the files before them, and removed one at a time in walk order
+        for whiteout, remote_path, is_folder in pending:
+            if is_folder:
+                self.__count(lambda: self.__delete_folder(rclone, remote_path), remote.name, whiteout, remote_path,
+                             confirmed, counts)
+
+    @staticmethod
+    def __count(delete, name, whiteout, remote_path, confirmed, counts):
         try:
-            hidden_files = path.find_items(self.unionfs_fuse, '_HIDDEN~')
-            log.info(f"Found {len(hidden_files)} hidden files in {self.unionfs_fuse}")
+            deleted = delete()
         except Exception:
-            log.exception(f"Exception finding hidden files for {self.unionfs_fuse}: ")
-            hidden_files = None
-        return hidden_files
-
-    def __folders(self):
-        try:
-            hidden_folders = path.find_items(self.unionfs_fuse, '_HIDDEN~')
-            log.info(f"Found {len(hidden_folders)} hidden folders in {self.unionfs_fuse}")
-        except Exception:
-            log.exception(f"Exception finding hidden folders for {self.unionfs_fuse}: ")
-            hidden_folders = None
-        return hidden_folders
+            log.exception(f"Exception removing '{remote_path}' from remote {name}: ")
+            deleted = False
+
+        if deleted is None:
+            log.debug(f"Skipped '{remote_path}', it is not on the remote")
+            counts[2] += 1
+        elif deleted:
+            log.info(f"Removed '{remote_path}'")
+            counts[0] += 1
+        else:
+            log.error(f"Failed removing '{remote_path}'")
+            counts[1] += 1
+            return
+        confirmed[whiteout].add(name)
+
+    def __finish_batch(self, remotes, batch, confirmed):
+        if self.dry_run:
+            return 0
+
+        names = {remote.name for remote in remotes}
+        done = []
+        for whiteout, _ in batch:
+            if names <= confirmed[whiteout]:
+                done.append(whiteout)
+                self.progress.pop(whiteout, None)
+            elif confirmed[whiteout]:
+                # retried on the next clean, only on the remotes that have not confirmed it
+                self.progress[whiteout] = sorted(confirmed[whiteout])
+
+        path.delete(done)
+        # only the folders that held these whiteouts can have been emptied
+        path.remove_empty_parents(self.unionfs_fuse, {os.path.dirname(os.path.relpath(whiteout, self.unionfs_fuse))
+                                                      for whiteout in done}, 1)
+        return len(done)
+
+    def __prune_progress(self):
+        # whiteouts removed by hand, or under a folder that is no longer cleaned, would be kept forever
+        folder = os.path.join(self.unionfs_fuse, '')
+        for whiteout in [item for item in self.progress.keys() if item.startswith(folder)]:
+            if not os.path.lexists(whiteout):
+                self.progress.pop(whiteout, None)
+
+    def __delete_file(self, rclone, remote_file):
+        """ True or False for the delete, None when the cached listing says there is nothing to delete """
+        if self.listing is not None and self.listing.exists(remote_file) is False:
+            return None
+        deleted = rclone.delete_file(remote_file)
+        if deleted and self.listing is not None and not self.dry_run:
+            self.listing.removed(remote_file)
+        return deleted
+
+    def __delete_folder(self, rclone, remote_folder):
+        if self.listing is not None and self.listing.exists(remote_folder) is False:
+            return None
+        deleted = rclone.delete_folder(remote_folder)
+        if deleted and self.listing is not None and not self.dry_run:
+            self.listing.removed(remote_folder)
+        return deleted
 
     def __hidden2remote(self, remote, hidden_path):
-        try:
-            remote_path = hidden_path.replace(self.unionfs_fuse, remote['hidden_remote']).rstrip('_HIDDEN~')
-            log.debug(f"Mapped '{hidden_path}' to '{remote_path}'")
-            return remote_path
-        except Exception:
-            log.exception(f"Exception mapping hidden file '{hidden_path}' to its rclone remote path")
-        return None
+        remote_path = hidden_path.replace(self.unionfs_fuse, remote.hidden_remote, 1)[:-len(HIDDEN_SUFFIX)]
+        log.debug(f"Mapped '{hidden_path}' to '{remote_path}'")
+        return remote_path
@@ -1,59 +1,166 @@
-import logging
 import glob
-import time
+import json
+import logging
+import os
+import re
 
 from . import path
+from .ledger import join_remote
 from .rclone import RcloneUploader
 
 log = logging.getLogger("uploader")
 
+# "2024/01/01 19:01:48 INFO  : Movies/Movie (2019)/Movie.mkv: Copied (new)"
+TRANSFER_LINE = re.compile(r'\bINFO\s*:\s*(?P<object>.+): (?P<msg>Copied \(|Moved \(|Deleted$)')
+TRANSFER_MESSAGES = ('Copied (', 'Moved (', 'Deleted')
+# the ledger tells files apart by name and size only, enough for media but not for artwork, subtitles and the like
+DUPLICATE_MIN_SIZE = 10 * 1024 ** 2
+# remotes keep modification times to the millisecond or second, closer than this is the same time
+MTIME_TOLERANCE = 1
+
+
+def _same_mtime(first, second):
+    return first is not None and second is not None and abs(first - second) < MTIME_TOLERANCE
+
+
+class TransferLog:
+    """ files rclone reported as transferred and their folders, parsed from its INFO output as it runs """
+
+    def __init__(self):
+        self.folders = set()
+        self.files = set()
+        self.taken = set()
+
+    def wrap(self, callback):
+        def check(data):
+            self.add(data)
+            return callback(data)
+
+        return check
+
+    def add(self, line):
+        if line.startswith('{'):
+            # --use-json-log
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                return
+            if entry.get('object') and str(entry.get('msg', '')).startswith(TRANSFER_MESSAGES):
+                self.__record(entry['object'], str(entry['msg']))
+            return
+
+        match = TRANSFER_LINE.search(line)
+        if match:
+            self.__record(match.group('object'), match.group('msg'))
+
+    def add_file(self, item):
+        """ a file that reached the remote without rclone transferring it """
+        self.__record(item, 'Copied')
+
+    def take(self):
+        """ the files transferred since the last take """
+        files = self.files - self.taken
+        self.taken |= files
+        return sorted(files)
+
+    # internals
+    def __record(self, item, msg):
+        self.folders.add(os.path.dirname(item))
+        # the source side of a move is deleted right after it was copied, only the copy is a new file
+        if not msg.startswith('Deleted'):
+            self.files.add(item)
+
 
 class Uploader:
-    def __init__(self, name, uploader_config, rclone_config, rclone_binary_path, rclone_config_path, plex, dry_run):
-        self.name = name
-        self.uploader_config = uploader_config
-        self.rclone_config = rclone_config
-        self.trigger_tracks = {}
+    def __init__(self, config, rclone_binary_path, rclone_config_path, dry_run, ledger=None, listing=None,
+                 leases=None):
+        self.name = config.name
+        self.config = config
+        self.remote = config.remote
         self.delayed_check = 0
         self.delayed_trigger = ""
         self.rclone_binary_path = rclone_binary_path
         self.rclone_config_path = rclone_config_path
-        self.plex = plex
         self.dry_run = dry_run
         self.service_account = None
+        # the accounts a trigger may switch the running rclone to, and those it switched away from with their delay
+        self.spare_accounts = []
+        self.swapped = []
+        # kept across service account rotations, everything any of the runs moved is pruned afterwards
+        self.transferred = TransferLog()
+        self.ledger = ledger
+        self.listing = listing
+        # service accounts shared with other hosts, the accounts switched to are leased and their usage published
+        self.leases = leases
+        # set when a trigger stopped the last upload, the next service account only gets the files it left
+        self.carry_over = False
 
-    def set_service_account(self, sa_file):
+    def set_service_account(self, sa_file, spares=()):
         self.service_account = sa_file
+        self.spare_accounts = list(spares) if self.config.hot_swap_service_accounts else []
         log.info(f"Using service account: {sa_file}")
 
     def upload(self):
-        rclone_config = self.rclone_config.copy()
+        excludes = []
+        files_to_exclude = []
 
         # should we exclude open files
-        if self.uploader_config['exclude_open_files']:
+        if self.config.exclude_open_files:
             files_to_exclude = self.__opened_files()
             if len(files_to_exclude):
                 log.info(f"Excluding these files from being uploaded because they were open: {files_to_exclude}")
-                # add files_to_exclude to rclone_config
-                for item in files_to_exclude:
-                    rclone_config['rclone_excludes'].append(glob.escape(item))
+                excludes = [glob.escape(item) for item in files_to_exclude]
 
         # do upload
-        if self.service_account is not None:
-            rclone = RcloneUploader(self.name, rclone_config, self.rclone_binary_path, self.rclone_config_path,
-                                    self.plex, self.dry_run, self.service_account)
-        else:
-            rclone = RcloneUploader(self.name, rclone_config, self.rclone_binary_path, self.rclone_config_path,
-                                    self.plex, self.dry_run)
+        rclone = RcloneUploader(self.name, self.remote, self.rclone_binary_path, self.rclone_config_path,
+                                self.dry_run, self.service_account, excludes,
+                                schedule=self.config.bandwidth_schedule)
+
+        # copies stay in the upload folder, only rclone's transfer log tells what the last account already copied
+        carry_over = self.carry_over and (self.remote.rclone_command == 'move' or self.remote.logs_transfers)
+        self.carry_over = False
+
+        # the upload folder as it was before the upload, only for what cannot tell from rclone's transfers
+        scanned = self.__scan() if self.__needs_scan(carry_over) else {}
+        opened = {item.lstrip('/') for item in files_to_exclude}
+        if scanned and self.config.skip_duplicates:
+            rclone.excludes = [*excludes, *self.__skip_duplicates(rclone, scanned, opened)]
+        transferred_before = set(self.transferred.files)
 
-        log.info(f"Uploading '{rclone_config['upload_folder']}' to remote: {self.name}")
         self.delayed_check = 0
-        self.trigger_tracks = {}
+        self.delayed_trigger = ""
+        if carry_over:
+            rclone.files = self.__remaining(scanned, opened)
+            if not rclone.files:
+                log.info(f"Nothing left to upload to remote: {self.name}")
+                return self.delayed_check, self.delayed_trigger, True
+            log.info(f"Uploading the {len(rclone.files)} file(s) left by the previous service account to remote: "
+                     f"{self.name}")
+        else:
+            log.info(f"Uploading '{self.remote.upload_folder}' to remote: {self.name}")
+        triggers = self.remote.triggers.tracker()
         success = False
-        upload_status, return_code = rclone.upload(self.__logic)
+        self.swapped = []
+        upload_status, return_code = rclone.upload(self.transferred.wrap(triggers.check),
+                                                   (lambda job: self.__swap(rclone, job, triggers))
+                                                   if self.spare_accounts else None)
 
         log.debug("return_code is: %s", return_code)
 
+        uploaded = None
+        if (self.ledger is not None or self.leases is not None) and not self.dry_run:
+            uploaded = self.__uploaded(rclone, scanned, transferred_before)
+        if self.ledger is not None and uploaded:
+            self.__record(uploaded)
+        if self.leases is not None and uploaded and self.service_account is not None:
+            self.leases.add_usage(self.service_account, sum(item['size'] for item in uploaded.values()))
+        if self.listing is not None and not self.dry_run:
+            self.__update_listing(uploaded or scanned, transferred_before)
+
+        if triggers.tripped:
+            self.delayed_check = triggers.delayed_check
+            self.delayed_trigger = triggers.delayed_trigger
+
         if return_code == 7:
             success = True
             log.info("Received 'Max Transfer Reached' signal from Rclone.")
@@ -74,56 +181,195 @@ class Uploader:
         else:
             self.delayed_trigger = f"Unhandled situation: Exit code: {return_code} - Upload Status: {upload_status}"
 
+        self.carry_over = bool(self.delayed_check)
         return self.delayed_check, self.delayed_trigger, success
 
     def remove_empty_dirs(self):
-        path.remove_empty_dirs(self.rclone_config['upload_folder'], self.rclone_config['remove_empty_dir_depth'])
-        log.info(f"Removed empty directories from '{self.rclone_config['upload_folder']}' with min depth: {self.rclone_config['remove_empty_dir_depth']}")
+        if not self.remote.logs_transfers:
+            # rclone is not printing the files it moves, walk the whole upload folder instead
+            path.remove_empty_dirs(self.remote.upload_folder, self.remote.remove_empty_dir_depth)
+            log.info(f"Removed empty directories from '{self.remote.upload_folder}' with min depth: {self.remote.remove_empty_dir_depth}")
+            return
+
+        removed = path.remove_empty_parents(self.remote.upload_folder, self.transferred.folders,
+                                            self.remote.remove_empty_dir_depth)
+        log.info(f"Removed {removed} empty directories left by the upload from '{self.remote.upload_folder}' with min depth: {self.remote.remove_empty_dir_depth}")
         return
 
     # internals
+    def __swap(self, rclone, job, triggers):
+        """ move the running rclone on to the next service account, the upload carries on where it was """
+        while self.spare_accounts:
+            sa_file = self.spare_accounts.pop(0)
+            if self.leases is None or self.leases.acquire(sa_file):
+                break
+            log.info(f"Service account {sa_file} is in use by another host, skipping it")
+        else:
+            return False
+
+        if not rclone.swap_service_account(job, sa_file):
+            log.warning(f"Could not switch the running upload to service account {sa_file}, restarting it instead")
+            # the restart goes through the same accounts, a switch that failed once is not tried again
+            self.spare_accounts = []
+            if self.leases is not None:
+                self.leases.release(sa_file)
+            return False
+
+        log.info(f"Trigger {triggers.delayed_trigger} was met, switched the running upload from service account "
+                 f"{self.service_account} to {sa_file}")
+        self.swapped.append((self.service_account, triggers.delayed_check, triggers.delayed_trigger))
+        self.service_account = sa_file
+        triggers.reset()
+        return True
+
+    def __account(self):
+        return os.path.basename(self.service_account) if self.service_account else None
+
+    def __needs_scan(self, carry_over):
+        """ whether anything reads the upload folder as it was before the upload """
+        if carry_over or (self.ledger is not None and self.config.skip_duplicates):
+            return True
+        # without the transfer log, what rclone moved is told by what left the upload folder
+        return (self.ledger is not None or self.leases is not None) and not self.remote.logs_transfers and \
+            self.remote.rclone_command == 'move'
+
+    def __scan(self):
+        items = {}
+        for folder, _, names in os.walk(self.remote.upload_folder):
+            for name in names:
+                relative = os.path.relpath(os.path.join(folder, name), self.remote.upload_folder)
+                if self.remote.exclude_matcher.match(relative):
+                    # never uploaded, neither carried over nor recorded when a partial download disappears
+                    continue
+                item = self.__item(relative)
+                if item is not None:
+                    items[relative] = item
+        return items
+
+    def __item(self, relative, size=None, mtime=None):
+        """ the ledger entry of a file in the upload folder, stat'ed unless its size and mtime are given """
+        local_path = os.path.join(os.path.abspath(self.remote.upload_folder), relative)
+        if size is None:
+            try:
+                stat = os.stat(local_path)
+            except OSError:
+                # gone since it was found
+                return None
+            size, mtime = stat.st_size, stat.st_mtime
+        return {'local_path': local_path, 'size': size, 'mtime': mtime, 'hash': path.get_file_hash(local_path, size),
+                'remote_path': join_remote(self.remote.upload_remote, relative)}
+
+    def __remaining(self, scanned, opened):
+        """ the files a rotation hands to the next service account, without listing the remote again """
+        # the scan already left out the rclone_excludes, open files are left out here
+        if self.remote.rclone_command == 'move':
+            # whatever the previous accounts moved is gone from the upload folder
+            return sorted(relative for relative in scanned if relative not in opened)
+        return sorted(relative for relative in scanned
+                      if relative not in opened and relative not in self.transferred.files)
+
+    def __skip_duplicates(self, rclone, scanned, opened):
+        """ skip files uploaded before, or copy them server side from where they went, returns the excludes """
+        candidates = {relative: item for relative, item in scanned.items()
+                      if item['size'] >= DUPLICATE_MIN_SIZE and relative not in opened}
+        previous_uploads = self.ledger.find(item['hash'] for item in candidates.values()) if candidates else {}
+        # server side copies only work within a remote
+        remote_name = self.remote.upload_remote.partition(':')[0]
+
+        matches = {}
+        for relative, item in candidates.items():
+            # a file replaced by another one of the same name and size, like a repack, has a different mtime
+            uploads = [upload for upload in previous_uploads.get(item['hash'], [])
+                       if upload['remote_path'].partition(':')[0] == remote_name and
+                       _same_mtime(upload['mtime'], item['mtime'])]
+            # the same place as before, otherwise the latest copy on this remote
+            previous = next((upload for upload in uploads if upload['remote_path'] == item['remote_path']),
+                            uploads[-1] if uploads else None)
+            if previous is not None:
+                matches[relative] = previous
+
+        # what should still be in place is checked against the remote, all in one listing
+        in_place = [relative for relative, previous in matches.items()
+                    if previous['remote_path'] == scanned[relative]['remote_path']]
+        on_remote = rclone.file_details(in_place) if in_place else {}
+
+        skipped, recorded = [], []
+        for relative, previous in matches.items():
+            item = scanned[relative]
+            if previous['remote_path'] == item['remote_path']:
+                size, mtime = on_remote.get(relative, (None, None))
+                if size != item['size'] or not _same_mtime(mtime, item['mtime']):
+                    # changed or gone on the remote, rclone decides
+                    continue
+                log.info(f"Not uploading '{relative}', it is still on the remote from a previous upload")
+            elif rclone.copy_file(previous['remote_path'], item['remote_path']):
+                log.info(f"Copied '{relative}' on the remote from '{previous['remote_path']}' instead of uploading it")
+            else:
+                continue
+            skipped.append(relative)
+            if (previous['local_path'], previous['remote_path']) != (item['local_path'], item['remote_path']):
+                recorded.append(dict(item, account=self.__account()))
+
+        if not skipped or self.dry_run:
+            return [f'/{glob.escape(relative)}' for relative in skipped]
+
+        self.ledger.record(recorded)
+        excludes = []
+        for relative in skipped:
+            if self.listing is not None:
+                self.listing.added(scanned[relative]['remote_path'], scanned[relative]['size'])
+            del scanned[relative]
+            if self.remote.rclone_command == 'move':
+                # finish the move like rclone would, the empty folders and the mover pick it up from here
+                path.delete(os.path.join(self.remote.upload_folder, relative))
+                self.transferred.add_file(relative)
+            else:
+                excludes.append(f'/{glob.escape(relative)}')
+        log.info(f"Skipped {len(skipped)} file(s) already uploaded to remote: {self.name}")
+        return excludes
+
+    def __uploaded(self, rclone, scanned, transferred_before):
+        """ the files the last rclone uploaded with their ledger entries, None when there is no telling """
+        if self.remote.logs_transfers:
+            transferred = self.transferred.files - transferred_before
+            uploaded = {relative: scanned[relative] for relative in transferred if relative in scanned}
+            unscanned = sorted(transferred - uploaded.keys())
+            if not unscanned:
+                return uploaded
+            if self.remote.rclone_command == 'move':
+                # gone from the upload folder, the remote kept their size and modification time
+                details = rclone.file_details(unscanned)
+                uploaded.update((relative, self.__item(relative, *details[relative]))
+                                for relative in unscanned if relative in details)
+            else:
+                # copies are still in the upload folder
+                uploaded.update((relative, self.__item(relative)) for relative in unscanned)
+            return {relative: item for relative, item in uploaded.items() if item is not None}
+        if self.remote.rclone_command == 'move':
+            # rclone does not report what it moved, everything that left the upload folder went to the remote
+            return {relative: item for relative, item in scanned.items() if not os.path.exists(item['local_path'])}
+        log.debug(f"Not recording the upload to {self.name}, rclone does not report what it copied")
+        return None
+
+    def __record(self, uploaded):
+        recorded = self.ledger.record(dict(item, account=self.__account()) for item in uploaded.values())
+        log.info(f"Recorded {recorded} uploaded file(s) in the ledger")
+
+    def __update_listing(self, known, transferred_before):
+        if not self.remote.logs_transfers:
+            # no telling what arrived, the listings of the upload remote are listed again when next needed
+            self.listing.forget(self.remote.upload_remote)
+            self.listing.added(self.remote.upload_remote, is_dir=True)
+            return
+
+        for relative in self.transferred.files - transferred_before:
+            self.listing.added(join_remote(self.remote.upload_remote, relative),
+                               known[relative]['size'] if relative in known else None)
+
     def __opened_files(self):
-        open_files = path.opened_files(self.rclone_config['upload_folder'])
+        open_files = path.opened_files(self.remote.upload_folder)
         return [
-            item.replace(self.rclone_config['upload_folder'], '')
+            item.replace(self.remote.upload_folder, '')
             for item in open_files
-            if not self.__is_opened_file_excluded(item)
+            if not self.config.is_opened_file_excluded(item)
         ]
-
-    def __is_opened_file_excluded(self, file_path):
-        return any(
-            item.lower() in file_path.lower()
-            for item in self.uploader_config['opened_excludes']
-        )
-
-    def __logic(self, data):
-        # loop sleep triggers
-        for trigger_text, trigger_config in self.rclone_config['rclone_sleeps'].items():
-            # check/reset trigger timeout
-            if (
-                trigger_text in self.trigger_tracks
-                and self.trigger_tracks[trigger_text]['expires'] != ''
-                and time.time() >= self.trigger_tracks[trigger_text]['expires']
-            ):
-                log.warning(f"Tracking of trigger: {trigger_text} has expired, resetting occurrence count and timeout")
-                self.trigger_tracks[trigger_text] = {'count': 0, 'expires': ''}
-
-            # check if trigger_text is in data
-            if trigger_text.lower() in data.lower():
-                # check / increase tracking count of trigger_text
-                if trigger_text not in self.trigger_tracks or self.trigger_tracks[trigger_text]['count'] == 0:
-                    # set initial tracking info for trigger
-                    self.trigger_tracks[trigger_text] = {'count': 1, 'expires': time.time() + trigger_config['timeout']}
-                    log.warning(f"Tracked first occurrence of trigger: {trigger_text}. Expiring in {trigger_config['timeout']} seconds at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.trigger_tracks[trigger_text]['expires']))}")
-                else:
-                    # trigger_text WAS seen before increase count
-                    self.trigger_tracks[trigger_text]['count'] += 1
-                    log.warning(f"Tracked trigger: {trigger_text} has occurred {self.trigger_tracks[trigger_text]['count']}/{trigger_config['count']} times within {trigger_config['timeout']} seconds")
-
-                    # check if trigger_text was found the required amount of times to abort
-                    if self.trigger_tracks[trigger_text]['count'] >= trigger_config['count']:
-                        log.warning(f"Tracked trigger {trigger_text} has reached the maximum limit of {trigger_config['count']} occurrences within {trigger_config['timeout']} seconds, aborting upload...")
-                        self.delayed_check = trigger_config['sleep']
-                        self.delayed_trigger = trigger_text
-                        return True
-        return False
@@ -1,22 +1,30 @@
 import logging
 import os
 import sys
-
-try:
-    from git import Repo
-except ImportError:
-    sys.exit("You are missing the GitPython requirement or executing from the wrong working directory.")
+import time
 
 log = logging.getLogger("git")
 
-repo = Repo.init(os.path.dirname(os.path.realpath(sys.argv[0])))
+repo_path = os.path.dirname(os.path.realpath(sys.argv[0]))
+# only fetch from origin when the last fetch is older than this many seconds
+FETCH_INTERVAL = 6 * 60 * 60
 
+_repo = None
 
-def active_branch():
-    global repo
 
+def get_repo():
+    global _repo
+
+    if _repo is None:
+        # GitPython is slow to import, only pay for it when a version check actually runs
+        from git import Repo
+        _repo = Repo.init(repo_path)
+    return _repo
+
+
+def active_branch():
     try:
-        return repo.active_branch.name
+        return get_repo().active_branch.name
 
     except Exception:
         log.exception("Exception retrieving current branch: ")
@@ -24,9 +32,16 @@ def active_branch():
 
 
 def latest_version():
-    global repo
-
     try:
+        repo = get_repo()
+        fetch_head = os.path.join(repo.git_dir, 'FETCH_HEAD')
+        if os.path.exists(fetch_head) and time.time() - os.path.getmtime(fetch_head) < FETCH_INTERVAL:
+            # fetched recently, use the cached result instead of hitting origin again
+            with open(fetch_head, 'r') as fp:
+                line = fp.readline()
+            if line:
+                return line.split()[0]
+
         fetch_info = repo.remotes.origin.fetch()
         return str(fetch_info[0].commit)
 
@@ -36,10 +51,8 @@ def latest_version():
 
 
 def current_version():
-    global repo
-
     try:
-        result = repo.active_branch.commit
+        result = get_repo().active_branch.commit
         return str(result)
 
     except Exception:
@@ -48,11 +61,10 @@ def current_version():
 
 
 def missing_commits(using_version):
-    global repo
     missing = 0
 
     try:
-        for commit in repo.iter_commits():
+        for commit in get_repo().iter_commits():
             if str(commit) == using_version:
                 break
             missing += 1
@@ -63,6 +75,15 @@ def missing_commits(using_version):
 
 
 def check_version():
+    try:
+        get_repo()
+    except ImportError:
+        log.warning("Unable to check version, you are missing the GitPython requirement")
+        return
+    except Exception:
+        log.exception("Unable to check version, exception opening the git repository: ")
+        return
+
     current = current_version()
     latest = latest_version()
 
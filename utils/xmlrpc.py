@@ -1,25 +1,51 @@
-import socket
 import xmlrpc.client
+from urllib.parse import urlparse
 
-""" referemce: https://stackoverflow.com/a/14397619 """
+""" reference: https://stackoverflow.com/a/14397619 """
+
+
+class TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+
+class TimeoutSafeTransport(xmlrpc.client.SafeTransport):
+    def __init__(self, timeout, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
 
 
 class ServerProxy:
+    """ keeps one XMLRPC proxy (and its keep-alive connection) per url, with a per-connection timeout """
+
     def __init__(self, url, timeout=10):
         self.__url = url
         self.__timeout = timeout
-        self.__prevDefaultTimeout = None
+        self.__proxy = None
 
     def __enter__(self):
-        try:
-            if self.__timeout:
-                self.__prevDefaultTimeout = socket.getdefaulttimeout()
-                socket.setdefaulttimeout(self.__timeout)
-            proxy = xmlrpc.client.ServerProxy(self.__url, allow_none=True)
-        except Exception as ex:
-            raise Exception("Unable create XMLRPC-proxy for url '%s': %s" % (self.__url, ex))
-        return proxy
+        if self.__proxy is None:
+            try:
+                transport = (TimeoutSafeTransport if urlparse(self.__url).scheme == 'https' else TimeoutTransport)(
+                    self.__timeout)
+                self.__proxy = xmlrpc.client.ServerProxy(self.__url, transport=transport, allow_none=True)
+            except Exception as ex:
+                raise Exception("Unable create XMLRPC-proxy for url '%s': %s" % (self.__url, ex))
+        return self.__proxy
 
     def __exit__(self, type, value, traceback):
-        if self.__prevDefaultTimeout is None:
-            socket.setdefaulttimeout(self.__prevDefaultTimeout)
+        if type is not None and self.__proxy is not None:
+            # drop the pooled connection after a failure, the next call reconnects
+            self.__proxy('close')()
+            self.__proxy = None